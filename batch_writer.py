@@ -0,0 +1,168 @@
+# file: batch_writer.py
+
+import time
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
+
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import SQLAlchemyError
+
+from db import insert_ignore
+from metrics import Metrics, NULL_METRICS
+
+logger = logging.getLogger(__name__)
+
+
+class BatchWriter:
+    def __init__(self, db_session: Session,
+                 batch_size: int = 100,
+                 flush_interval: float = 5.0,
+                 metrics: Optional[Metrics] = None):
+        """
+        Write-behind buffer that commits many results in one transaction.
+
+        Writes are queued and flushed once `batch_size` of them are pending
+        or `flush_interval` seconds have passed since the last flush. A crash
+        loses at most the unflushed batch. If a batch fails, it is rolled back
+        and replayed one item per transaction so a single bad row does not
+        take the rest of the batch with it.
+
+        Args:
+            db_session (Session): Active SQLAlchemy session.
+            batch_size (int): Pending writes that trigger a flush.
+            flush_interval (float): Seconds after which a flush is forced.
+            metrics (Optional[Metrics]): Records each batch write and commit
+                as stage 'db.commit'.
+        """
+        self.db = db_session
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.metrics = metrics or NULL_METRICS
+        self.failures: List[Dict[str, Any]] = []
+        self._updates: List[Tuple[Any, Type, Dict[str, Any]]] = []
+        self._inserts: List[Tuple[Any, Type, Dict[str, Any]]] = []
+        self._ignores: List[Tuple[Any, Type, Dict[str, Any]]] = []
+        self._bulk: List[Tuple[Any, Callable[[Session, List[Any]], None], Any]] = []
+        self._calls: List[Tuple[Any, Callable[[Session], None]]] = []
+        self._last_flush = time.monotonic()
+
+    def __len__(self) -> int:
+        return (len(self._updates) + len(self._inserts) + len(self._ignores)
+                + len(self._bulk) + len(self._calls))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
+
+    def update(self, model: Type, values: Dict[str, Any], key: Any = None):
+        """Queue a bulk UPDATE by primary key (`values` must include it)."""
+        self._updates.append((key, model, values))
+        self.maybe_flush()
+
+    def insert(self, model: Type, values: Dict[str, Any], key: Any = None):
+        """Queue a bulk INSERT of one row."""
+        self._inserts.append((key, model, values))
+        self.maybe_flush()
+
+    def insert_ignore(self, model: Type, values: Dict[str, Any], key: Any = None):
+        """Queue an INSERT that is skipped if the row's key already exists."""
+        self._ignores.append((key, model, values))
+        self.maybe_flush()
+
+    def bulk(self, fn: Callable[[Session, List[Any]], None], item: Any,
+             key: Any = None):
+        """
+        Queue `item` for a set-based writer: at flush time `fn(session, items)`
+        runs once with every item queued for that `fn`.
+        """
+        self._bulk.append((key, fn, item))
+        self.maybe_flush()
+
+    def call(self, fn: Callable[[Session], None], key: Any = None):
+        """Queue arbitrary ORM work, run as `fn(session)` at flush time."""
+        self._calls.append((key, fn))
+        self.maybe_flush()
+
+    def maybe_flush(self) -> int:
+        if (len(self) >= self.batch_size
+                or time.monotonic() - self._last_flush >= self.flush_interval):
+            return self.flush()
+        return 0
+
+    def flush(self) -> int:
+        """
+        Write and commit everything pending.
+
+        Returns:
+            int: Number of queued writes that were committed.
+        """
+        updates, inserts, ignores, bulk, calls = (
+            self._updates, self._inserts, self._ignores, self._bulk, self._calls)
+        self._updates, self._inserts, self._ignores = [], [], []
+        self._bulk, self._calls = [], []
+        self._last_flush = time.monotonic()
+        total = (len(updates) + len(inserts) + len(ignores) + len(bulk)
+                 + len(calls))
+        if not total:
+            return 0
+
+        try:
+            with self.metrics.timer('db.commit'):
+                self._apply(updates, inserts, ignores, bulk, calls)
+                self.db.commit()
+            return total
+        except SQLAlchemyError as e:
+            self.db.rollback()
+            logger.warning("Batch of %d writes failed (%s); retrying one by one",
+                           total, e)
+
+        # Rows inserted with insert_ignore() are idempotent; write them first
+        # so the per-item replays below can reference them.
+        written = 0
+        if ignores:
+            written += self._write_one(None, ignores=ignores)
+        for item in inserts:
+            written += self._write_one(item[0], inserts=[item])
+        for item in updates:
+            written += self._write_one(item[0], updates=[item])
+        for item in bulk:
+            written += self._write_one(item[0], bulk=[item])
+        for item in calls:
+            written += self._write_one(item[0], calls=[item])
+        return written
+
+    def _write_one(self, key, updates=(), inserts=(), ignores=(), bulk=(),
+                   calls=()) -> int:
+        try:
+            self._apply(updates, inserts, ignores, bulk, calls)
+            self.db.commit()
+            return (len(updates) + len(inserts) + len(ignores) + len(bulk)
+                    + len(calls))
+        except SQLAlchemyError as e:
+            self.db.rollback()
+            logger.error("DB write failed for %s: %s", key, e)
+            self.failures.append({'key': key, 'error': str(e)})
+            return 0
+
+    def _apply(self, updates, inserts, ignores, bulk, calls):
+        for model, rows in _group(inserts).items():
+            self.db.bulk_insert_mappings(model, rows)
+        for model, rows in _group(ignores).items():
+            insert_ignore(self.db, model, rows)
+        for model, rows in _group(updates).items():
+            self.db.bulk_update_mappings(model, rows)
+        for fn, items in _group(bulk).items():
+            fn(self.db, items)
+        for _, fn in calls:
+            fn(self.db)
+        self.db.flush()
+
+
+def _group(items) -> Dict[Any, List[Any]]:
+    """Group (key, target, value) triples by target, keeping order."""
+    grouped: Dict[Any, List[Any]] = {}
+    for _, target, value in items:
+        grouped.setdefault(target, []).append(value)
+    return grouped
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+## Micro-benchmark: legacy name-matching cascade vs. name_matcher.NameMatcher
+## filename: bench_name_matcher.py
+##
+## Uses the page_text already stored by Phase II. Every page is matched
+## against its own profile's name (mostly hits) and against `--negatives`
+## other names (misses, which reach the expensive fuzzy step).
+
+import re
+import time
+import random
+import argparse
+from typing import List, Tuple
+
+from rapidfuzz import fuzz
+from sqlalchemy import select
+
+from db import init_db, URL, Profile, PageContent, decompress_text
+from name_matcher import NameMatcher, normalize
+
+
+def legacy_match(name: str, norm_text: str) -> bool:
+    """The original per-URL cascade from URLValidator.validate_batch."""
+    norm_name = " ".join((name or "").split()).lower()
+    if norm_name and norm_name in norm_text:
+        return True
+    surname = norm_name.split()[-1] if norm_name else ""
+    if surname and surname in norm_text:
+        return True
+    if norm_name and fuzz.partial_ratio(norm_name, norm_text) >= 75:
+        return True
+    if norm_name:
+        tokens = norm_name.split()
+        pattern = r"\b(" + "|".join(re.escape(tok) for tok in tokens) + r")\b"
+        if re.search(pattern, norm_text, flags=re.IGNORECASE):
+            return True
+    return False
+
+
+def load_corpus(db_url: str, limit: int) -> List[Tuple[str, str]]:
+    Session = init_db(db_url)
+    with Session() as session:
+        stmt = (select(Profile.name, PageContent.codec, PageContent.body)
+                .select_from(URL)
+                .join(URL.profile)
+                .join(URL.content)
+                .limit(limit))
+        return [(name or "", decompress_text(codec, body))
+                for name, codec, body in session.execute(stmt)]
+
+
+def main(db_url: str, limit: int, negatives: int, seed: int):
+    corpus = load_corpus(db_url, limit)
+    if not corpus:
+        print(f"No stored page_text in {db_url}; run Phase II first.")
+        return
+
+    rng = random.Random(seed)
+    names = [name for name, _ in corpus]
+    pages = [normalize(text) for _, text in corpus]
+    pairs = []
+    for i, page in enumerate(pages):
+        pairs.append((names[i], page))
+        pairs.extend((rng.choice(names), page) for _ in range(negatives))
+
+    t0 = time.perf_counter()
+    legacy = [legacy_match(name, page) for name, page in pairs]
+    t_legacy = time.perf_counter() - t0
+
+    # One matcher per distinct name, as in the validator
+    t0 = time.perf_counter()
+    matchers = {}
+    new = []
+    for name, page in pairs:
+        m = matchers.get(name)
+        if m is None:
+            m = matchers[name] = NameMatcher(name)
+        new.append(m.match(page) is not None)
+    t_new = time.perf_counter() - t0
+
+    agree = sum(a == b for a, b in zip(legacy, new))
+    chars = sum(len(p) for p in pages)
+    print(f"pages: {len(pages)} ({chars / 1e6:.1f}M chars), "
+          f"name/page pairs: {len(pairs)}, distinct names: {len(matchers)}")
+    print(f"legacy cascade : {t_legacy:8.3f}s  ({len(pairs) / t_legacy:8.0f} pairs/s)")
+    print(f"NameMatcher    : {t_new:8.3f}s  ({len(pairs) / t_new:8.0f} pairs/s)")
+    print(f"speedup        : {t_legacy / t_new:8.1f}x")
+    print(f"agreement      : {agree}/{len(pairs)} "
+          f"({100.0 * agree / len(pairs):.2f}%)")
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Name-matching micro-benchmark")
+    p.add_argument("--db", default="sqlite:///hrd.db",
+                   help="Database URL holding Phase II page_text")
+    p.add_argument("--limit", type=int, default=2000,
+                   help="Max stored pages to load")
+    p.add_argument("--negatives", type=int, default=3,
+                   help="Non-matching names tried per page")
+    p.add_argument("--seed", type=int, default=0)
+    args = p.parse_args()
+
+    main(args.db, args.limit, args.negatives, args.seed)
@@ -0,0 +1,461 @@
+#!/usr/bin/env python3
+## Offline end-to-end benchmark: collect -> scrape -> validate against a
+## simulated hrdmemorial.org and simulated cited sites
+## filename: bench_pipeline.py
+##
+## A local server (in its own process, so it does not skew CPU or RSS)
+## imitates the /hrdrecord/ listing, the profile page markup that
+## ProfileScraper.extract_profile_data reads, and many external hosts with
+## configurable latency, error rate, redirects, oversized bodies and dead
+## domains. Host names are pointed at it through host_health's DNS overrides,
+## so no request leaves the machine. Each stage reports items/sec, p50/p99
+## request latency, keep-alive reuse and peak RSS; --json appends the numbers
+## (with the git commit) to a file for comparing commits.
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import logging
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+try:
+    import resource
+except ImportError:       # optional: not available on Windows
+    resource = None
+
+from db import init_db, URL
+from url_collector import URLCollector
+from profile_scraper import ProfileScraper
+from phase2_validator import URLValidator
+from politeness import HostScheduler
+from host_health import HostHealth, install_dns_cache
+from http_client import make_session, connection_stats
+from metrics import Metrics
+
+SITE_HOST = 'hrdmemorial.org'
+FIRST = ['Ana', 'Berta', 'Carlos', 'Dora', 'Emilio', 'Fatima', 'Gloria',
+         'Hector', 'Isabel', 'Jose', 'Karla', 'Luis', 'Maria', 'Nelson']
+LAST = ['Caceres', 'Mendoza', 'Rojas', 'Quispe', 'Herrera', 'Lozano',
+        'Vargas', 'Castillo', 'Ortega', 'Navarro', 'Salazar', 'Ibarra']
+_FILLER = ('Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do '
+           'eiusmod tempor incididunt ut labore et dolore magna aliqua. ')
+
+
+# --- simulated sites (server process) ----------------------------------------
+
+def _name(i: int) -> str:
+    rng = random.Random(i)
+    return f"{rng.choice(FIRST)} {rng.choice(LAST)} {i}"
+
+
+def _links(cfg: Dict[str, Any], i: int) -> List[str]:
+    """External URLs cited by profile i; the path encodes the answer."""
+    rng = random.Random(cfg['seed'] * 100003 + i)
+    links = []
+    for k in range(cfg['links']):
+        r = rng.random()
+        if r < cfg['dead_rate']:
+            host = f"dead{rng.randrange(max(1, cfg['dead_hosts']))}.bench.test"
+            links.append(f"http://{host}:{cfg['dead_port']}/p{i}/page/{k}")
+            continue
+        host = f"site{rng.randrange(cfg['hosts'])}.bench.test"
+        r = rng.random()
+        if r < cfg['error_rate']:
+            kind = 'error'
+        elif r < cfg['error_rate'] + cfg['redirect_rate']:
+            kind = 'redirect'
+        elif r < cfg['error_rate'] + cfg['redirect_rate'] + cfg['large_rate']:
+            kind = 'large'
+        else:
+            kind = 'page'
+        links.append(f"http://{host}:{cfg['port']}/p{i}/{kind}/{k}")
+    return links
+
+
+def _listing_page(cfg: Dict[str, Any], page: int) -> Optional[str]:
+    last = max(1, -(-cfg['profiles'] // cfg['per_page']))
+    if page > last:
+        return None
+    base = f"http://{SITE_HOST}:{cfg['port']}/hrdrecord"
+    start = (page - 1) * cfg['per_page']
+    items = ''.join(f'<a href="{base}/defender-{i}/">{_name(i)}</a>\n'
+                    for i in range(start, min(start + cfg['per_page'],
+                                              cfg['profiles'])))
+    pages = ''.join(f'<a class="page-numbers" href="{base}/page/{n}/">{n}</a>'
+                    for n in (1, 2, last))
+    return (f'<html><body><div class="hrd-listing">{items}</div>'
+            f'<nav class="pagination">{pages}</nav></body></html>')
+
+
+def _profile_page(cfg: Dict[str, Any], i: int) -> Optional[str]:
+    if not 0 <= i < cfg['profiles']:
+        return None
+    rng = random.Random(i)
+    links = ''.join(f'<dt>Source {k + 1}</dt><dd><a href="{u}">{u}</a></dd>'
+                    for k, u in enumerate(_links(cfg, i)))
+    info = [('Region', 'Americas'), ('Country', rng.choice(['Colombia', 'Peru'])),
+            ('Sex', rng.choice(['Female', 'Male'])),
+            ('Type of Work', 'Land rights'), ('Previous Threats', 'Yes')]
+    items = ''.join(f'<p class="basic-info-item"><span>{k}:</span> '
+                    f'<a href="#">{v}</a></p>' for k, v in info)
+    items += ('<p class="basic-info-item"><span>Date of Killing:</span> '
+              f'{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/2019</p>')
+    body = ''.join(f'<p>{_FILLER * 4}</p>' for _ in range(5))
+    return (f'<html><head><script>var nonce={rng.random()}</script></head><body>'
+            f'<h1 class="entry-title">{_name(i)}</h1>'
+            f'<div class="thumbnail"><img src="/img/{i}.jpg"></div>{items}'
+            f'<p><strong>Source:</strong> <a href="https://example.org/{i}">'
+            f'Example</a></p><p class="meta">Written by Bench</p>'
+            f'<div class="entry-content">{body}</div>'
+            f'<h5>Contact</h5><p><a href="mailto:info@example.org">mail</a></p>'
+            f'<h5>URLs of Interest</h5><dl>{links}</dl></body></html>')
+
+
+def _external_page(cfg: Dict[str, Any], i: int, k: int) -> bytes:
+    mention = (_name(i).rsplit(' ', 1)[0]
+               if random.Random(i * 31 + k).random() < cfg['name_rate']
+               else 'someone else')
+    filler = _FILLER * max(1, cfg['page_kb'] * 1024 // len(_FILLER))
+    return (f'<html><head><title>News {i}/{k}</title></head><body>'
+            f'<p>{filler}</p><p>Report about {mention}.</p></body></html>'
+            ).encode('utf-8')
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'     # keep-alive, as real servers do
+    disable_nagle_algorithm = True    # no 40 ms stall between headers and body
+    cfg: Dict[str, Any] = {}
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status: int, body: bytes = b'',
+              headers: Optional[Dict[str, str]] = None):
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _sleep(self, ms: float):
+        if ms > 0:
+            time.sleep(random.uniform(0.5, 1.5) * ms / 1000.0)
+
+    def do_GET(self):
+        try:
+            host = (self.headers.get('Host') or '').split(':')[0]
+            if host == SITE_HOST:
+                self._site()
+            else:
+                self._external()
+        except (BrokenPipeError, ConnectionResetError):
+            pass    # the client stopped reading (body cap)
+
+    do_HEAD = do_GET
+
+    def _site(self):
+        self._sleep(self.cfg['site_latency'])
+        parts = [p for p in self.path.split('/') if p]
+        html = None
+        if parts[:1] == ['hrdrecord']:
+            if len(parts) == 1:
+                html = _listing_page(self.cfg, 1)
+            elif parts[1] == 'page' and len(parts) > 2 and parts[2].isdigit():
+                html = _listing_page(self.cfg, int(parts[2]))
+            elif parts[1].startswith('defender-'):
+                html = _profile_page(self.cfg, int(parts[1][len('defender-'):]))
+        if html is None:
+            self._send(404, b'<html><body>Not found</body></html>')
+        else:
+            self._send(200, html.encode('utf-8'))
+
+    def _external(self):
+        self._sleep(self.cfg['latency'])
+        try:
+            _, p, kind, k = self.path.split('/')
+            i, k = int(p[1:]), int(k)
+        except ValueError:
+            self._send(404)
+            return
+        if kind == 'error':
+            self._send(404 if k % 2 == 0 else 500, b'<html>error</html>')
+        elif kind == 'redirect':
+            self._send(302, headers={'Location': f'/p{i}/page/{k}'})
+        elif kind == 'large':
+            self._send_large()
+        else:
+            self._send(200, _external_page(self.cfg, i, k))
+
+    def _send_large(self):
+        size = self.cfg['large_kb'] * 1024
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(size))
+        self.end_headers()
+        chunk = (_FILLER * (65536 // len(_FILLER) + 1)).encode()[:65536]
+        sent = 0
+        while sent < size:
+            piece = chunk[:size - sent]
+            self.wfile.write(piece)
+            sent += len(piece)
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass    # clients dropping keep-alive or capped connections
+
+
+def _serve(cfg: Dict[str, Any], ready):
+    _Handler.cfg = cfg
+    server = _Server(('127.0.0.1', cfg['port']), _Handler)
+    ready.put(True)
+    server.serve_forever()
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(cfg: Dict[str, Any]) -> multiprocessing.Process:
+    """Run the simulated sites in a child process; returns once it listens."""
+    ready = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=_serve, args=(cfg, ready), daemon=True)
+    proc.start()
+    ready.get(timeout=10)
+    return proc
+
+
+# --- measurement (benchmark process) -----------------------------------------
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile, q in [0, 100]."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1,
+                              round(q / 100.0 * len(ordered)) - 1))]
+
+
+def peak_rss_mb() -> Optional[float]:
+    """
+    Peak resident set size of this process so far, in MiB (parse worker
+    processes are not included).
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024.0 * 1024.0 if sys.platform == 'darwin' else 1024.0)
+
+
+def timed_session(pool_maxsize: int, latencies: List[float]):
+    """make_session() recording time-to-headers of every response."""
+    session = make_session(pool_maxsize=pool_maxsize, pool_connections=100)
+    session.hooks['response'].append(
+        lambda r, *args, **kwargs: latencies.append(r.elapsed.total_seconds()))
+    return session
+
+
+def run_stage(name: str, unit: str, fn, session, latencies: List[float]
+              ) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    items = fn()
+    seconds = time.perf_counter() - t0
+    p50, p99 = percentile(latencies, 50), percentile(latencies, 99)
+    return {'stage': name, 'unit': unit, 'items': items,
+            'seconds': round(seconds, 3),
+            'rate': round(items / seconds, 1) if seconds else None,
+            'p50_ms': round(p50 * 1000, 1) if p50 is not None else None,
+            'p99_ms': round(p99 * 1000, 1) if p99 is not None else None,
+            'connections': connection_stats(session),
+            'peak_rss_mb': peak_rss_mb()}
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))
+                              ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(cfg: Dict[str, Any], fetch_workers: int, parse_workers: int,
+         concurrency: int, delay: float, parallel_listing: bool,
+         json_path: Optional[str], keep_db: bool,
+         metrics_path: Optional[str] = None):
+    cfg = dict(cfg, port=_free_port(), dead_port=_free_port())
+    server = start_server(cfg)
+
+    # Every simulated host resolves to the local server; dead hosts point at
+    # a port nobody listens on
+    hosts = [SITE_HOST] + [f"site{n}.bench.test" for n in range(cfg['hosts'])]
+    hosts += [f"dead{n}.bench.test" for n in range(max(1, cfg['dead_hosts']))]
+    install_dns_cache({h: '127.0.0.1' for h in hosts})
+    metrics = Metrics(enabled=metrics_path is not None)
+    metrics.instrument_network()
+
+    workdir = tempfile.mkdtemp(prefix='bench_pipeline_')
+    db_path = os.path.join(workdir, 'bench.db')
+    SessionLocal = init_db(f"sqlite:///{db_path}", echo=False)
+    scheduler = HostScheduler(min_interval=delay, metrics=metrics)
+    results = []
+
+    try:
+        with SessionLocal() as session:
+            lat: List[float] = []
+            http = timed_session(4, lat)
+            collector = URLCollector(
+                base_url=f"http://{SITE_HOST}:{cfg['port']}/hrdrecord/",
+                db_session=session, scheduler=scheduler, session=http,
+                metrics=metrics, max_pages=None, parallel=parallel_listing)
+            profile_urls: List[str] = []
+
+            def collect():
+                profile_urls.extend(collector.collect())
+                return len(profile_urls)
+            results.append(run_stage('collect', 'profiles', collect, http, lat))
+
+            lat = []
+            http = timed_session(max(10, fetch_workers), lat)
+            scraper = ProfileScraper(db_session=session, scheduler=scheduler,
+                                     session=http, fetch_workers=fetch_workers,
+                                     parse_workers=parse_workers,
+                                     metrics=metrics)
+            results.append(run_stage(
+                'scrape', 'profiles',
+                lambda: scraper.scrape_profiles(profile_urls)['success'],
+                http, lat))
+
+            lat = []
+            http = timed_session(max(10, concurrency), lat)
+            validator = URLValidator(db_session=session, scheduler=scheduler,
+                                     concurrency=concurrency,
+                                     health=HostHealth(), session=http,
+                                     metrics=metrics)
+
+            def validate():
+                validator.validate_batch()
+                return (session.query(URL)
+                        .filter(URL.checked_at.isnot(None)).count())
+            results.append(run_stage('validate', 'urls', validate, http, lat))
+    finally:
+        server.terminate()
+        if keep_db:
+            print(f"Database kept at {db_path}")
+        else:
+            os.remove(db_path)
+            for suffix in ('-wal', '-shm'):
+                if os.path.exists(db_path + suffix):
+                    os.remove(db_path + suffix)
+            os.rmdir(workdir)
+
+    print(f"\n{'stage':<10}{'items':>8}{'secs':>9}{'items/s':>10}"
+          f"{'p50 ms':>9}{'p99 ms':>9}{'reused':>9}{'peak RSS':>11}")
+    for r in results:
+        conn = r['connections']
+        rss = f"{r['peak_rss_mb']:.0f} MiB" if r['peak_rss_mb'] else 'n/a'
+        print(f"{r['stage']:<10}{r['items']:>8}{r['seconds']:>9.2f}"
+              f"{r['rate'] or 0:>10.1f}{r['p50_ms'] or 0:>9.1f}"
+              f"{r['p99_ms'] or 0:>9.1f}"
+              f"{conn['reused']:>5}/{conn['requests']:<3}{rss:>11}")
+
+    if metrics_path:
+        metrics.write_jsonl(metrics_path, run='bench', commit=git_commit())
+        print(f"Stage timings appended to {metrics_path}")
+    if json_path:
+        record = {'commit': git_commit(),
+                  'at': datetime.utcnow().isoformat(timespec='seconds'),
+                  'config': cfg, 'fetch_workers': fetch_workers,
+                  'parse_workers': parse_workers, 'concurrency': concurrency,
+                  'stages': results}
+        with open(json_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + '\n')
+        print(f"Results appended to {json_path}")
+    return results
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Offline pipeline benchmark")
+    g = p.add_argument_group("simulated sites")
+    g.add_argument("--profiles", type=int, default=200,
+                   help="Profiles on the simulated listing")
+    g.add_argument("--per-page", type=int, default=20,
+                   help="Profiles per listing page")
+    g.add_argument("--links", type=int, default=5,
+                   help="External URLs cited per profile")
+    g.add_argument("--hosts", type=int, default=40,
+                   help="Distinct live external hosts")
+    g.add_argument("--dead-hosts", type=int, default=4,
+                   help="Distinct dead external hosts (connection refused)")
+    g.add_argument("--dead-rate", type=float, default=0.05,
+                   help="Share of links pointing at dead hosts")
+    g.add_argument("--error-rate", type=float, default=0.1,
+                   help="Share of links answering 404/500")
+    g.add_argument("--redirect-rate", type=float, default=0.1,
+                   help="Share of links answering with a redirect")
+    g.add_argument("--large-rate", type=float, default=0.02,
+                   help="Share of links with an oversized body")
+    g.add_argument("--large-kb", type=int, default=4096,
+                   help="Size of oversized bodies in KiB")
+    g.add_argument("--page-kb", type=int, default=20,
+                   help="Size of normal external pages in KiB")
+    g.add_argument("--name-rate", type=float, default=0.5,
+                   help="Share of external pages mentioning the defender")
+    g.add_argument("--latency", type=float, default=20.0,
+                   help="Mean external response latency in ms (±50%%)")
+    g.add_argument("--site-latency", type=float, default=5.0,
+                   help="Mean hrdmemorial.org response latency in ms")
+    g.add_argument("--seed", type=int, default=0)
+    r = p.add_argument_group("pipeline")
+    r.add_argument("--fetch-workers", type=int, default=4)
+    r.add_argument("--parse-workers", type=int, default=0)
+    r.add_argument("--concurrency", type=int, default=16,
+                   help="Validator concurrency")
+    r.add_argument("--delay", type=float, default=0.0,
+                   help="Per-host politeness interval in seconds")
+    r.add_argument("--parallel-listing", action="store_true")
+    p.add_argument("--json", default=None, metavar="PATH",
+                   help="Append results as one JSON line to PATH")
+    p.add_argument("--metrics", default=None, metavar="PATH",
+                   help="Also record per-stage timings (metrics.py) and "
+                        "append them as one JSON line to PATH")
+    p.add_argument("--keep-db", action="store_true",
+                   help="Keep the benchmark database")
+    p.add_argument("-v", "--verbose", action="store_true",
+                   help="Show the pipeline's INFO logging")
+    args = p.parse_args()
+
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+    # Connection retries to the dead hosts are expected
+    logging.getLogger('urllib3').setLevel(logging.INFO if args.verbose
+                                          else logging.ERROR)
+    cfg = {'profiles': args.profiles, 'per_page': args.per_page,
+           'links': args.links, 'hosts': max(1, args.hosts),
+           'dead_hosts': args.dead_hosts, 'dead_rate': args.dead_rate,
+           'error_rate': args.error_rate, 'redirect_rate': args.redirect_rate,
+           'large_rate': args.large_rate, 'large_kb': args.large_kb,
+           'page_kb': args.page_kb, 'name_rate': args.name_rate,
+           'latency': args.latency, 'site_latency': args.site_latency,
+           'seed': args.seed}
+    main(cfg, fetch_workers=args.fetch_workers, parse_workers=args.parse_workers,
+         concurrency=args.concurrency, delay=args.delay,
+         parallel_listing=args.parallel_listing, json_path=args.json,
+         keep_db=args.keep_db, metrics_path=args.metrics)
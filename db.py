@@ -1,5 +1,16 @@
 # file: db.py
 
+import hashlib
+import logging
+import zlib
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+try:
+    import zstandard
+except ImportError:       # optional: zlib is used instead
+    zstandard = None
+
 from sqlalchemy import (
     create_engine,
     Column,
@@ -9,10 +20,20 @@ from sqlalchemy import (
     Boolean,
     DateTime,
     Text,
-    ForeignKey
+    LargeBinary,
+    bindparam,
+    ForeignKey,
+    Index,
+    event,
+    insert,
+    inspect,
+    select,
+    text
 )
 from sqlalchemy.orm import sessionmaker, declarative_base, relationship
 
+from url_canon import canonical_url
+
 Base = declarative_base()
 
 class Profile(Base):
@@ -39,29 +60,325 @@ class Profile(Base):
     more_information= Column(String)
     contact_email   = Column(String)
     created_at      = Column(DateTime)
+    # Cache validators of the profile page, for delta sync
+    etag            = Column(String)
+    last_modified   = Column(String)
+    content_hash    = Column(String(64))
+    checked_at      = Column(DateTime)
+    # Last write to the row; drives incremental export
+    updated_at      = Column(DateTime, default=datetime.utcnow,
+                             onupdate=datetime.utcnow, index=True)
     urls            = relationship('URL', back_populates='profile')
 
 
+class ProfileLink(Base):
+    """Profile URLs seen on the listing pages (URLCollector)."""
+    __tablename__ = 'profile_links'
+    url            = Column(Text, primary_key=True)
+    first_seen     = Column(DateTime)
+    last_seen      = Column(DateTime)
+
+
+URL_UNIQUE_INDEX = 'uq_urls_profile_url'
+
+
 class URL(Base):
     __tablename__ = 'urls'
+    __table_args__ = (
+        # One row per link per profile, so re-scrapes do not duplicate links
+        Index(URL_UNIQUE_INDEX, 'profile_id', 'url', unique=True),
+    )
     url_id         = Column(Integer, primary_key=True, index=True)
     profile_id     = Column(Integer, ForeignKey('profiles.profile_id'), nullable=False)
     label          = Column(String)
     url            = Column(Text, nullable=False)
+    # url_canon.canonical_url(url): groups links to the same page
+    canonical_url  = Column(Text, nullable=True, index=True)
     # Phase I fields
     is_archived    = Column(Boolean)
     archived_url   = Column(Text)
+    # Phase III field: last Wayback availability lookup
+    archive_checked_at = Column(DateTime, nullable=True)
     # Phase II fields (validation & scraping)
     is_active      = Column(Boolean,  nullable=True)
     contains_name  = Column(Boolean,  nullable=True)
-    page_text      = Column(Text,     nullable=True)
+    page_hash      = Column(String(64), ForeignKey('page_content.content_hash'),
+                            nullable=True, index=True)
+    match_strategy = Column(String,   nullable=True)   # exact/surname/token/fuzzy
     checked_at     = Column(DateTime, nullable=True)
+    # Cache validators for conditional re-checks
+    etag           = Column(String,   nullable=True)
+    last_modified  = Column(String,   nullable=True)
+    content_hash   = Column(String(64), nullable=True)   # SHA-256 of body read
+    # Last write to the row; drives incremental export
+    updated_at     = Column(DateTime, default=datetime.utcnow,
+                            onupdate=datetime.utcnow, index=True)
 
     profile = relationship('Profile', back_populates='urls')
+    content = relationship('PageContent', lazy='select')
+
+    @property
+    def page_text(self) -> Optional[str]:
+        """Stored page text, loaded and decompressed on first access."""
+        return self.content.text if self.content is not None else None
+
+
+class ExportWatermark(Base):
+    """Newest updated_at already exported, per table (incremental export)."""
+    __tablename__ = 'export_watermarks'
+    table_name     = Column(String, primary_key=True)
+    watermark      = Column(DateTime, nullable=False)
+    exported_at    = Column(DateTime)
+    rows           = Column(Integer)
+
+
+class Job(Base):
+    """
+    Lease-based work queue shared by worker processes: one row per item
+    (e.g. a urls.url_id) and kind of work. See work_queue.WorkQueue.
+    """
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        Index('ux_jobs_kind_item', 'kind', 'item_id', unique=True),
+        Index('ix_jobs_claim', 'kind', 'status', 'lease_expires'),
+    )
+    job_id         = Column(Integer, primary_key=True)
+    kind           = Column(String, nullable=False)        # e.g. 'validate'
+    item_id        = Column(Integer, nullable=False)
+    status         = Column(String, nullable=False, default='pending')
+    worker         = Column(String)
+    lease_token    = Column(String(32), index=True)        # one per claim
+    lease_expires  = Column(DateTime)
+    attempts       = Column(Integer, nullable=False, default=0)
+    last_error     = Column(Text)
+    created_at     = Column(DateTime, default=datetime.utcnow)
+    finished_at    = Column(DateTime)
+
+
+class PageContent(Base):
+    """Page bodies, compressed and deduplicated by SHA-256 of the text."""
+    __tablename__ = 'page_content'
+    content_hash   = Column(String(64), primary_key=True)
+    codec          = Column(String, nullable=False)      # 'zlib' or 'zstd'
+    body           = Column(LargeBinary, nullable=False)
+    size           = Column(Integer)                     # uncompressed bytes
+    created_at     = Column(DateTime)
+
+    @property
+    def text(self) -> str:
+        return decompress_text(self.codec, self.body)
+
+    @staticmethod
+    def row_for(text: str) -> Dict[str, Any]:
+        """Column values for storing `text` (hash, compressed body)."""
+        raw = text.encode('utf-8')
+        codec, body = _compress(raw)
+        return {
+            'content_hash': hashlib.sha256(raw).hexdigest(),
+            'codec': codec,
+            'body': body,
+            'size': len(raw),
+            'created_at': datetime.utcnow()
+        }
+
+
+def _compress(raw: bytes):
+    if zstandard is not None:
+        return 'zstd', zstandard.ZstdCompressor(level=10).compress(raw)
+    return 'zlib', zlib.compress(raw, 6)
+
+
+def decompress_text(codec: str, body: bytes) -> str:
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ImportError("page stored with zstd; install zstandard")
+        raw = zstandard.ZstdDecompressor().decompress(body)
+    elif codec == 'zlib':
+        raw = zlib.decompress(body)
+    else:
+        raise ValueError(f"Unknown page codec: {codec}")
+    return raw.decode('utf-8')
+
+
+def _dialect_insert(conn):
+    """Dialect insert() supporting ON CONFLICT, or None for other engines."""
+    bind = conn.get_bind() if hasattr(conn, 'get_bind') else conn
+    dialect = bind.dialect.name
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        return None
+    return dialect_insert
+
+
+def insert_ignore(conn, model, rows: List[Dict[str, Any]]):
+    """
+    INSERT rows, skipping those whose primary/unique key already exists.
+
+    Works with a Session or a Connection.
+    """
+    if not rows:
+        return
+    dialect_insert = _dialect_insert(conn)
+    if dialect_insert is not None:
+        conn.execute(dialect_insert(model.__table__).on_conflict_do_nothing(), rows)
+        return
+    pk = list(model.__table__.primary_key.columns)
+    for row in rows:
+        found = conn.execute(
+            select(*pk).where(*(c == row[c.name] for c in pk))).first()
+        if found is None:
+            conn.execute(insert(model), [row])
+
+
+def upsert(conn, model, rows: List[Dict[str, Any]],
+           index_elements: List[str]) -> bool:
+    """
+    Bulk INSERT ... ON CONFLICT (index_elements) DO UPDATE of all other
+    columns given in `rows` (which must share the same keys).
+
+    Returns:
+        bool: False if the engine has no ON CONFLICT support (nothing done).
+    """
+    dialect_insert = _dialect_insert(conn)
+    if dialect_insert is None:
+        return False
+    if not rows:
+        return True
+    stmt = dialect_insert(model.__table__)
+    pk = {c.name for c in model.__table__.primary_key.columns}
+    update = {k: stmt.excluded[k] for k in rows[0]
+              if k not in index_elements and k not in pk}
+    # ON CONFLICT DO UPDATE skips onupdate hooks; the inserted row carries
+    # the column default, so take that (e.g. updated_at = now)
+    for col in model.__table__.columns:
+        if col.onupdate is not None and col.name not in update:
+            update[col.name] = stmt.excluded[col.name]
+    conn.execute(stmt.on_conflict_do_update(index_elements=index_elements,
+                                            set_=update), rows)
+    return True
+
+
+def ensure_columns(engine):
+    """
+    Add model columns missing from existing tables (ALTER TABLE ADD COLUMN),
+    so databases created by older versions keep working.
+
+    Existing rows get the column's Python default, if it has one, and
+    indexes on the new columns are created.
+    """
+    insp = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not insp.has_table(table.name):
+                continue
+            existing = {c['name'] for c in insp.get_columns(table.name)}
+            indexes = {ix['name'] for ix in insp.get_indexes(table.name)}
+            added = set()
+            for col in table.columns:
+                if col.name in existing:
+                    continue
+                col_type = col.type.compile(dialect=engine.dialect)
+                logging.getLogger(__name__).info(
+                    "Adding column `%s` to %s", col.name, table.name)
+                conn.execute(text(
+                    f"ALTER TABLE {table.name} ADD COLUMN {col.name} {col_type}"))
+                default = col.default
+                if default is not None and (default.is_scalar or default.is_callable):
+                    value = default.arg(None) if default.is_callable else default.arg
+                    conn.execute(table.update().values({col.name: value}))
+                added.add(col.name)
+            for index in table.indexes:
+                if (index.name not in indexes
+                        and {c.name for c in index.columns} <= added):
+                    index.create(conn)
+
+
+def ensure_canonical_urls(engine, chunk_size: int = 1000) -> int:
+    """
+    Fill urls.canonical_url where it is missing (rows from older versions or
+    inserted without it), `chunk_size` rows per transaction.
+
+    Returns:
+        int: Rows filled.
+    """
+    filled = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                select(URL.url_id, URL.url)
+                .where(URL.canonical_url.is_(None))
+                .limit(chunk_size)).all()
+            if not rows:
+                break
+            conn.execute(
+                URL.__table__.update()
+                .where(URL.url_id == bindparam('b_id'))
+                .values(canonical_url=bindparam('b_canonical')),
+                [{'b_id': r.url_id, 'b_canonical': canonical_url(r.url)}
+                 for r in rows])
+        filled += len(rows)
+    if filled:
+        logging.getLogger(__name__).info(
+            "Filled canonical_url on %d urls rows", filled)
+    return filled
+
+
+def ensure_url_unique_index(engine):
+    """
+    Make (profile_id, url) unique on existing databases.
+
+    Duplicate links left by earlier re-scrapes are removed first, keeping the
+    oldest row (the one most likely to carry validation results).
+    """
+    names = {ix['name'] for ix in inspect(engine).get_indexes('urls')}
+    if URL_UNIQUE_INDEX in names:
+        return
+    with engine.begin() as conn:
+        removed = conn.execute(text(
+            "DELETE FROM urls WHERE url_id NOT IN "
+            "(SELECT MIN(url_id) FROM urls GROUP BY profile_id, url)")).rowcount
+        conn.execute(text(
+            f"CREATE UNIQUE INDEX {URL_UNIQUE_INDEX} ON urls (profile_id, url)"))
+    if removed:
+        logging.getLogger(__name__).info(
+            "Removed %d duplicate url rows before adding %s",
+            removed, URL_UNIQUE_INDEX)
+
+
+def store_page(session, text: str) -> str:
+    """Store page text (deduplicated) and return its content hash."""
+    row = PageContent.row_for(text)
+    insert_ignore(session, PageContent, [row])
+    return row['content_hash']
+
+
+# Applied to every SQLite connection: WAL lets readers run alongside the
+# writer, and synchronous=NORMAL skips the fsync on each commit (WAL keeps
+# the database consistent; a crash can only lose the last commits).
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'temp_store': 'MEMORY',
+    'cache_size': -64000,       # KiB, i.e. ~64 MB page cache
+    'busy_timeout': 30000,      # ms to wait on a locked database
+}
+
+
+def _set_sqlite_pragmas(dbapi_conn, _record):
+    cursor = dbapi_conn.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
 
 
 def get_engine(db_url: str, echo: bool = False):
-    return create_engine(db_url, echo=echo, future=True)
+    engine = create_engine(db_url, echo=echo, future=True)
+    if engine.dialect.name == 'sqlite':
+        event.listen(engine, 'connect', _set_sqlite_pragmas)
+    return engine
 
 
 def get_session_factory(engine):
@@ -70,8 +387,12 @@ def get_session_factory(engine):
 
 def init_db(db_url: str, echo: bool = False):
     """
-    Create database engine, tables, and return session factory.
+    Create database engine (WAL + tuned pragmas on SQLite), tables, and
+    return session factory.
     """
     engine = get_engine(db_url, echo=echo)
     Base.metadata.create_all(engine)
+    ensure_columns(engine)
+    ensure_url_unique_index(engine)
+    ensure_canonical_urls(engine)
     return get_session_factory(engine)
@@ -1,39 +1,81 @@
 # file: export_module.py
 
 import os
+import glob
+import gzip
 import logging
-from typing import Dict, Any
+from datetime import datetime
+from typing import Dict, Any, Iterator, List, Optional
 
 import pandas as pd
+from sqlalchemy import (func, select, Boolean, Date, DateTime, Float, Integer,
+                        LargeBinary)
 from sqlalchemy.orm import Session
 
-from db import Profile, URL   # ← Add this line
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:       # optional: only needed for fmt='parquet'
+    pa = pq = None
+
+from db import Profile, URL, ExportWatermark   # ← Add this line
+from metrics import Metrics, NULL_METRICS
 
 logger = logging.getLogger(__name__)
 
+FORMATS = {'csv': '.csv', 'csv.gz': '.csv.gz', 'parquet': '.parquet'}
+DEFAULT_CHUNKSIZE = 1_000
+TABLES = {'profiles': Profile, 'urls': URL}
+DELTA_DIR = 'deltas'
+
+
 class Exporter:
-    def __init__(self, db_session: Session, output_dir: str = "./output"):
+    def __init__(self, db_session: Session, output_dir: str = "./output",
+                 metrics: Optional[Metrics] = None):
         """
         Args:
             db_session (Session): Active SQLAlchemy session.
             output_dir (str): Directory to write CSVs.
+            metrics (Optional[Metrics]): Per-chunk timings: 'export.read'
+                (query and DataFrame build) and 'export.write'.
         """
         self.db = db_session
         self.output_dir = output_dir
+        self.metrics = metrics or NULL_METRICS
         os.makedirs(self.output_dir, exist_ok=True)
 
     def export(self,
                include_profiles: bool = True,
                include_urls: bool = True,
-               to_pandas: bool = False
+               to_pandas: bool = False,
+               fmt: str = 'csv',
+               chunksize: int = DEFAULT_CHUNKSIZE,
+               columns: Optional[Dict[str, List[str]]] = None,
+               exclude: Optional[Dict[str, List[str]]] = None,
+               incremental: bool = False
                ) -> Dict[str, Any]:
         """
-        Export tables to CSV and optionally return DataFrames.
+        Export tables to CSV (or Parquet) and optionally return DataFrames.
+
+        Rows are streamed from the database `chunksize` at a time and each
+        chunk is appended to the output file, so with to_pandas=False peak
+        memory does not depend on table size.
 
         Args:
             include_profiles (bool): Export profiles table.
             include_urls (bool): Export urls table.
-            to_pandas (bool): Return DataFrames if True.
+            to_pandas (bool): Return DataFrames if True (holds the whole
+                table in memory).
+            fmt (str): 'csv', 'csv.gz' or 'parquet' (requires pyarrow).
+            chunksize (int): Rows read and written per chunk.
+            columns (Optional[Dict[str, List[str]]]): Columns to export per
+                table name, e.g. {'profiles': ['slug', 'name']}; all if unset.
+            exclude (Optional[Dict[str, List[str]]]): Columns to leave out per
+                table name, e.g. {'profiles': ['description_html']}.
+            incremental (bool): Write only rows whose updated_at is past the
+                table's watermark, as a new file under deltas/<table>/. The
+                first incremental export writes the full snapshot. Use
+                compact() to merge the deltas back into the snapshot.
 
         Returns:
             Dict[str, Any]: {
@@ -43,7 +85,14 @@ class Exporter:
                 'urls_df': DataFrame or None,
                 'counts': {'profiles': n, 'urls': m}
             }
+            The '*_csv' keys hold the output path whatever the format
+            (None when an incremental export found no changed rows).
         """
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown export format: {fmt}")
+        if fmt == 'parquet' and pq is None:
+            raise ImportError("fmt='parquet' requires the pyarrow package")
+
         report: Dict[str, Any] = {
             'profiles_csv': None,
             'urls_csv': None,
@@ -52,24 +101,180 @@ class Exporter:
             'counts': {}
         }
 
-        if include_profiles:
-            df_profiles = pd.read_sql(self.db.query(Profile).statement,
-                                      self.db.bind)
-            path_p = os.path.join(self.output_dir, "profiles.csv")
-            df_profiles.to_csv(path_p, index=False, encoding='utf-8')
-            report['profiles_csv'] = path_p
-            report['counts']['profiles'] = len(df_profiles)
-            if to_pandas:
-                report['profiles_df'] = df_profiles
-
-        if include_urls:
-            df_urls = pd.read_sql(self.db.query(URL).statement,
-                                  self.db.bind)
-            path_u = os.path.join(self.output_dir, "urls.csv")
-            df_urls.to_csv(path_u, index=False, encoding='utf-8')
-            report['urls_csv'] = path_u
-            report['counts']['urls'] = len(df_urls)
+        for name, wanted in (('profiles', include_profiles),
+                             ('urls', include_urls)):
+            if not wanted:
+                continue
+            model = TABLES[name]
+            table_cols = self._columns(model, (columns or {}).get(name),
+                                       (exclude or {}).get(name))
+            path = os.path.join(self.output_dir, name + FORMATS[fmt])
+            where = []
+            if incremental:
+                mark = self.db.get(ExportWatermark, name)
+                if mark is not None:
+                    path = self._delta_path(name, fmt)
+                    where.append(model.updated_at > mark.watermark)
+                # Upper bound fixed up front: rows written during the export
+                # land in the next delta
+                high = self.db.scalar(select(func.max(model.updated_at))
+                                      .where(*where))
+                if high is None:
+                    report['counts'][name] = 0
+                    logger.info("No %s rows changed since last export", name)
+                    continue
+                where.append(model.updated_at <= high)
+            frames = [] if to_pandas else None
+            count = self._export_table(table_cols, path, fmt, chunksize, frames,
+                                       where)
+            if incremental:
+                self._set_watermark(name, high, count)
+            report[f'{name}_csv'] = path
+            report['counts'][name] = count
             if to_pandas:
-                report['urls_df'] = df_urls
+                report[f'{name}_df'] = (
+                    pd.concat(frames, ignore_index=True) if frames
+                    else pd.DataFrame(columns=[c.name for c in table_cols]))
+            logger.info("Exported %d %s rows to %s", count, name, path)
 
         return report
+
+    @staticmethod
+    def _columns(model, include: Optional[List[str]],
+                 exclude: Optional[List[str]]) -> List[Any]:
+        table = model.__table__
+        names = list(include) if include else [c.name for c in table.columns]
+        unknown = [n for n in names if n not in table.columns]
+        if unknown:
+            raise ValueError(f"Unknown {table.name} columns: {unknown}")
+        skip = set(exclude or ())
+        return [table.columns[n] for n in names if n not in skip]
+
+    def compact(self, fmt: str = 'csv') -> Dict[str, int]:
+        """
+        Merge each table's delta files into its full snapshot.
+
+        Rows are keyed by primary key and the newest delta wins. The merged
+        snapshot replaces the old one and the merged deltas are deleted.
+
+        Returns:
+            Dict[str, int]: Rows in each compacted snapshot.
+        """
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown export format: {fmt}")
+        counts: Dict[str, int] = {}
+        for name, model in TABLES.items():
+            deltas = sorted(glob.glob(os.path.join(
+                self.output_dir, DELTA_DIR, name, f"{name}-*{FORMATS[fmt]}")))
+            if not deltas:
+                continue
+            path = os.path.join(self.output_dir, name + FORMATS[fmt])
+            parts = [path] if os.path.exists(path) else []
+            df = pd.concat([_read(p, fmt) for p in parts + deltas],
+                           ignore_index=True)
+            keys = [c.name for c in model.__table__.primary_key.columns]
+            df = df.drop_duplicates(subset=keys, keep='last').sort_values(keys)
+            tmp = path + '.part'
+            _write(df, tmp, fmt)
+            os.replace(tmp, path)
+            for delta in deltas:
+                os.remove(delta)
+            counts[name] = len(df)
+            logger.info("Compacted %d %s deltas into %s (%d rows)",
+                        len(deltas), name, path, len(df))
+        return counts
+
+    def _delta_path(self, name: str, fmt: str) -> str:
+        folder = os.path.join(self.output_dir, DELTA_DIR, name)
+        os.makedirs(folder, exist_ok=True)
+        # Timestamped names sort in export order
+        stamp = datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')
+        return os.path.join(folder, f"{name}-{stamp}{FORMATS[fmt]}")
+
+    def _set_watermark(self, name: str, high: datetime, count: int):
+        mark = self.db.get(ExportWatermark, name)
+        if mark is None:
+            mark = ExportWatermark(table_name=name)
+            self.db.add(mark)
+        mark.watermark = high
+        mark.exported_at = datetime.utcnow()
+        mark.rows = count
+        self.db.commit()
+
+    def _chunks(self, table_cols: List[Any], chunksize: int,
+                where: Optional[List[Any]] = None) -> Iterator[pd.DataFrame]:
+        """Stream the selected columns as DataFrames of `chunksize` rows."""
+        # Server-side cursor where the driver supports it (e.g. psycopg2)
+        stmt = (select(*table_cols).where(*(where or []))
+                .execution_options(stream_results=True))
+        yield from self.metrics.timed_iter(
+            pd.read_sql(stmt, self.db.connection(), chunksize=max(1, chunksize)),
+            'export.read')
+
+    def _export_table(self, table_cols: List[Any], path: str, fmt: str,
+                      chunksize: int, frames: Optional[List[pd.DataFrame]],
+                      where: Optional[List[Any]] = None) -> int:
+        count = 0
+        tmp = path + '.part'
+        if fmt == 'parquet':
+            schema = _arrow_schema(table_cols)
+            with pq.ParquetWriter(tmp, schema) as writer:
+                for df in self._chunks(table_cols, chunksize, where):
+                    with self.metrics.timer('export.write'):
+                        writer.write_table(pa.Table.from_pandas(
+                            df, schema=schema, preserve_index=False))
+                    count += len(df)
+                    if frames is not None:
+                        frames.append(df)
+        else:
+            opener = gzip.open if fmt == 'csv.gz' else open
+            with opener(tmp, 'wt', encoding='utf-8', newline='') as fh:
+                header = True
+                for df in self._chunks(table_cols, chunksize, where):
+                    with self.metrics.timer('export.write'):
+                        df.to_csv(fh, index=False, header=header)
+                    header = False
+                    count += len(df)
+                    if frames is not None:
+                        frames.append(df)
+                if header:   # empty table: still write the header row
+                    fh.write(",".join(c.name for c in table_cols) + "\n")
+        # Readers never see a half-written export
+        os.replace(tmp, path)
+        return count
+
+
+def _read(path: str, fmt: str) -> pd.DataFrame:
+    if fmt == 'parquet':
+        return pd.read_parquet(path)
+    return pd.read_csv(path)   # gzip inferred from the .gz suffix
+
+
+def _write(df: pd.DataFrame, path: str, fmt: str):
+    if fmt == 'parquet':
+        df.to_parquet(path, index=False)
+    else:
+        df.to_csv(path, index=False, encoding='utf-8',
+                  compression='gzip' if fmt == 'csv.gz' else None)
+
+
+def _arrow_schema(table_cols: List[Any]):
+    """Parquet schema from the SQLAlchemy column types, stable across chunks."""
+    fields = []
+    for col in table_cols:
+        if isinstance(col.type, Boolean):
+            typ = pa.bool_()
+        elif isinstance(col.type, Integer):
+            typ = pa.int64()
+        elif isinstance(col.type, Float):
+            typ = pa.float64()
+        elif isinstance(col.type, DateTime):
+            typ = pa.timestamp('us')
+        elif isinstance(col.type, Date):
+            typ = pa.date32()
+        elif isinstance(col.type, LargeBinary):
+            typ = pa.binary()
+        else:
+            typ = pa.string()
+        fields.append(pa.field(col.name, typ))
+    return pa.schema(fields)
@@ -0,0 +1,186 @@
+# file: host_health.py
+
+import socket
+import time
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+
+def is_connection_failure(exc: BaseException) -> bool:
+    """
+    True for failures that say nothing answered: DNS errors, refused or reset
+    connections and timeouts (urllib3 retries surface as ConnectionError).
+    """
+    return isinstance(exc, (requests.ConnectionError, requests.Timeout,
+                            socket.gaierror))
+
+
+def endpoint_of(url: str) -> str:
+    """Circuit key for a URL: host plus explicit port, lower-cased."""
+    try:
+        parts = urlsplit(url)
+        host = (parts.hostname or '').lower()
+    except ValueError:    # unparseable; the request itself will fail
+        return ''
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    return f"{host}:{port}" if port else host
+
+
+class _Circuit:
+    __slots__ = ('state', 'failures', 'opened_at', 'probing', 'skipped')
+
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.skipped = 0
+
+
+class HostHealth:
+    def __init__(self, failure_threshold: int = 3,
+                 reset_timeout: float = 300.0):
+        """
+        Per-host circuit breaker.
+
+        After `failure_threshold` consecutive connection-level failures the
+        host's circuit opens and allow() refuses its URLs, so callers can
+        mark them inactive without touching the network. Once
+        `reset_timeout` seconds have passed one probe request is let through
+        (half-open): success closes the circuit, failure opens it again.
+        Any HTTP response, even an error status, counts as success.
+
+        Args:
+            failure_threshold (int): Consecutive failures that open a circuit;
+                0 disables the breaker.
+            reset_timeout (float): Seconds before an open circuit is probed.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._circuits: Dict[str, _Circuit] = {}
+        self._lock = threading.Lock()
+
+    def allow(self, url: str) -> bool:
+        """Whether a request to the URL's host may be sent now."""
+        if self.failure_threshold <= 0:
+            return True
+        host = endpoint_of(url)
+        with self._lock:
+            c = self._circuits.get(host)
+            if c is None or c.state == CLOSED:
+                return True
+            if (c.state == OPEN and not c.probing
+                    and time.monotonic() - c.opened_at >= self.reset_timeout):
+                c.state, c.probing = HALF_OPEN, True
+                logger.info("Probing host %s (circuit half-open)", host)
+                return True
+            c.skipped += 1
+            return False
+
+    def record_success(self, url: str):
+        host = endpoint_of(url)
+        with self._lock:
+            c = self._circuits.get(host)
+            if c is None:
+                return
+            if c.state != CLOSED:
+                logger.info("Host %s is reachable again; closing circuit", host)
+            c.state, c.failures, c.probing = CLOSED, 0, False
+
+    def record_failure(self, url: str, exc: Optional[BaseException] = None):
+        """Count a connection-level failure. Other errors (too many
+        redirects, a broken body, ...) mean the host answered, so they count
+        as success; that also ends a half-open probe."""
+        if self.failure_threshold <= 0:
+            return
+        if exc is not None and not is_connection_failure(exc):
+            self.record_success(url)
+            return
+        host = endpoint_of(url)
+        with self._lock:
+            c = self._circuits.setdefault(host, _Circuit())
+            c.failures += 1
+            if c.state == HALF_OPEN or c.failures >= self.failure_threshold:
+                if c.state != OPEN:
+                    logger.info("Opening circuit for %s after %d failures",
+                                host, c.failures)
+                c.state, c.opened_at, c.probing = OPEN, time.monotonic(), False
+
+    def state(self, url: str) -> str:
+        with self._lock:
+            c = self._circuits.get(endpoint_of(url))
+            return c.state if c else CLOSED
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Hosts whose circuit ever opened: {'host': {'state', 'skipped'}}."""
+        with self._lock:
+            return {h: {'state': c.state, 'skipped': c.skipped}
+                    for h, c in self._circuits.items()
+                    if c.state != CLOSED or c.skipped}
+
+
+# --- DNS cache --------------------------------------------------------------
+
+_real_getaddrinfo = socket.getaddrinfo
+_dns_lock = threading.Lock()
+_dns_cache: Dict[Tuple, object] = {}
+_dns_overrides: Dict[str, str] = {}
+# Resolver answers that the name does not exist; others (EAI_AGAIN, ...) may
+# be transient and are retried on the next lookup
+_DNS_PERMANENT = {getattr(socket, name) for name in ('EAI_NONAME', 'EAI_NODATA')
+                  if hasattr(socket, name)}
+
+
+def _cached_getaddrinfo(host, port, family=0, type=0, proto=0, flags=0):
+    if isinstance(host, bytes):
+        host = host.decode('ascii')
+    target = _dns_overrides.get(host.lower(), host) if host else host
+    key = (target, port, family, type, proto, flags)
+    with _dns_lock:
+        hit = _dns_cache.get(key)
+    if hit is None:
+        try:
+            hit = _real_getaddrinfo(target, port, family, type, proto, flags)
+        except socket.gaierror as e:
+            if e.errno not in _DNS_PERMANENT:
+                raise
+            # Unknown hosts stay unknown for the run
+            hit = e
+        with _dns_lock:
+            _dns_cache[key] = hit
+    if isinstance(hit, socket.gaierror):
+        raise hit
+    return list(hit)
+
+
+def install_dns_cache(overrides: Optional[Dict[str, str]] = None):
+    """
+    Cache name resolution (including unknown-host failures, but not
+    temporary resolver errors) for the rest of the process.
+
+    Patches socket.getaddrinfo, so every requests/urllib3 connection shares
+    the cache. `overrides` maps host names to addresses, e.g.
+    {'hrdmemorial.org': '127.0.0.1'} to point a run at a local server.
+    """
+    with _dns_lock:
+        _dns_overrides.update({h.lower(): ip for h, ip in (overrides or {}).items()})
+    socket.getaddrinfo = _cached_getaddrinfo
+
+
+def uninstall_dns_cache():
+    """Restore the real resolver and drop cached entries and overrides."""
+    socket.getaddrinfo = _real_getaddrinfo
+    with _dns_lock:
+        _dns_cache.clear()
+        _dns_overrides.clear()
@@ -0,0 +1,448 @@
+# file: http_client.py
+
+import codecs
+import logging
+import os
+import re
+import ssl
+import threading
+import time
+import weakref
+from typing import Dict, Optional, Tuple, Union
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import (DEFAULT_CA_BUNDLE_PATH, get_encoding_from_headers,
+                            select_proxy)
+from urllib3.exceptions import (ConnectTimeoutError, MaxRetryError,
+                                ProtocolError, ReadTimeoutError)
+from urllib3.util.retry import Retry
+
+try:
+    import httpx
+except ImportError:       # optional: only needed for http2=True
+    httpx = None
+
+from text_extract import TextExtractor, DEFAULT_MAX_CHARS
+
+logger = logging.getLogger(__name__)
+
+# Browser-like User-Agent; some sites answer 403 to the requests default
+USER_AGENT = (
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) '
+    'AppleWebKit/537.36 (KHTML, like Gecko) '
+    'Chrome/114.0.0.0 Safari/537.36'
+)
+DEFAULT_TIMEOUT: Tuple[float, float] = (5.0, 15.0)   # (connect, read) seconds
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024
+HTML_TYPES = ('text/html', 'application/xhtml+xml')
+_META_CHARSET = re.compile(rb'<meta[^>]+charset=["\']?([\w.:-]+)', re.IGNORECASE)
+# A byte-order mark overrides any declared charset (as in browsers)
+_BOMS = ((codecs.BOM_UTF8, 'utf-8-sig'),
+         (codecs.BOM_UTF16_LE, 'utf-16'),
+         (codecs.BOM_UTF16_BE, 'utf-16'))
+
+Timeout = Union[float, Tuple[float, float]]
+
+
+def default_retry() -> Retry:
+    """
+    Retry policy shared by every session: transient 5xx answers are retried
+    with backoff, a failed connect only once (see host_health for hosts that
+    stay down). 429 is left to politeness.HostScheduler.
+    """
+    return Retry(
+        total=3,
+        connect=1,
+        backoff_factor=0.5,
+        status_forcelist=[500, 502, 503, 504],
+        allowed_methods=frozenset(['HEAD', 'GET', 'OPTIONS'])
+    )
+
+
+class PooledAdapter(HTTPAdapter):
+    def __init__(self, timeout: Timeout = DEFAULT_TIMEOUT, **kwargs):
+        """
+        HTTPAdapter with a default (connect, read) timeout and counters of
+        new versus reused keep-alive connections.
+
+        Args:
+            timeout (Timeout): Used when a request passes no timeout.
+            **kwargs: pool_connections, pool_maxsize, max_retries, ...
+        """
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._retired = [0, 0]    # connections, requests of evicted pools
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        # Keep the counts of per-host pools dropped from the LRU
+        self.poolmanager.pools.dispose_func = self._retire
+
+    def _retire(self, pool):
+        with self._lock:
+            self._retired[0] += pool.num_connections
+            self._retired[1] += pool.num_requests
+        pool.close()
+
+    def send(self, request, stream=False, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = self.timeout
+        return super().send(request, stream=stream, timeout=timeout, **kwargs)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            connections, requests_ = self._retired
+        pools = self.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                connections += pool.num_connections
+                requests_ += pool.num_requests
+        return {'requests': requests_, 'new_connections': connections}
+
+
+class _HTTPXBody:
+    """File-like view of a streamed httpx response, for requests.Response.raw."""
+
+    def __init__(self, resp):
+        self._resp = resp
+        self._chunks = resp.iter_bytes()
+        self._buf = b''
+
+    def read(self, amt=None, decode_content=True) -> bytes:
+        if amt is None:
+            data, self._buf = self._buf + b''.join(self._chunks), b''
+            return data
+        while len(self._buf) < amt:
+            try:
+                self._buf += next(self._chunks)
+            except StopIteration:
+                break
+        data, self._buf = self._buf[:amt], self._buf[amt:]
+        return data
+
+    def stream(self, amt=64 * 1024, decode_content=True):
+        while True:
+            chunk = self.read(amt)
+            if not chunk:
+                break
+            yield chunk
+
+    def close(self):
+        self._resp.close()
+
+    release_conn = close
+
+
+class _RetryView:
+    """Just enough of a urllib3 response for Retry.increment() and sleep()."""
+
+    def __init__(self, resp):
+        self.status = resp.status_code
+        self.headers = resp.headers
+
+    def get_redirect_location(self):
+        return False
+
+
+def _ssl_context(verify: Union[bool, str], cert) -> ssl.SSLContext:
+    """SSL context for requests' `verify` (bool or CA bundle/dir path) and
+    `cert` (path, or (cert, key) tuple) arguments."""
+    if verify is False:
+        ctx = ssl.create_default_context()
+        ctx.check_hostname = False
+        ctx.verify_mode = ssl.CERT_NONE
+    else:
+        ca = DEFAULT_CA_BUNDLE_PATH if verify is True else verify
+        ctx = (ssl.create_default_context(capath=ca) if os.path.isdir(ca)
+               else ssl.create_default_context(cafile=ca))
+    if cert:
+        ctx.load_cert_chain(*((cert,) if isinstance(cert, str) else cert))
+    return ctx
+
+
+def _urllib3_error(e: Exception) -> Exception:
+    """The urllib3 error Retry.increment() counts an httpx error as."""
+    if isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout,
+                      httpx.ProxyError)):
+        return ConnectTimeoutError(str(e))
+    if isinstance(e, httpx.ReadTimeout):
+        return ReadTimeoutError(None, None, str(e))
+    if isinstance(e, (httpx.ReadError, httpx.RemoteProtocolError)):
+        return ProtocolError(str(e))
+    return e
+
+
+class HTTP2Adapter(BaseAdapter):
+    def __init__(self, timeout: Timeout = DEFAULT_TIMEOUT,
+                 pool_maxsize: int = 10,
+                 max_retries: Optional[Retry] = None):
+        """
+        Transport adapter sending requests over HTTP/2 (falling back to
+        HTTP/1.1 per host) through httpx, so a session can multiplex many
+        requests to one host over a single connection.
+
+        Behaves like PooledAdapter otherwise: the urllib3 retry policy is
+        applied to connect/read errors and retryable statuses, and each
+        request's verify/cert/proxies are honoured (one httpx client per
+        combination in use).
+
+        Requires the optional `httpx[http2]` package.
+
+        Args:
+            timeout (Timeout): Used when a request passes no timeout.
+            pool_maxsize (int): Keep-alive connections kept per client.
+            max_retries (Optional[Retry]): default_retry() if unset.
+        """
+        if httpx is None:
+            raise ImportError("http2=True requires the httpx[http2] package")
+        super().__init__()
+        self.timeout = timeout
+        self.pool_maxsize = pool_maxsize
+        self.max_retries = max_retries or default_retry()
+        self._clients: Dict[tuple, "httpx.Client"] = {}
+        self._lock = threading.Lock()
+        self._seen = weakref.WeakSet()
+        self._requests = 0
+        self._connections = 0
+
+    def _client(self, verify, cert, proxy: Optional[str]) -> "httpx.Client":
+        key = (verify, cert, proxy)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = self._clients[key] = httpx.Client(
+                    transport=httpx.HTTPTransport(
+                        http2=True, verify=_ssl_context(verify, cert),
+                        proxy=proxy, trust_env=False,
+                        limits=httpx.Limits(
+                            max_keepalive_connections=self.pool_maxsize)),
+                    follow_redirects=False,  # requests.Session follows them
+                    trust_env=False)         # requests resolved env settings
+            return client
+
+    def send(self, request, stream=False, timeout=None, verify=True,
+             cert=None, proxies=None):
+        timeout = self.timeout if timeout is None else timeout
+        connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+        client = self._client(verify, cert,
+                              select_proxy(request.url, proxies or {}))
+        retry = self.max_retries
+        while True:
+            try:
+                req = client.build_request(
+                    request.method, request.url, headers=dict(request.headers),
+                    content=request.body,
+                    timeout=httpx.Timeout(read, connect=connect))
+                resp = client.send(req, stream=True)
+            except httpx.TransportError as e:
+                try:
+                    retry = retry.increment(request.method, request.url,
+                                            error=_urllib3_error(e))
+                except Exception:
+                    raise self._requests_error(e, request)
+                retry.sleep()
+                continue
+            self._count(resp)
+            if not retry.is_retry(request.method, resp.status_code,
+                                  'Retry-After' in resp.headers):
+                break
+            try:
+                retry = retry.increment(request.method, request.url,
+                                        response=_RetryView(resp))
+            except MaxRetryError as e:
+                if retry.raise_on_status:
+                    resp.close()
+                    raise requests.exceptions.RetryError(e, request=request)
+                break
+            resp.close()
+            retry.sleep(_RetryView(resp))
+
+        response = requests.Response()
+        response.status_code = resp.status_code
+        response.headers = CaseInsensitiveDict(resp.headers.items())
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.reason = resp.reason_phrase
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        response.raw = _HTTPXBody(resp)
+        if not stream:
+            response.content
+        return response
+
+    @staticmethod
+    def _requests_error(e: Exception, request) -> requests.RequestException:
+        if isinstance(e, httpx.ProxyError):
+            return requests.exceptions.ProxyError(e, request=request)
+        cause = e
+        for _ in range(4):     # httpx -> httpcore -> ssl.SSLError
+            cause = cause.__cause__ or cause.__context__
+            if cause is None:
+                break
+            if isinstance(cause, ssl.SSLError):
+                return requests.exceptions.SSLError(e, request=request)
+        if isinstance(e, httpx.ConnectTimeout):
+            return requests.ConnectTimeout(e, request=request)
+        if isinstance(e, httpx.TimeoutException):
+            return requests.ReadTimeout(e, request=request)
+        return requests.ConnectionError(e, request=request)
+
+    def _count(self, resp: "httpx.Response"):
+        # The documented 'network_stream' response extension is the same
+        # object for every request sent over one connection
+        stream = resp.extensions.get('network_stream')
+        with self._lock:
+            self._requests += 1
+            if stream is None or stream not in self._seen:
+                if stream is not None:
+                    self._seen.add(stream)
+                self._connections += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'requests': self._requests,
+                    'new_connections': self._connections}
+
+    def close(self):
+        with self._lock:
+            clients, self._clients = list(self._clients.values()), {}
+        for client in clients:
+            client.close()
+
+
+def make_session(pool_maxsize: int = 10,
+                 pool_connections: int = 10,
+                 timeout: Timeout = DEFAULT_TIMEOUT,
+                 retries: Optional[Retry] = None,
+                 http2: bool = False) -> requests.Session:
+    """
+    Build the requests.Session every fetching class uses.
+
+    Args:
+        pool_maxsize (int): Keep-alive connections kept per host (set it to
+            the number of threads fetching the same host).
+        pool_connections (int): Hosts whose connection pools are kept.
+        timeout (Timeout): Default (connect, read) timeout.
+        retries (Optional[Retry]): urllib3 retry policy; default_retry() if
+            unset.
+        http2 (bool): Send https:// requests over HTTP/2 (needs httpx[http2]).
+
+    Returns:
+        requests.Session: With the shared User-Agent and pooled adapters.
+    """
+    session = requests.Session()
+    adapter = PooledAdapter(timeout=timeout,
+                            max_retries=retries or default_retry(),
+                            pool_connections=pool_connections,
+                            pool_maxsize=pool_maxsize)
+    session.mount("http://", adapter)
+    session.mount("https://", HTTP2Adapter(timeout=timeout,
+                                           pool_maxsize=pool_maxsize,
+                                           max_retries=retries)
+                  if http2 else adapter)
+    session.headers.update({'User-Agent': USER_AGENT})
+    return session
+
+
+def connection_stats(session: requests.Session) -> Dict[str, int]:
+    """
+    Requests sent and connections opened by a make_session() session.
+
+    Returns:
+        Dict[str, int]: {'requests', 'new_connections', 'reused'}, where
+        'reused' counts requests that went over an existing keep-alive
+        connection.
+    """
+    totals = {'requests': 0, 'new_connections': 0}
+    adapters = {id(a): a for a in session.adapters.values()}
+    for adapter in adapters.values():
+        if hasattr(adapter, 'stats'):
+            for key, value in adapter.stats().items():
+                totals[key] += value
+    totals['reused'] = max(0, totals['requests'] - totals['new_connections'])
+    return totals
+
+
+def is_html(content_type: str) -> bool:
+    """True for HTML content types; a missing header is given the benefit of the doubt."""
+    mime = content_type.split(';', 1)[0].strip().lower()
+    return not mime or mime in HTML_TYPES
+
+
+def detect_encoding(resp: requests.Response, head: bytes) -> str:
+    """
+    Pick a body encoding: byte-order mark, then header charset, then
+    <meta charset>, then UTF-8. The BOM codecs strip the mark itself.
+    """
+    for bom, encoding in _BOMS:
+        if head.startswith(bom):
+            return encoding
+    if 'charset' in resp.headers.get('Content-Type', '').lower() and resp.encoding:
+        encoding = resp.encoding
+    else:
+        m = _META_CHARSET.search(head[:4096])
+        encoding = m.group(1).decode('ascii') if m else 'utf-8'
+    try:
+        codecs.lookup(encoding)
+    except LookupError:
+        encoding = 'utf-8'
+    return encoding
+
+
+def stream_text(resp: requests.Response, max_bytes: int,
+                max_chars: Optional[int] = DEFAULT_MAX_CHARS,
+                parser: str = 'auto',
+                chunk_size: int = 64 * 1024,
+                digest=None,
+                timings: Optional[Dict[str, float]] = None) -> Tuple[str, int]:
+    """
+    Decode and extract text from a streamed response chunk by chunk.
+
+    Reading stops at `max_bytes` of body or once `max_chars` of text have
+    been extracted, whichever comes first; the full page is never held in
+    memory. If given, `digest` (a hashlib object) is updated with every
+    body byte read, and `timings` has the seconds spent reading the body
+    ('download') and decoding/extracting it ('parse') added to it.
+
+    Returns:
+        Tuple[str, int]: (extracted text, body bytes read)
+    """
+    extractor = TextExtractor(max_chars=max_chars, parser=parser)
+    decoder = None
+    nbytes = 0
+    download = parse = 0.0
+    chunks = resp.iter_content(chunk_size=chunk_size)
+    while True:
+        t0 = time.perf_counter()
+        chunk = next(chunks, None)
+        t1 = time.perf_counter()
+        download += t1 - t0
+        if chunk is None:
+            break
+        if decoder is None:
+            decoder = codecs.getincrementaldecoder(
+                detect_encoding(resp, chunk))(errors='replace')
+        chunk = chunk[:max_bytes - nbytes]
+        nbytes += len(chunk)
+        if digest is not None:
+            digest.update(chunk)
+        more = extractor.feed(decoder.decode(chunk))
+        parse += time.perf_counter() - t1
+        if not more:
+            break
+        if nbytes >= max_bytes:
+            logger.debug("Body of %s capped at %d bytes", resp.url, max_bytes)
+            break
+    t1 = time.perf_counter()
+    if decoder is not None:
+        extractor.feed(decoder.decode(b'', final=True))
+    text = extractor.close()
+    if timings is not None:
+        timings['download'] = timings.get('download', 0.0) + download
+        timings['parse'] = (timings.get('parse', 0.0) + parse
+                            + time.perf_counter() - t1)
+    return text, nbytes
@@ -0,0 +1,322 @@
+# file: metrics.py
+
+import os
+import json
+import time
+import socket
+import logging
+import threading
+from bisect import bisect_left
+from datetime import datetime
+from typing import (Any, Callable, Dict, Iterable, Iterator, List, Optional,
+                    Sequence, Tuple)
+
+import urllib3.connection
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds; a last +Inf bucket is implied
+DEFAULT_BUCKETS: Tuple[float, ...] = (0.0005, 0.001, 0.0025, 0.005, 0.01,
+                                      0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                                      5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'count', 'sum', 'min', 'max')
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate from the buckets, interpolating inside the hit bucket."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lo = self.buckets[i - 1] if i else 0.0
+                hi = self.buckets[i] if i < len(self.buckets) else self.max
+                lo, hi = max(lo, self.min), min(hi, self.max)
+                return lo + (hi - lo) * (rank - seen) / n
+            seen += n
+        return self.max
+
+    def to_dict(self) -> Dict[str, Any]:
+        p50, p90, p99 = (self.quantile(q) for q in (0.5, 0.9, 0.99))
+        return {'count': self.count, 'sum': round(self.sum, 6),
+                'min': round(self.min, 6) if self.count else None,
+                'max': round(self.max, 6),
+                'p50': p50 and round(p50, 6), 'p90': p90 and round(p90, 6),
+                'p99': p99 and round(p99, 6),
+                'buckets': dict(zip([str(b) for b in self.buckets] + ['+Inf'],
+                                    self.counts))}
+
+
+class _Timer:
+    __slots__ = ('metrics', 'stage', 'host', 'start')
+
+    def __init__(self, metrics: 'Metrics', stage: str, host: Optional[str]):
+        self.metrics, self.stage, self.host = metrics, stage, host
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe(self.stage, time.perf_counter() - self.start,
+                             self.host)
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Metrics:
+    def __init__(self, enabled: bool = True, per_host: bool = True,
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        """
+        Per-stage timing histograms for a run.
+
+        Stages are dotted names such as 'validate.ttfb' or 'db.commit'; each
+        gets one histogram overall and, with `per_host`, one per host.
+        A disabled instance records nothing: timer() hands back a shared
+        no-op context manager and observe() returns at once, so fetching
+        classes can call them unconditionally.
+
+        Args:
+            enabled (bool): Record observations.
+            per_host (bool): Also keep histograms per (stage, host).
+            buckets (Sequence[float]): Histogram upper bounds in seconds.
+        """
+        self.enabled = enabled
+        self.per_host = per_host
+        self.buckets = tuple(sorted(buckets))
+        self.started_at = datetime.utcnow()
+        self._stages: Dict[str, Histogram] = {}
+        self._hosts: Dict[Tuple[str, str], Histogram] = {}
+        self._lock = threading.Lock()
+
+    def timer(self, stage: str, host: Optional[str] = None):
+        """Context manager recording the time spent in its block."""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, stage, host)
+
+    def timed(self, fn: Callable[..., Any], stage: str,
+              host: Optional[str] = None) -> Callable[..., Any]:
+        """`fn` wrapped so every call is recorded; `fn` itself when disabled."""
+        if not self.enabled:
+            return fn
+
+        def call(*args, **kwargs):
+            with self.timer(stage, host):
+                return fn(*args, **kwargs)
+        return call
+
+    def timed_iter(self, iterable: Iterable[Any], stage: str,
+                   host: Optional[str] = None) -> Iterator[Any]:
+        """Iterate `iterable`, recording how long each item took to produce."""
+        if not self.enabled:
+            return iter(iterable)
+        return self._timed_iter(iter(iterable), stage, host)
+
+    def _timed_iter(self, it: Iterator[Any], stage: str,
+                    host: Optional[str]) -> Iterator[Any]:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            self.observe(stage, time.perf_counter() - start, host)
+            yield item
+
+    def observe(self, stage: str, seconds: float, host: Optional[str] = None):
+        if not self.enabled:
+            return
+        with self._lock:
+            hist = self._stages.get(stage)
+            if hist is None:
+                hist = self._stages[stage] = Histogram(self.buckets)
+            hist.observe(seconds)
+            if host and self.per_host:
+                hist = self._hosts.get((stage, host))
+                if hist is None:
+                    hist = self._hosts[(stage, host)] = Histogram(self.buckets)
+                hist.observe(seconds)
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Returns:
+            Dict[str, Any]: {'started_at', 'finished_at', 'stages': {stage:
+            histogram}, 'hosts': {stage: {host: histogram}}}, histograms as
+            Histogram.to_dict().
+        """
+        with self._lock:
+            stages = {s: h.to_dict() for s, h in sorted(self._stages.items())}
+            hosts: Dict[str, Dict[str, Any]] = {}
+            for (stage, host), h in sorted(self._hosts.items()):
+                hosts.setdefault(stage, {})[host] = h.to_dict()
+        return {'started_at': self.started_at.isoformat(timespec='seconds'),
+                'finished_at': datetime.utcnow().isoformat(timespec='seconds'),
+                'stages': stages, 'hosts': hosts}
+
+    def log_summary(self, log: logging.Logger = logger):
+        """One INFO line per stage: count, total, p50 and p99."""
+        for stage, h in self.summary()['stages'].items():
+            log.info("%-20s n=%-7d total=%8.2fs p50=%7.1fms p99=%7.1fms",
+                     stage, h['count'], h['sum'], (h['p50'] or 0) * 1000,
+                     (h['p99'] or 0) * 1000)
+
+    def write_jsonl(self, path: str, **extra: Any):
+        """Append the run summary (plus `extra` fields) as one JSON line."""
+        if not self.enabled:
+            return
+        record = dict(extra, **self.summary())
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + '\n')
+        logger.info("Metrics summary appended to %s", path)
+
+    def write_prometheus(self, path: str, prefix: str = 'hrd'):
+        """
+        Write the histograms in the Prometheus text exposition format, e.g.
+        for node_exporter's textfile collector. The file is replaced
+        atomically.
+        """
+        if not self.enabled:
+            return
+        # Per-host series get their own name so sums over stages stay right
+        name, host_name = f"{prefix}_stage_seconds", f"{prefix}_stage_host_seconds"
+        lines = [f"# HELP {name} Time spent per pipeline stage.",
+                 f"# TYPE {name} histogram"]
+        with self._lock:
+            for stage, h in sorted(self._stages.items()):
+                lines.extend(_prometheus_histogram(name, {'stage': stage}, h))
+            if self._hosts:
+                lines += [f"# HELP {host_name} Time spent per pipeline stage "
+                          f"and host.", f"# TYPE {host_name} histogram"]
+            for (stage, host), h in sorted(self._hosts.items()):
+                lines.extend(_prometheus_histogram(
+                    host_name, {'stage': stage, 'host': host}, h))
+        tmp = path + '.part'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp, path)
+        logger.info("Prometheus metrics written to %s", path)
+
+    def instrument_network(self):
+        """
+        Time DNS lookups ('http.dns') and connection setup ('http.connect',
+        TCP plus TLS, DNS excluded) of every urllib3 connection.
+
+        Patches socket.getaddrinfo and urllib3's connect(); call it after
+        host_health.install_dns_cache() so cache hits are what gets timed.
+        Undo with uninstrument_network().
+        """
+        global _network_metrics
+        if not self.enabled:
+            return
+        with _patch_lock:
+            _network_metrics = self
+            if socket.getaddrinfo is not _timed_getaddrinfo:
+                _saved['getaddrinfo'] = socket.getaddrinfo
+                socket.getaddrinfo = _timed_getaddrinfo
+            for cls in (urllib3.connection.HTTPConnection,
+                        urllib3.connection.HTTPSConnection):
+                connect = cls.__dict__.get('connect')
+                if connect is not None and cls not in _saved:
+                    _saved[cls] = connect
+                    cls.connect = _timed_connect(connect)
+
+
+# Metrics that never record anything; the default of every fetching class
+NULL_METRICS = Metrics(enabled=False)
+
+
+def _label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _prometheus_histogram(name: str, labels: Dict[str, str],
+                          h: Histogram) -> List[str]:
+    base = ','.join(f'{k}="{_label(v)}"' for k, v in labels.items())
+    out = []
+    cumulative = 0
+    for bound, n in zip(list(h.buckets) + ['+Inf'], h.counts):
+        cumulative += n
+        out.append(f'{name}_bucket{{{base},le="{bound}"}} {cumulative}')
+    out.append(f'{name}_sum{{{base}}} {h.sum:.6f}')
+    out.append(f'{name}_count{{{base}}} {h.count}')
+    return out
+
+
+# --- network hooks -----------------------------------------------------------
+
+_patch_lock = threading.Lock()
+_saved: Dict[Any, Any] = {}
+_network_metrics: Metrics = NULL_METRICS
+_dns_time = threading.local()
+
+
+def _timed_getaddrinfo(host, *args, **kwargs):
+    start = time.perf_counter()
+    try:
+        return _saved['getaddrinfo'](host, *args, **kwargs)
+    finally:
+        elapsed = time.perf_counter() - start
+        _dns_time.total = getattr(_dns_time, 'total', 0.0) + elapsed
+        if isinstance(host, bytes):
+            host = host.decode('ascii', 'replace')
+        _network_metrics.observe('http.dns', elapsed, host)
+
+
+def _timed_connect(connect):
+    def timed(conn, *args, **kwargs):
+        dns_before = getattr(_dns_time, 'total', 0.0)
+        start = time.perf_counter()
+        try:
+            return connect(conn, *args, **kwargs)
+        finally:
+            dns = getattr(_dns_time, 'total', 0.0) - dns_before
+            _network_metrics.observe('http.connect',
+                                     time.perf_counter() - start - dns,
+                                     conn.host)
+    return timed
+
+
+def uninstrument_network():
+    """Remove the hooks installed by Metrics.instrument_network()."""
+    global _network_metrics
+    with _patch_lock:
+        if 'getaddrinfo' in _saved and socket.getaddrinfo is _timed_getaddrinfo:
+            socket.getaddrinfo = _saved.pop('getaddrinfo')
+        for cls in (urllib3.connection.HTTPConnection,
+                    urllib3.connection.HTTPSConnection):
+            original = _saved.pop(cls, None)
+            if original is not None:
+                cls.connect = original
+        _network_metrics = NULL_METRICS
@@ -0,0 +1,109 @@
+# file: name_matcher.py
+
+from functools import lru_cache
+from typing import Iterator, List, Optional, Tuple
+
+from rapidfuzz import fuzz
+
+EXACT = 'exact'
+SURNAME = 'surname'
+TOKEN = 'token'
+FUZZY = 'fuzzy'
+
+
+def normalize(text: Optional[str]) -> str:
+    """Collapse whitespace and lower-case, as the validator does for pages."""
+    return " ".join((text or "").split()).lower()
+
+
+class NameMatcher:
+    def __init__(self, name: Optional[str], fuzzy_threshold: int = 75,
+                 hint_len: int = 3):
+        """
+        Precompiled name-matching cascade for one defender.
+
+        Build once per profile and reuse it for every page of that profile.
+        The cascade is cheapest-first: exact full name, surname substring,
+        any whole name token, then fuzzy matching. All scans use str.find,
+        which is far faster than a regex alternation over a long page. The
+        fuzzy step only scores short windows around places where a token
+        prefix occurs instead of the whole page, so long articles cost little.
+
+        Args:
+            name (Optional[str]): The defender's name as stored on Profile.
+            fuzzy_threshold (int): Minimum fuzz.partial_ratio score.
+            hint_len (int): Token prefix length used to find fuzzy windows.
+        """
+        self.name = normalize(name)
+        self.tokens: List[str] = self.name.split()
+        self.token_set = frozenset(self.tokens)
+        self.surname = self.tokens[-1] if self.tokens else ""
+        self.fuzzy_threshold = fuzzy_threshold
+        self.hints: Tuple[str, ...] = tuple(sorted({tok[:hint_len]
+                                                    for tok in self.tokens}))
+
+    def match(self, norm_text: str) -> Optional[str]:
+        """
+        Match against normalized page text (see normalize()).
+
+        Returns:
+            Optional[str]: The strategy that matched ('exact', 'surname',
+            'token' or 'fuzzy'), or None.
+        """
+        if not self.name:
+            return None
+        if self.name in norm_text:
+            return EXACT
+        if self.surname in norm_text:
+            return SURNAME
+        if any(_is_word_at(norm_text, i, len(tok))
+               for tok in self.token_set for i in _find_all(norm_text, tok)):
+            return TOKEN
+        if self._fuzzy(norm_text):
+            return FUZZY
+        return None
+
+    def _fuzzy(self, norm_text: str) -> bool:
+        for start, end in self._windows(norm_text):
+            score = fuzz.partial_ratio(self.name, norm_text[start:end],
+                                       score_cutoff=self.fuzzy_threshold)
+            if score >= self.fuzzy_threshold:
+                return True
+        return False
+
+    def _windows(self, norm_text: str) -> List[Tuple[int, int]]:
+        """Merged text spans around token-prefix hits, each ~3 names wide."""
+        span = len(self.name)
+        hits = sorted(i for h in self.hints for i in _find_all(norm_text, h))
+        windows: List[Tuple[int, int]] = []
+        for i in hits:
+            start = max(0, i - span)
+            end = i + 2 * span
+            if windows and start <= windows[-1][1]:
+                windows[-1] = (windows[-1][0], end)
+            else:
+                windows.append((start, end))
+        return windows
+
+
+def _find_all(text: str, sub: str) -> Iterator[int]:
+    i = text.find(sub)
+    while i != -1:
+        yield i
+        i = text.find(sub, i + 1)
+
+
+def _is_word_char(ch: str) -> bool:
+    return ch.isalnum() or ch == '_'
+
+
+def _is_word_at(text: str, i: int, n: int) -> bool:
+    """True if text[i:i+n] is bounded like regex \\b...\\b."""
+    return ((i == 0 or not _is_word_char(text[i - 1]))
+            and (i + n == len(text) or not _is_word_char(text[i + n])))
+
+
+@lru_cache(maxsize=4096)
+def get_matcher(name: Optional[str]) -> NameMatcher:
+    """Cached NameMatcher per profile name."""
+    return NameMatcher(name)
@@ -1,148 +1,545 @@
-import time
+import asyncio
+import hashlib
 import logging
-import re
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Optional, List
+from typing import (Any, Callable, Dict, Iterable, Iterator, List,
+                    NamedTuple, Optional, Set, Tuple)
 
 import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
-from bs4 import BeautifulSoup
+from sqlalchemy import func, select
 from sqlalchemy.orm import Session
-from sqlalchemy.exc import SQLAlchemyError
 from tqdm import tqdm
-from rapidfuzz import fuzz   # new import
 
-from db import URL
+from db import URL, PageContent, Profile, ensure_canonical_urls
+from batch_writer import BatchWriter
+from name_matcher import get_matcher
+from text_extract import DEFAULT_MAX_CHARS
+from http_client import (DEFAULT_MAX_BYTES, connection_stats, is_html,
+                         make_session, stream_text)
+from politeness import HostScheduler, host_of, interleave_hosts
+from host_health import HostHealth
+from metrics import Metrics, NULL_METRICS
+from work_queue import WorkQueue
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
+# What checking a URL needs: no page text, no ORM identity map. The
+# profile name comes in through a join instead of one lazy load per row.
+_PENDING_COLUMNS = (URL.url_id, URL.url, Profile.name.label('name'),
+                    URL.etag, URL.last_modified, URL.content_hash)
+DEFAULT_CHUNK_SIZE = 1000
+
+# (row, check_url() result) pairs produced by one unit of work
+_Results = List[Tuple[Any, Dict[str, Any]]]
+
+
+class _SharedURL(NamedTuple):
+    """Rows whose links share a canonical URL; `url` is the one fetched."""
+    url: str
+    rows: List[Any]
+
+
+def _previous(url_rec: Any) -> Dict[str, Any]:
+    """Cache validators from a URL's last check, for check_url(prev=...)."""
+    return {'etag': url_rec.etag,
+            'last_modified': url_rec.last_modified,
+            'content_hash': url_rec.content_hash}
+
 
 class URLValidator:
-    def __init__(self, db_session: Session, delay: float = 1.0):
+    def __init__(self, db_session: Session, delay: float = 1.0,
+                 concurrency: int = 1,
+                 scheduler: Optional[HostScheduler] = None,
+                 max_bytes: int = DEFAULT_MAX_BYTES,
+                 max_chars: Optional[int] = DEFAULT_MAX_CHARS,
+                 parser: str = 'auto',
+                 batch_size: int = 100,
+                 flush_interval: float = 5.0,
+                 health: Optional[HostHealth] = None,
+                 session: Optional[requests.Session] = None,
+                 metrics: Optional[Metrics] = None):
+        """
+        Args:
+            db_session (Session): Active SQLAlchemy session.
+            delay (float): Minimum interval between requests to the same host
+                (used when no scheduler is given).
+            concurrency (int): Number of URLs checked at once. 1 keeps
+                the original serial loop; >1 uses the asyncio engine.
+            scheduler (Optional[HostScheduler]): Shared per-host politeness.
+            max_bytes (int): Cap on the body bytes read per page.
+            max_chars (Optional[int]): Cap on the text extracted per page.
+            parser (str): Text extraction backend ('auto', 'lxml',
+                'html.parser'); see text_extract.
+            batch_size (int): Results committed per transaction.
+            flush_interval (float): Max seconds a result waits before commit.
+            health (Optional[HostHealth]): Per-host circuit breaker; URLs of
+                hosts whose circuit is open are marked inactive without a
+                request.
+            session (Optional[requests.Session]): Shared HTTP client (see
+                http_client.make_session); one sized for `concurrency` is
+                built if unset.
+            metrics (Optional[Metrics]): Per-stage timings: 'validate.ttfb',
+                'validate.download', 'validate.parse', 'validate.match' and
+                'validate.url' per host, plus 'db.commit'.
+        """
         self.db = db_session
+        self.metrics = metrics or NULL_METRICS
+        self.writer = BatchWriter(db_session, batch_size=batch_size,
+                                  flush_interval=flush_interval,
+                                  metrics=self.metrics)
         self.delay = delay
+        self.scheduler = scheduler or HostScheduler(min_interval=delay)
+        self.concurrency = max(1, concurrency)
+        self.max_bytes = max_bytes
+        self.max_chars = max_chars
+        self.parser = parser
+        self.health = health or HostHealth()
 
-        # Session with retries
-        self.session = requests.Session()
-        retries = Retry(
-            total=3,
-            backoff_factor=0.5,
-            status_forcelist=[500, 502, 503, 504],
-            allowed_methods=frozenset(['HEAD', 'GET', 'OPTIONS'])
-        )
-        adapter = HTTPAdapter(max_retries=retries)
-        self.session.mount("http://", adapter)
-        self.session.mount("https://", adapter)
-
-        self.session.headers.update({
-            'User-Agent': (
-                'Mozilla/5.0 (Windows NT 10.0; Win64; x64) '
-                'AppleWebKit/537.36 (KHTML, like Gecko) '
-                'Chrome/114.0.0.0 Safari/537.36'
-            )
-        })
+        # One pooled connection per concurrent worker and host
+        self.session = session or make_session(
+            pool_maxsize=max(10, self.concurrency), pool_connections=100)
 
     def validate_batch(self,
                        limit: Optional[int] = None,
-                       force: bool = False
+                       force: bool = False,
+                       chunk_size: int = DEFAULT_CHUNK_SIZE,
+                       fetch_once: bool = False
                        ):
         """
         Validate URLs:
 
         - If force=False (default), only URLs with checked_at IS NULL.
         - If force=True, re-validate all URLs.
+        - With concurrency > 1, URLs are checked by the asyncio engine.
+        - With fetch_once=True, rows sharing a canonical URL (see
+          url_canon) are checked with one request: the page is fetched
+          once and every row's profile name is matched against that body.
+          `limit` then counts distinct URLs.
+
+        URLs are read `chunk_size` at a time by keyset pagination (on url_id,
+        or on canonical_url with fetch_once), as light rows (see
+        _PENDING_COLUMNS) rather than ORM objects, so memory stays flat
+        however many URLs are pending.
+        """
+        where = [] if force else [URL.checked_at.is_(None)]
+        if fetch_once:
+            ensure_canonical_urls(self.db.get_bind())
+            total = self.db.execute(select(func.count()).select_from(URL)
+                                    .where(*where)).scalar()
+            distinct = self.db.execute(
+                select(func.count(URL.canonical_url.distinct()))
+                .where(*where)).scalar()
+            logger.info("Validating %d URLs, %d distinct (limit=%s, "
+                        "force=%s, concurrency=%d)", total, distinct, limit,
+                        force, self.concurrency)
+            if limit and limit < distinct:
+                total = None    # rows behind the first `limit` URLs: unknown
+            chunks = self._shared_chunks(where, chunk_size, limit)
+        else:
+            total = self.db.execute(select(func.count()).select_from(URL)
+                                    .where(*where)).scalar()
+            if limit:
+                total = min(total, limit)
+            logger.info("Validating %d URLs (limit=%s, force=%s, "
+                        "concurrency=%d)", total, limit, force,
+                        self.concurrency)
+            chunks = self._pending_chunks(where, chunk_size, limit)
+
+        # Leaving the writer flushes pending results, also on Ctrl-C
+        with self.writer, tqdm(total=total, desc="Validating URLs",
+                               unit="url") as progress:
+            self._check_all(chunks, progress,
+                            check=self._check_shared if fetch_once else None)
+        self._log_stats()
+
+    def _pending_chunks(self, where: List[Any], chunk_size: int,
+                        limit: Optional[int] = None) -> Iterator[List[Any]]:
+        """
+        Rows matching `where`, in url_id order, `chunk_size` per list.
+
+        Each chunk resumes after the last url_id seen (WHERE url_id > :last,
+        served by the primary key) instead of using OFFSET, so later chunks
+        cost the same as the first and rows updated meanwhile are neither
+        skipped nor repeated.
+        """
+        chunk_size = max(1, chunk_size)
+        last_id = None
+        remaining = limit or None
+        while remaining is None or remaining > 0:
+            stmt = (select(*_PENDING_COLUMNS)
+                    .join(Profile, URL.profile_id == Profile.profile_id)
+                    .where(*where)
+                    .order_by(URL.url_id)
+                    .limit(chunk_size if remaining is None
+                           else min(chunk_size, remaining)))
+            if last_id is not None:
+                stmt = stmt.where(URL.url_id > last_id)
+            rows = self.db.execute(stmt).all()
+            if not rows:
+                return
+            yield rows
+            last_id = rows[-1].url_id
+            if remaining is not None:
+                remaining -= len(rows)
+
+    def _shared_chunks(self, where: List[Any], chunk_size: int,
+                       limit: Optional[int] = None
+                       ) -> Iterator[List[_SharedURL]]:
         """
-        q = self.db.query(URL)
+        Rows matching `where` grouped by canonical URL, `chunk_size` URLs
+        per list.
+
+        Pages through the distinct canonical URLs in order (keyset on the
+        canonical_url index) and loads each page's rows with one IN query,
+        so a URL's rows always land in the same chunk and it is fetched
+        once per run.
+        """
+        chunk_size = max(1, chunk_size)
+        last_key = None
+        remaining = limit or None
+        while remaining is None or remaining > 0:
+            keys = (select(URL.canonical_url).distinct()
+                    .where(URL.canonical_url.isnot(None), *where)
+                    .order_by(URL.canonical_url)
+                    .limit(chunk_size if remaining is None
+                           else min(chunk_size, remaining)))
+            if last_key is not None:
+                keys = keys.where(URL.canonical_url > last_key)
+            keys = self.db.execute(keys).scalars().all()
+            if not keys:
+                return
+            groups: Dict[str, List[Any]] = {}
+            for row in self.db.execute(
+                    select(*_PENDING_COLUMNS, URL.canonical_url)
+                    .join(Profile, URL.profile_id == Profile.profile_id)
+                    .where(URL.canonical_url.in_(keys), *where)
+                    .order_by(URL.url_id)):
+                groups.setdefault(row.canonical_url, []).append(row)
+            # Fetch a link as cited, preferring https (the key folds schemes)
+            yield [_SharedURL(next((r.url for r in rows
+                                    if r.url.lower().startswith('https:')),
+                                   rows[0].url), rows)
+                   for rows in groups.values()]
+            last_key = keys[-1]
+            if remaining is not None:
+                remaining -= len(keys)
+
+    def validate_queue(self, queue: WorkQueue,
+                       claim_size: int = 100,
+                       limit: Optional[int] = None,
+                       force: bool = False) -> int:
+        """
+        Validate URLs claimed from a shared jobs queue, so several workers
+        (processes or machines on one database) split the URL set.
+
+        Unchecked URLs (every URL with force=True) are enqueued first, which
+        is a no-op for URLs another worker already enqueued; finished jobs
+        stay finished even with force=True, so re-validating needs one
+        WorkQueue.reset() before the workers start. Jobs are then
+        claimed `claim_size` at a time until the queue is empty or `limit`
+        URLs were checked; each claim's results and job completions are
+        committed together before the next claim.
+
+        Returns:
+            int: URLs checked by this worker.
+        """
+        ids = select(URL.url_id)
         if not force:
-            q = q.filter(URL.checked_at.is_(None))
-        if limit:
-            q = q.limit(limit)
+            ids = ids.where(URL.checked_at.is_(None))
+        queue.enqueue(ids)
+
+        checked = 0
+        try:
+            while limit is None or checked < limit:
+                n = claim_size if limit is None else min(claim_size, limit - checked)
+                jobs = queue.claim(n)
+                if not jobs:
+                    break
+                pending = self.db.execute(
+                    select(*_PENDING_COLUMNS)
+                    .join(Profile, URL.profile_id == Profile.profile_id)
+                    .where(URL.url_id.in_(list(jobs)))).all()
+                logger.info("Claimed %d URLs (worker %s)", len(jobs),
+                            queue.worker_id)
+                self.writer.failures = []
+                with self.writer, tqdm(total=len(pending),
+                                       desc="Validating URLs",
+                                       unit="url") as progress:
+                    self._check_all([pending], progress,
+                                    after=lambda rec: queue.finish(
+                                        self.writer, jobs[rec.url_id],
+                                        key=rec.url))
+                    # Rows deleted since they were enqueued
+                    for url_id in set(jobs) - {rec.url_id for rec in pending}:
+                        queue.finish(self.writer, jobs[url_id])
+                failed = {f['key'] for f in self.writer.failures}
+                queue.retry((jobs[rec.url_id] for rec in pending
+                             if rec.url in failed), "result write failed")
+                checked += len(pending)
+        finally:
+            queue.release()
+        logger.info("Jobs: %s", queue.stats())
+        self._log_stats()
+        return checked
+
+    def _check_all(self, chunks: Iterable[List[Any]], progress: tqdm,
+                   after: Optional[Callable[[Any], None]] = None,
+                   check: Optional[Callable[[Any], _Results]] = None):
+        """Check and store the items of `chunks`; `after(url_rec)` runs once
+        a row's result has been queued with the writer.
+
+        `check(item)` returns (row, result) pairs; the default checks one
+        row per item, _check_shared a group of rows."""
+        check = check or self._check_row
+        if self.concurrency > 1:
+            asyncio.run(self._validate_async(chunks, progress, after, check))
+            return
+        for chunk in chunks:
+            for item in chunk:
+                self._store_results(check(item), progress, after)
+
+    def _check_row(self, url_rec: Any) -> _Results:
+        return [(url_rec, self.check_url(url_rec.url, url_rec.name,
+                                         _previous(url_rec)))]
+
+    def _check_shared(self, shared: _SharedURL) -> _Results:
+        """
+        Fetch a shared URL once and match each of its rows' profile names
+        against the body.
+
+        The request is conditional only when all rows carry the same cache
+        validators; otherwise each row counts as unchanged when the body
+        hash equals its own content_hash.
+        """
+        url, rows = shared
+        validators = {(r.etag, r.last_modified, r.content_hash) for r in rows}
+        prev = _previous(rows[0]) if len(validators) == 1 else None
+        host = host_of(url)
+        with self.metrics.timer('validate.url', host):
+            base, text = self._fetch_page(url, prev or {})
+        norm_text = text.lower() if text is not None else None
+        out = []
+        for row in rows:
+            result = dict(base)
+            if norm_text is not None:
+                if result['content_hash'] == row.content_hash:
+                    result['unchanged'] = True
+                else:
+                    self._match(result, text, norm_text, row.name, host)
+            out.append((row, result))
+        return out
 
-        pending: List[URL] = q.all()
-        logger.info("Validating %d URLs (limit=%s, force=%s)",
-                    len(pending), limit, force)
+    def _store_results(self, results: _Results,
+                       progress: tqdm,
+                       after: Optional[Callable[[Any], None]]):
+        for url_rec, result in results:
+            self._store_result(url_rec, result)
+            progress.update()
+            if after is not None:
+                after(url_rec)
 
-        for url_rec in tqdm(pending, desc="Validating URLs", unit="url"):
-            now = datetime.utcnow()
+    def _log_stats(self):
+        for host, st in self.health.stats().items():
+            logger.info("Host %s: circuit %s, %d URLs skipped",
+                        host, st['state'], st['skipped'])
+        logger.info("HTTP connections: %s", connection_stats(self.session))
+        self.metrics.log_summary(logger)
+        logger.info("Batch complete")
+
+    async def _validate_async(self, chunks: Iterable[List[Any]],
+                              progress: tqdm,
+                              after: Optional[Callable[[Any], None]],
+                              check: Callable[[Any], _Results]):
+        """
+        Check URLs concurrently, at most `self.concurrency` at a time.
+
+        Network work runs on a thread pool; ORM access and commits stay on
+        the event-loop thread, so the session is never shared across threads.
+        URLs are interleaved by host (within a chunk) so workers rarely queue
+        behind the same host's politeness interval. The next chunk is read
+        once no more than `concurrency` checks are left, so the workers never
+        run dry at a chunk boundary and at most about one chunk is held.
+        """
+        loop = asyncio.get_running_loop()
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def run(item: Any):
+            async with slots:
+                return await loop.run_in_executor(pool, check, item)
+
+        async def drain(running: Set[asyncio.Future], keep: int):
+            while len(running) > keep:
+                done, running = await asyncio.wait(
+                    running, return_when=asyncio.FIRST_COMPLETED)
+                for fut in done:
+                    self._store_results(fut.result(), progress, after)
+            return running
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            running: Set[asyncio.Future] = set()
+            for chunk in chunks:
+                running.update(asyncio.ensure_future(run(item))
+                               for item in interleave_hosts(chunk))
+                running = await drain(running, self.concurrency)
+            await drain(running, 0)
+
+    def check_url(self, url: str, name: Optional[str],
+                  prev: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Check one URL for liveness and for the defender's name.
+
+        Does no database access, so it is safe to call from worker threads.
+
+        Args:
+            url (str): URL to check.
+            name (Optional[str]): Defender name to look for.
+            prev (Optional[Dict[str, Any]]): 'etag', 'last_modified' and
+                'content_hash' from the previous check. They turn the GET
+                into a conditional request; a 304, or a body with the same
+                hash, is reported as unchanged.
+
+        Returns:
+            Dict[str, Any]: {'is_active', 'contains_name', 'page_text',
+                             'match_strategy', 'checked_at', 'etag',
+                             'last_modified', 'content_hash', 'unchanged'}
+                When 'unchanged' is True only 'is_active', 'checked_at' and
+                the cache validators are meaningful.
+        """
+        with self.metrics.timer('validate.url', host_of(url)):
+            return self._check_url(url, name, prev)
+
+    def _check_url(self, url: str, name: Optional[str],
+                   prev: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        result, text = self._fetch_page(url, prev or {})
+        if text is not None:
+            self._match(result, text, text.lower(), name, host_of(url))
+        return result
+
+    def _fetch_page(self, url: str, prev: Dict[str, Any]
+                    ) -> Tuple[Dict[str, Any], Optional[str]]:
+        """
+        GET `url` once: liveness, cache validators and body text.
+
+        Returns:
+            Tuple[Dict[str, Any], Optional[str]]: A check_url() result with
+            no name match yet, and the extracted text; None when the URL is
+            dead, not HTML, unreadable or unchanged.
+        """
+        result: Dict[str, Any] = {
+            'is_active': False,
+            'contains_name': False,
+            'page_text': None,
+            'match_strategy': None,
+            'checked_at': datetime.utcnow(),
+            'etag': None,
+            'last_modified': None,
+            'content_hash': None,
+            'unchanged': False
+        }
+
+        headers = {}
+        if prev.get('etag'):
+            headers['If-None-Match'] = prev['etag']
+        if prev.get('last_modified'):
+            headers['If-Modified-Since'] = prev['last_modified']
+
+        if not self.health.allow(url):
+            logger.debug("Circuit open for %s; marking inactive", url)
+            return result, None
+
+        # 1) Single streamed GET: the status decides liveness
+        try:
+            resp = self.scheduler.request(self.session.get, url,
+                                          stream=True, headers=headers)
+        except Exception as e:
+            logger.debug("GET failed for %s: %s", url, e)
+            self.health.record_failure(url, e)
+            return result, None
+        self.health.record_success(url)
+        host = host_of(url)
+        self.metrics.observe('validate.ttfb', resp.elapsed.total_seconds(), host)
+
+        with resp:
+            if resp.status_code == 304:
+                logger.debug("URL %s not modified", url)
+                result.update(is_active=True, unchanged=True,
+                              etag=resp.headers.get('ETag') or prev.get('etag'),
+                              last_modified=(resp.headers.get('Last-Modified')
+                                             or prev.get('last_modified')),
+                              content_hash=prev.get('content_hash'))
+                return result, None
+
+            result['is_active'] = resp.status_code < 400
+            logger.debug("URL %s status %d → is_active=%s",
+                         url, resp.status_code, result['is_active'])
+            if not result['is_active']:
+                return result, None
+            result['etag'] = resp.headers.get('ETag')
+            result['last_modified'] = resp.headers.get('Last-Modified')
 
-            # 1) Existence check: HEAD -> GET fallback
+            content_type = resp.headers.get('Content-Type', '')
+            if not is_html(content_type):
+                logger.debug("Skipping body of %s (%s)", url, content_type)
+                return result, None
+
+            # 2) Text of the same response body, for the name check
             try:
-                resp = self.session.head(url_rec.url, timeout=10, allow_redirects=True)
-                status = resp.status_code
-                if status >= 400:
-                    logger.debug("HEAD %d for %s; falling back to GET", status, url_rec.url)
-                    resp_get = self.session.get(url_rec.url, timeout=10, stream=True)
-                    status = resp_get.status_code
-                    resp_get.close()
-                url_rec.is_active = status < 400
-                logger.debug("URL %s status %d → is_active=%s",
-                             url_rec.url, status, url_rec.is_active)
+                digest = hashlib.sha256()
+                timings: Dict[str, float] = {}
+                raw_text, _ = stream_text(resp, self.max_bytes,
+                                          self.max_chars, self.parser,
+                                          digest=digest, timings=timings)
+                self.metrics.observe('validate.download', timings['download'],
+                                     host)
+                self.metrics.observe('validate.parse', timings['parse'], host)
+                result['content_hash'] = digest.hexdigest()
+                if result['content_hash'] == prev.get('content_hash'):
+                    # Server ignored the validators but the body is the same
+                    result['unchanged'] = True
+                    return result, None
             except Exception as e:
-                logger.debug("HEAD/GET existence check failed for %s: %s",
-                             url_rec.url, e)
-                url_rec.is_active = False
-
-            # Reset name & text
-            url_rec.contains_name = False
-            url_rec.page_text     = None
-
-            # 2) Content & name check
-            if url_rec.is_active:
-                try:
-                    full_html = self.session.get(url_rec.url, timeout=10).text
-                    soup      = BeautifulSoup(full_html, 'html.parser')
-                    raw_text  = soup.get_text(separator=' ', strip=True)
-                    norm_text = " ".join(raw_text.split()).lower()
-
-                    raw_name  = url_rec.profile.name or ""
-                    norm_name = " ".join(raw_name.split()).lower()
-                    found = False
-
-                    # A) Exact full-name
-                    if norm_name and norm_name in norm_text:
-                        found = True
-
-                    # B) Surname only
-                    if not found:
-                        surname = norm_name.split()[-1] if norm_name else ""
-                        if surname and surname in norm_text:
-                            found = True
-
-                    # C) Fuzzy match on full-name
-                    if not found and norm_name:
-                        score = fuzz.partial_ratio(norm_name, norm_text)
-                        logger.debug("Fuzzy score %d for '%s' in %s",
-                                     score, norm_name, url_rec.url)
-                        if score >= 75:
-                            found = True
-
-                    # D) Regex any token match
-                    if not found and norm_name:
-                        tokens = norm_name.split()
-                        pattern = r"\b(" + "|".join(re.escape(tok) for tok in tokens) + r")\b"
-                        if re.search(pattern, norm_text, flags=re.IGNORECASE):
-                            found = True
-
-                    if found:
-                        url_rec.contains_name = True
-                        url_rec.page_text     = raw_text
-
-                except Exception as e:
-                    logger.debug("Content fetch/search failed for %s: %s",
-                                 url_rec.url, e)
-
-            # 3) Timestamp
-            url_rec.checked_at = now
-
-            # Commit & delay
-            try:
-                self.db.commit()
-            except SQLAlchemyError as e:
-                logger.error("DB commit failed for %s: %s", url_rec.url, e)
-                self.db.rollback()
+                logger.debug("Content read failed for %s: %s", url, e)
+                return result, None
 
-            time.sleep(self.delay)
+        return result, raw_text
 
-        logger.info("Batch complete")
+    def _match(self, result: Dict[str, Any], raw_text: str, norm_text: str,
+               name: Optional[str], host: str):
+        """Run the name cascade on a fetched body and record it in `result`."""
+        try:
+            with self.metrics.timer('validate.match', host):
+                strategy = get_matcher(name).match(norm_text)
+        except Exception as e:
+            logger.debug("Name search failed on %s: %s", host, e)
+            return
+        logger.debug("Name match on %s: %s", host, strategy)
+        if strategy:
+            result['contains_name']  = True
+            result['page_text']      = raw_text
+            result['match_strategy'] = strategy
+
+    def _store_result(self, url_rec: Any, result: Dict[str, Any]):
+        """
+        Queue a check_url() result for the write-behind buffer.
+
+        Until its batch is flushed the row keeps checked_at IS NULL, so an
+        interrupted run picks it up again. Page text goes to the deduplicated
+        page_content table; the urls row only keeps its hash.
+        """
+        values = dict(result, url_id=url_rec.url_id, page_hash=None)
+        if values.pop('unchanged'):
+            # Keep contains_name / page_hash / match_strategy as they were
+            for key in ('contains_name', 'page_text', 'match_strategy',
+                        'page_hash'):
+                values.pop(key)
+            self.writer.update(URL, values, key=url_rec.url)
+            return
+
+        text = values.pop('page_text')
+        if text is not None:
+            page = PageContent.row_for(text)
+            self.writer.insert_ignore(PageContent, page, key=url_rec.url)
+            values['page_hash'] = page['content_hash']
+        self.writer.update(URL, values, key=url_rec.url)
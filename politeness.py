@@ -0,0 +1,190 @@
+# file: politeness.py
+
+import time
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Sequence
+from urllib.parse import urlsplit
+
+import requests
+
+from metrics import Metrics, NULL_METRICS
+
+logger = logging.getLogger(__name__)
+
+
+def host_of(url: str) -> str:
+    """Scheduling key for a URL: its lower-cased host name ('' when the URL
+    cannot be parsed, so the request itself reports the error)."""
+    try:
+        return (urlsplit(url).hostname or '').lower()
+    except ValueError:    # e.g. 'http://[bad/'
+        return ''
+
+
+def interleave_hosts(records: Sequence[Any]) -> List[Any]:
+    """Round-robin records (anything with a `url`) across hosts, keeping
+    per-host order, so concurrent workers rarely queue behind one host."""
+    by_host: Dict[str, List[Any]] = {}
+    for rec in records:
+        by_host.setdefault(host_of(rec.url), []).append(rec)
+    queues = list(by_host.values())
+    out: List[Any] = []
+    for i in range(max((len(q) for q in queues), default=0)):
+        out.extend(q[i] for q in queues if i < len(q))
+    return out
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a Retry-After header (delta-seconds or HTTP-date) into seconds.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+class _HostState:
+    __slots__ = ('next_slot', 'tokens', 'refilled_at', 'blocked_until',
+                 'strikes')
+
+    def __init__(self, burst: float, now: float):
+        self.next_slot = now
+        self.tokens = burst
+        self.refilled_at = now
+        self.blocked_until = 0.0
+        self.strikes = 0
+
+
+class HostScheduler:
+    def __init__(self,
+                 min_interval: float = 1.0,
+                 rate: Optional[float] = None,
+                 burst: int = 1,
+                 host_intervals: Optional[Dict[str, float]] = None,
+                 max_retry_after: float = 300.0,
+                 max_429_retries: int = 2,
+                 metrics: Optional[Metrics] = None):
+        """
+        Per-host politeness shared by all fetching classes.
+
+        Each host gets a token bucket plus a minimum interval between
+        requests. Requests to different hosts never wait on each other, so
+        threads working on unrelated domains proceed in parallel.
+
+        Args:
+            min_interval (float): Minimum seconds between two requests to the
+                same host.
+            rate (Optional[float]): Token-bucket refill rate (requests/sec per
+                host). None disables the bucket and leaves only min_interval.
+            burst (int): Token-bucket capacity.
+            host_intervals (Optional[Dict[str, float]]): Per-host overrides of
+                min_interval, e.g. {'hrdmemorial.org': 2.0}.
+            max_retry_after (float): Upper bound honoured for Retry-After.
+            max_429_retries (int): How often request() retries after a 429.
+            metrics (Optional[Metrics]): Records the time requests wait for
+                their host as stage 'politeness.wait'.
+        """
+        self.min_interval = min_interval
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.host_intervals = {h.lower(): v for h, v in (host_intervals or {}).items()}
+        self.max_retry_after = max_retry_after
+        self.max_429_retries = max_429_retries
+        self.metrics = metrics or NULL_METRICS
+        self._hosts: Dict[str, _HostState] = {}
+        self._lock = threading.Lock()
+
+    def interval_for(self, host: str) -> float:
+        return self.host_intervals.get(host, self.min_interval)
+
+    def _reserve(self, host: str) -> float:
+        """Book the next free slot for `host`; return when it starts."""
+        now = time.monotonic()
+        with self._lock:
+            st = self._hosts.get(host)
+            if st is None:
+                st = self._hosts[host] = _HostState(self.burst, now)
+
+            slot = max(now, st.next_slot, st.blocked_until)
+
+            if self.rate:
+                # Refill up to the booked slot, then wait for a whole token
+                st.tokens = min(self.burst,
+                                st.tokens + (slot - st.refilled_at) * self.rate)
+                st.refilled_at = slot
+                if st.tokens < 1:
+                    slot += (1 - st.tokens) / self.rate
+                    st.tokens = 1
+                    st.refilled_at = slot
+                st.tokens -= 1
+
+            st.next_slot = slot + self.interval_for(host)
+            return slot
+
+    def wait(self, url: str) -> float:
+        """
+        Block until a request to the URL's host is allowed.
+
+        Returns:
+            float: Seconds spent waiting.
+        """
+        host = host_of(url)
+        pause = max(0.0, self._reserve(host) - time.monotonic())
+        self.metrics.observe('politeness.wait', pause, host)
+        if pause > 0:
+            time.sleep(pause)
+        return pause
+
+    def observe(self, url: str, response: Optional[requests.Response]):
+        """
+        Feed a response back so 429/503 + Retry-After throttle the host.
+        """
+        if response is None:
+            return
+        host = host_of(url)
+        status = response.status_code
+        with self._lock:
+            st = self._hosts.get(host)
+            if st is None:
+                return
+            if status == 429 or (status == 503 and 'Retry-After' in response.headers):
+                st.strikes += 1
+                pause = parse_retry_after(response.headers.get('Retry-After'))
+                if pause is None:
+                    # No hint from the server: back off exponentially
+                    pause = self.interval_for(host) * (2 ** st.strikes)
+                pause = min(pause, self.max_retry_after)
+                st.blocked_until = max(st.blocked_until, time.monotonic() + pause)
+                logger.info("Host %s answered %d; pausing it for %.1fs",
+                            host, status, pause)
+            elif status < 400:
+                st.strikes = 0
+
+    def request(self, send: Callable[..., requests.Response], url: str,
+                *args, **kwargs) -> requests.Response:
+        """
+        Call `send(url, *args, **kwargs)` under the host's politeness rules.
+
+        A 429 response is retried (after the host's pause) up to
+        `max_429_retries` times; the last response is returned as-is.
+        """
+        for attempt in range(self.max_429_retries + 1):
+            self.wait(url)
+            resp = send(url, *args, **kwargs)
+            self.observe(url, resp)
+            if resp.status_code != 429 or attempt == self.max_429_retries:
+                return resp
+            resp.close()
+        return resp
@@ -1,32 +1,107 @@
-import time
+import re
 import logging
 import json
-from datetime import datetime
+import hashlib
+import multiprocessing
+import queue
+import threading
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import (ProcessPoolExecutor, ThreadPoolExecutor,
+                                as_completed)
+from datetime import datetime, timezone
 from typing import List, Tuple, Dict, Optional, Any
 
 import requests
 from bs4 import BeautifulSoup, Tag
 from sqlalchemy.orm import Session
-from sqlalchemy.exc import SQLAlchemyError
-
 from tqdm import tqdm               # ← new import
-from db import Profile, URL
+from db import Profile, URL, insert_ignore, upsert
+from politeness import HostScheduler, host_of
+from batch_writer import BatchWriter
+from http_client import make_session
+from metrics import Metrics, NULL_METRICS
+from url_canon import canonical_url
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
+# Markup that changes on every request (nonces, inline JSON, cache comments)
+_VOLATILE = re.compile(r'<script\b.*?</script>|<style\b.*?</style>|<!--.*?-->',
+                       re.S | re.I)
+_SITEMAP_NS = '{http://www.sitemaps.org/schemas/sitemap/0.9}'
+
+NEW, CHANGED, UNCHANGED = 'new', 'changed', 'unchanged'
+
+
+def page_fingerprint(html: str) -> str:
+    """sha256 of a profile page, ignoring scripts, styles and comments."""
+    return hashlib.sha256(_VOLATILE.sub('', html).encode('utf-8')).hexdigest()
+
+
+def _parse_lastmod(value: str) -> Optional[datetime]:
+    """W3C datetime from a sitemap <lastmod>, as naive UTC."""
+    try:
+        dt = datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def _extract_timed(html: str, url: str):
+    """extract_profile_data() plus its duration, for the parse worker pool."""
+    start = time.perf_counter()
+    result = ProfileScraper.extract_profile_data(html, url)
+    return result, time.perf_counter() - start
+
+
 class ProfileScraper:
-    def __init__(self, db_session: Session, delay: float = 1.0):
+    def __init__(self, db_session: Session, delay: float = 1.0,
+                 scheduler: Optional[HostScheduler] = None,
+                 batch_size: int = 50,
+                 flush_interval: float = 10.0,
+                 fetch_workers: int = 1,
+                 parse_workers: int = 0,
+                 queue_size: int = 32,
+                 session: Optional[requests.Session] = None,
+                 metrics: Optional[Metrics] = None):
+        """
+        Args:
+            db_session (Session): Active SQLAlchemy session.
+            delay (float): Minimum interval between requests to the same host
+                (used when no scheduler is given).
+            scheduler (Optional[HostScheduler]): Shared per-host politeness.
+            batch_size (int): Profiles committed per transaction.
+            flush_interval (float): Max seconds a profile waits before commit.
+            fetch_workers (int): Concurrent page fetchers.
+            parse_workers (int): Processes parsing pages; 0 parses in a thread.
+            queue_size (int): Bound on pages waiting between pipeline stages.
+            session (Optional[requests.Session]): Shared HTTP client (see
+                http_client.make_session).
+            metrics (Optional[Metrics]): Per-stage timings: 'scrape.ttfb',
+                'scrape.fetch' (headers and body), 'scrape.parse' and
+                'db.commit'.
+
+        With fetch_workers == 1 and parse_workers == 0 profiles are scraped in
+        the original serial loop; otherwise scrape_profiles() runs the
+        fetch -> parse -> write pipeline.
+        """
         self.db_session = db_session
+        self.fetch_workers = max(1, fetch_workers)
+        self.parse_workers = max(0, parse_workers)
+        self.queue_size = max(1, queue_size)
         self.delay = delay
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': (
-                'Mozilla/5.0 (Windows NT 10.0; Win64; x64) '
-                'AppleWebKit/537.36 (KHTML, like Gecko) '
-                'Chrome/114.0.0.0 Safari/537.36'
-            )
-        })
+        self.metrics = metrics or NULL_METRICS
+        self.scheduler = scheduler or HostScheduler(min_interval=delay)
+        # Profiles are committed in batches; call writer.flush() when using
+        # scrape_single_profile() directly.
+        self.writer = BatchWriter(db_session, batch_size=batch_size,
+                                  flush_interval=flush_interval,
+                                  metrics=self.metrics)
+        self.session = session or make_session(
+            pool_maxsize=max(10, self.fetch_workers))
 
     def scrape_profiles(self, profile_urls: List[str]) -> Dict[str, Any]:
         """
@@ -34,49 +109,346 @@ class ProfileScraper:
         """
         total = len(profile_urls)
         report = {'total': total, 'success': 0, 'failures': []}
+        self.writer.failures = []
 
         # Wrap the list in tqdm to show progress & remaining count
-        for url in tqdm(profile_urls,
-                        desc="Scraping profiles",
-                        unit="profile",
-                        leave=True):
-            success, error = self.scrape_single_profile(url)
-            if success:
-                report['success'] += 1
+        with self.writer:
+            if self.fetch_workers > 1 or self.parse_workers > 0:
+                results = self._scrape_pipelined(profile_urls)
             else:
-                report['failures'].append({'url': url, 'error': error})
-            time.sleep(self.delay)
+                results = ((url, *self.scrape_single_profile(url))
+                           for url in profile_urls)
+            for url, success, error in tqdm(results,
+                                            total=total,
+                                            desc="Scraping profiles",
+                                            unit="profile",
+                                            leave=True):
+                if success:
+                    report['success'] += 1
+                else:
+                    report['failures'].append({'url': url, 'error': error})
 
+        # Profiles whose batched write failed after being parsed
+        for failure in self.writer.failures:
+            report['success'] -= 1
+            report['failures'].append({'url': failure['key'],
+                                       'error': failure['error']})
         return report
 
+    def _scrape_pipelined(self, profile_urls: List[str]):
+        """
+        Fetch -> parse -> write pipeline, yielding (url, success, error).
+
+        `fetch_workers` threads fetch pages under the shared scheduler and
+        feed a bounded queue; a dispatcher hands pages to a process pool
+        running extract_profile_data; this generator, on the caller's thread,
+        is the single DB-writer stage. At most `queue_size` fetched pages
+        wait for parsing and at most `queue_size` parsed profiles wait for
+        the writer.
+        """
+        todo: "queue.Queue[str]" = queue.Queue()
+        for url in profile_urls:
+            todo.put(url)
+        fetched: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        parsed: queue.Queue = queue.Queue()
+        in_flight = threading.BoundedSemaphore(self.queue_size)
+        stop = threading.Event()
+        done_marker = object()
+        # Unexpected errors that ended a fetcher or the dispatcher
+        stage_errors: List[BaseException] = []
+
+        # Blocking calls give up once the consumer has gone away
+        def put(item):
+            while not stop.is_set():
+                try:
+                    fetched.put(item, timeout=0.5)
+                    return
+                except queue.Full:
+                    pass
+
+        def acquire() -> bool:
+            while not stop.is_set():
+                if in_flight.acquire(timeout=0.5):
+                    return True
+            return False
+
+        def guarded(stage, *args):
+            try:
+                stage(*args)
+            except BaseException as e:
+                logger.exception(f"Scrape pipeline stage {stage.__name__} died")
+                stage_errors.append(e)
+
+        def fetcher():
+            try:
+                while not stop.is_set():
+                    try:
+                        url = todo.get_nowait()
+                    except queue.Empty:
+                        break
+                    # Any error (e.g. ValueError from a malformed href) is
+                    # this URL's failure, never the fetcher's
+                    try:
+                        html, validators = self._fetch(url)
+                    except Exception as e:
+                        logger.error(f"Failed to fetch {url}: {e}")
+                        put((url, None, str(e), None))
+                        continue
+                    put((url, html, None, validators))
+            finally:
+                put(done_marker)
+
+        def next_parsed():
+            while True:
+                try:
+                    return parsed.get(timeout=0.5)
+                except queue.Empty:
+                    if stage_errors:
+                        raise RuntimeError("Scrape pipeline stopped: "
+                                           f"{stage_errors[0]!r}") \
+                            from stage_errors[0]
+
+        def dispatcher(pool):
+            finished = 0
+            while finished < self.fetch_workers:
+                try:
+                    item = fetched.get(timeout=0.5)
+                except queue.Empty:
+                    if stop.is_set():
+                        return
+                    continue
+                if item is done_marker:
+                    finished += 1
+                    continue
+                url, html, error, validators = item
+                if not acquire():
+                    return
+                if html is None:
+                    parsed.put((url, None, error, None))
+                    continue
+                try:
+                    fut = pool.submit(_extract_timed, html, url)
+                except Exception as e:   # e.g. a broken process pool
+                    parsed.put((url, None, str(e), None))
+                    continue
+                fut.add_done_callback(
+                    lambda f, url=url, v=validators: parsed.put((url, f, None, v)))
+
+        if self.parse_workers > 0:
+            # spawn: forking a process that already runs fetcher threads is unsafe
+            pool = ProcessPoolExecutor(
+                max_workers=self.parse_workers,
+                mp_context=multiprocessing.get_context('spawn'))
+        else:
+            pool = ThreadPoolExecutor(max_workers=1)
+        fetchers = ThreadPoolExecutor(max_workers=self.fetch_workers)
+        try:
+            for _ in range(self.fetch_workers):
+                fetchers.submit(guarded, fetcher)
+            threading.Thread(target=guarded, args=(dispatcher, pool),
+                             daemon=True).start()
+
+            for _ in range(len(profile_urls)):
+                url, fut, error, validators = next_parsed()
+                in_flight.release()
+                if fut is None:
+                    yield url, False, error
+                    continue
+                try:
+                    (profile_data, url_records), seconds = fut.result()
+                except Exception as e:
+                    logger.error(f"Extraction failed for {url}: {e}")
+                    yield url, False, str(e)
+                    continue
+                self.metrics.observe('scrape.parse', seconds, host_of(url))
+                profile_data.update(validators)
+                self.writer.bulk(self._save_profiles,
+                                 (profile_data, url_records), key=url)
+                yield url, True, None
+        finally:
+            stop.set()
+            fetchers.shutdown(wait=True, cancel_futures=True)
+            pool.shutdown(wait=True, cancel_futures=True)
+
     def scrape_single_profile(self, url: str) -> Tuple[bool, Optional[str]]:
         try:
-            resp = self.session.get(url, timeout=10)
-            resp.raise_for_status()
+            html, validators = self._fetch(url)
         except requests.RequestException as e:
             logger.error(f"Failed to fetch {url}: {e}")
             return False, str(e)
 
         try:
-            profile_data, url_records = self.extract_profile_data(resp.text, url)
+            with self.metrics.timer('scrape.parse', host_of(url)):
+                profile_data, url_records = self.extract_profile_data(html, url)
         except Exception as e:
             logger.error(f"Extraction failed for {url}: {e}")
             return False, str(e)
 
-        try:
-            pid = self._upsert_profile(profile_data)
-            self._insert_urls(pid, url_records)
-            self.db_session.commit()
-            return True, None
-        except SQLAlchemyError as e:
-            self.db_session.rollback()
-            logger.error(f"Database error for {url}: {e}")
-            return False, str(e)
+        profile_data.update(validators)
+        self.writer.bulk(self._save_profiles, (profile_data, url_records),
+                         key=url)
+        return True, None
+
+    def _fetch(self, url: str, prev: Optional[Dict[str, Any]] = None
+               ) -> Tuple[Optional[str], Dict[str, Any]]:
+        """
+        GET a profile page, conditionally when `prev` holds validators.
+
+        Returns:
+            Tuple[Optional[str], Dict[str, Any]]: The page HTML (None on a
+            304 Not Modified) and the validator columns to store for it.
+        """
+        headers = {}
+        if prev:
+            if prev.get('etag'):
+                headers['If-None-Match'] = prev['etag']
+            if prev.get('last_modified'):
+                headers['If-Modified-Since'] = prev['last_modified']
+        host = host_of(url)
+        # Timed without the politeness wait (see 'politeness.wait')
+        send = self.metrics.timed(self.session.get, 'scrape.fetch', host)
+        resp = self.scheduler.request(send, url, headers=headers)
+        self.metrics.observe('scrape.ttfb', resp.elapsed.total_seconds(), host)
+        validators = {'checked_at': datetime.utcnow()}
+        if resp.status_code == 304:
+            return None, validators
+        resp.raise_for_status()
+        validators.update({
+            'etag': resp.headers.get('ETag'),
+            'last_modified': resp.headers.get('Last-Modified'),
+            'content_hash': page_fingerprint(resp.text),
+        })
+        return resp.text, validators
+
+    def sync_profiles(self, profile_urls: List[str],
+                      sitemap_url: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Delta sync: re-scrape only profiles that are new or have changed.
 
-    # ... rest of your methods (_normalize_date, extract_profile_data, _upsert_profile, _insert_urls) unchanged ...
+        A profile is skipped without a request when the sitemap's <lastmod>
+        is older than its last check. Otherwise it is fetched with a
+        conditional GET; a 304, or a body whose fingerprint matches the
+        stored content_hash, counts as unchanged and is not parsed. Only new
+        and changed pages go through extract_profile_data and the writer.
 
+        Args:
+            profile_urls (List[str]): Profile URLs from the listing.
+            sitemap_url (Optional[str]): Sitemap (or sitemap index) with
+                <lastmod> dates for the profile pages.
 
-    def extract_profile_data(self, html: str, url: str) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        Returns:
+            Dict[str, Any]: Counts of new, changed and unchanged profiles,
+            and the failures.
+        """
+        report = {'total': len(profile_urls), NEW: 0, CHANGED: 0,
+                  UNCHANGED: 0, 'failures': []}
+        self.writer.failures = []
+        stored = {row.profile_url: row for row in self.db_session.query(
+            Profile.profile_id, Profile.profile_url, Profile.etag,
+            Profile.last_modified, Profile.content_hash, Profile.checked_at,
+            Profile.updated_at)}
+        lastmod = self.sitemap_lastmod(sitemap_url) if sitemap_url else {}
+
+        todo = []
+        for url in profile_urls:
+            prev = stored.get(url)
+            modified = lastmod.get(url)
+            if (prev is not None and prev.checked_at and modified
+                    and modified <= prev.checked_at):
+                report[UNCHANGED] += 1
+            else:
+                todo.append(url)
+        logger.info("Sync: %d profiles to check, %d unchanged per sitemap",
+                    len(todo), report[UNCHANGED])
+
+        with self.writer, ThreadPoolExecutor(max_workers=self.fetch_workers) as pool:
+            futures = {pool.submit(self._check_profile, url, stored.get(url)): url
+                       for url in todo}
+            for fut in tqdm(as_completed(futures), total=len(futures),
+                            desc="Syncing profiles", unit="profile"):
+                url = futures[fut]
+                try:
+                    status, profile_data, url_records = fut.result()
+                except Exception as e:
+                    logger.error(f"Sync failed for {url}: {e}")
+                    report['failures'].append({'url': url, 'error': str(e)})
+                    continue
+                report[status] += 1
+                if status == UNCHANGED:
+                    profile_data['profile_id'] = stored[url].profile_id
+                    # Only the validators change: keep updated_at (its
+                    # onupdate would re-export the row incrementally)
+                    profile_data['updated_at'] = stored[url].updated_at
+                    self.writer.update(Profile, profile_data, key=url)
+                else:
+                    self.writer.bulk(self._save_profiles,
+                                     (profile_data, url_records), key=url)
+
+        for failure in self.writer.failures:
+            report['failures'].append({'url': failure['key'],
+                                       'error': failure['error']})
+        return report
+
+    def _check_profile(self, url: str, prev) -> Tuple[str, Dict[str, Any],
+                                                      List[Dict[str, Any]]]:
+        """
+        Classify one profile for sync_profiles() and parse it if needed.
+
+        Returns:
+            Tuple[str, Dict[str, Any], List[Dict[str, Any]]]: The status,
+            the profile columns to write (only validators when unchanged)
+            and the profile's URL records.
+        """
+        html, validators = self._fetch(url, prev._asdict() if prev else None)
+        if html is None or (prev is not None
+                            and validators['content_hash'] == prev.content_hash):
+            return UNCHANGED, validators, []
+        with self.metrics.timer('scrape.parse', host_of(url)):
+            profile_data, url_records = self.extract_profile_data(html, url)
+        profile_data.update(validators)
+        return (CHANGED if prev is not None else NEW), profile_data, url_records
+
+    def sitemap_lastmod(self, sitemap_url: str) -> Dict[str, datetime]:
+        """
+        Read <loc>/<lastmod> pairs from a sitemap, following sitemap indexes.
+
+        Returns:
+            Dict[str, datetime]: Page URL -> last modification (naive UTC).
+            Empty if the sitemap cannot be read.
+        """
+        lastmod: Dict[str, datetime] = {}
+        pending, seen = [sitemap_url], set()
+        while pending:
+            sm_url = pending.pop()
+            if sm_url in seen:
+                continue
+            seen.add(sm_url)
+            try:
+                resp = self.scheduler.request(self.session.get, sm_url)
+                resp.raise_for_status()
+                root = ET.fromstring(resp.content)
+            except (requests.RequestException, ET.ParseError) as e:
+                logger.warning(f"Could not read sitemap {sm_url}: {e}")
+                continue
+            for entry in root:
+                loc = entry.findtext(f'{_SITEMAP_NS}loc')
+                if not loc:
+                    continue
+                loc = loc.strip()
+                if entry.tag == f'{_SITEMAP_NS}sitemap':
+                    pending.append(loc)
+                    continue
+                mod = entry.findtext(f'{_SITEMAP_NS}lastmod')
+                mod = _parse_lastmod(mod) if mod else None
+                if mod is not None:
+                    lastmod[loc] = mod
+        logger.info("Sitemap: %d pages with <lastmod>", len(lastmod))
+        return lastmod
+
+    @staticmethod
+    def extract_profile_data(html: str, url: str) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        # Static (no DB or session state) so the pipeline can run it in a
+        # worker process.
         soup = BeautifulSoup(html, 'html.parser')
         slug = url.rstrip('/').split('/')[-1]
 
@@ -111,7 +483,7 @@ class ProfileScraper:
             elif label.startswith('Sex'):
                 data['sex'] = val
             elif label == 'Date of Killing':
-                data['date_of_killing'] = self._normalize_date(val) if val else None
+                data['date_of_killing'] = ProfileScraper._normalize_date(val) if val else None
             elif label == 'Previous Threats':
                 data['previous_threats'] = (val or '').lower() == 'yes'
             elif label == 'Type of Work':
@@ -191,14 +563,44 @@ class ProfileScraper:
 
         return data, url_records
 
-    def _normalize_date(self, s: str) -> Optional[datetime.date]:
+    @staticmethod
+    def _normalize_date(s: str) -> Optional[datetime.date]:
         try:
             return datetime.strptime(s, '%d/%m/%Y').date()
         except Exception:
             logger.warning(f"Date parse failed: {s}")
             return None
 
+    def _save_profiles(self, db: Session,
+                       items: List[Tuple[Dict[str, Any], List[Dict[str, Any]]]]):
+        """
+        Write a batch of parsed profiles with set-based statements.
+
+        Profiles go through one INSERT ... ON CONFLICT(slug) DO UPDATE, their
+        ids come back in one SELECT, and links are inserted with conflicts on
+        (profile_id, url) ignored, so re-scrapes never duplicate URL rows.
+        """
+        profiles: Dict[str, Dict[str, Any]] = {}
+        links: Dict[str, List[Dict[str, Any]]] = {}
+        for profile_data, url_records in items:
+            slug = profile_data['slug']
+            profiles[slug] = {c: profile_data.get(c) for c in PROFILE_COLUMNS}
+            links[slug] = url_records
+
+        if upsert(db, Profile, list(profiles.values()), ['slug']):
+            ids = dict(db.query(Profile.slug, Profile.profile_id)
+                         .filter(Profile.slug.in_(list(profiles))))
+        else:
+            ids = {slug: self._upsert_profile(row)
+                   for slug, row in profiles.items()}
+
+        url_rows = [dict(URL_DEFAULTS, **r, profile_id=ids[slug],
+                         canonical_url=canonical_url(r['url']))
+                    for slug, records in links.items() for r in records]
+        insert_ignore(db, URL, url_rows)
+
     def _upsert_profile(self, pd: Dict[str, Any]) -> int:
+        """Per-row upsert for engines without ON CONFLICT."""
         existing = self.db_session.query(Profile).filter_by(slug=pd['slug']).one_or_none()
         if existing:
             for k, v in pd.items():
@@ -210,6 +612,10 @@ class ProfileScraper:
         self.db_session.flush()
         return obj.profile_id
 
-    def _insert_urls(self, profile_id: int, records: List[Dict[str, Any]]):
-        objs = [URL(profile_id=profile_id, **r) for r in records]
-        self.db_session.bulk_save_objects(objs)
+
+# Profile columns written by the scraper (everything but the primary key
+# and updated_at, which the database layer maintains)
+PROFILE_COLUMNS = [c.name for c in Profile.__table__.columns
+                   if c.name not in ('profile_id', 'updated_at')]
+URL_DEFAULTS = {'label': None, 'is_active': None, 'is_archived': None,
+                'archived_url': None}
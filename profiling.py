@@ -0,0 +1,210 @@
+# file: profiling.py
+
+import os
+import sys
+import time
+import pstats
+import cProfile
+import logging
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy.engine import make_url
+
+logger = logging.getLogger(__name__)
+
+CPROFILE, SAMPLE = 'cprofile', 'sample'
+MODES = (CPROFILE, SAMPLE)
+DEFAULT_TOP = 25
+
+
+def dump_dir_for(db_url: str) -> str:
+    """Folder for profile dumps: profiling/ next to a SQLite database file."""
+    try:
+        database = make_url(db_url).database
+    except Exception:
+        database = None
+    base = os.path.dirname(os.path.abspath(database)) if database else os.getcwd()
+    return os.path.join(base, 'profiling')
+
+
+class ThreadProfiler:
+    # Python 3.12 allows one active profiler per interpreter (cProfile sits
+    # on sys.monitoring), so a second Profile.enable() raises ValueError
+    PER_THREAD = sys.version_info < (3, 12)
+
+    def __init__(self):
+        """
+        Deterministic cProfile run covering the calling thread and every
+        thread started while it runs (executor workers included).
+
+        Threads get their own cProfile.Profile through threading.setprofile;
+        the per-thread results are merged when the run stops. Threads that
+        already existed, and worker processes, are not seen. On Python 3.12+
+        only the calling thread is profiled (use the 'sample' mode to see
+        worker threads there).
+        """
+        self.main = cProfile.Profile()
+        self._threads: List[cProfile.Profile] = []
+        self._lock = threading.Lock()
+        self._failed = False
+
+    def _bootstrap(self, frame, event, arg):
+        # First profiling event in a new thread: hand the thread over to a
+        # cProfile instance of its own (enable() replaces this hook). Never
+        # let a profiler failure kill the thread being profiled.
+        prof = cProfile.Profile()
+        try:
+            prof.enable()
+        except Exception as e:
+            sys.setprofile(None)
+            with self._lock:
+                first, self._failed = not self._failed, True
+            if first:
+                logger.warning(f"Worker threads not profiled: {e}")
+            return
+        with self._lock:
+            self._threads.append(prof)
+
+    def start(self):
+        if self.PER_THREAD:
+            threading.setprofile(self._bootstrap)
+        else:
+            logger.warning("cProfile covers the calling thread only on "
+                           "Python 3.12+; use --profile sample to see "
+                           "worker threads")
+        self.main.enable()
+
+    def stop(self) -> pstats.Stats:
+        self.main.disable()
+        if self.PER_THREAD:
+            threading.setprofile(None)
+        stats = pstats.Stats(self.main)
+        with self._lock:
+            threads = list(self._threads)
+        for prof in threads:
+            try:
+                stats.add(prof)
+            except TypeError:    # thread ended before any call was recorded
+                pass
+        return stats
+
+
+class StackSampler:
+    def __init__(self, interval: float = 0.005):
+        """
+        Wall-clock sampling profiler: every `interval` seconds the stack of
+        every thread is recorded. Blocked threads count too, so time spent
+        waiting on sockets or locks shows up next to CPU work.
+
+        Args:
+            interval (float): Seconds between samples.
+        """
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='stack-sampler',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for tid, frame in sys._current_frames().items():
+                if tid == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} "
+                                 f"({os.path.basename(code.co_filename)}"
+                                 f":{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def write_collapsed(self, path: str):
+        """'frame;frame;frame count' lines, for flamegraph.pl or speedscope."""
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(f"{stack} {count}\n")
+
+    def hotspots(self, top: int = DEFAULT_TOP
+                 ) -> Tuple[List[Tuple[str, int]], List[Tuple[str, int]]]:
+        """Top frames by self samples and by inclusive samples."""
+        own: Counter = Counter()
+        total: Counter = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(';')
+            own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+        return own.most_common(top), total.most_common(top)
+
+
+@contextmanager
+def profiled(phase: str, mode: Optional[str], out_dir: str,
+             top: int = DEFAULT_TOP):
+    """
+    Run the block under a profiler and write its dump to `out_dir`.
+
+    'cprofile' writes <phase>-<timestamp>.pstats (open with pstats or
+    snakeviz); 'sample' writes <phase>-<timestamp>.collapsed for flame
+    graphs. Either way the top `top` hotspots are printed afterwards.
+    With mode None the block runs unprofiled.
+    """
+    if not mode:
+        yield
+        return
+    if mode not in MODES:
+        raise ValueError(f"Unknown profile mode: {mode}")
+    os.makedirs(out_dir, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%dT%H%M%S')
+    base = os.path.join(out_dir, f"{phase}-{stamp}")
+    start = time.perf_counter()
+
+    if mode == CPROFILE:
+        profiler = ThreadProfiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            stats = profiler.stop()
+            stats.dump_stats(base + '.pstats')
+            print(f"\n=== {phase}: {time.perf_counter() - start:.2f}s, "
+                  f"top {top} by own time ({base}.pstats) ===")
+            stats.sort_stats('tottime').print_stats(top)
+    else:
+        sampler = StackSampler()
+        sampler.start()
+        try:
+            yield
+        finally:
+            sampler.stop()
+            sampler.write_collapsed(base + '.collapsed')
+            _print_hotspots(phase, sampler, time.perf_counter() - start,
+                            base + '.collapsed', top)
+
+
+def _print_hotspots(phase: str, sampler: StackSampler, seconds: float,
+                    path: str, top: int):
+    own, total = sampler.hotspots(top)
+    weight = sum(sampler.stacks.values()) or 1
+    print(f"\n=== {phase}: {seconds:.2f}s, {sampler.samples} samples "
+          f"({path}) ===")
+    for title, rows in (("own", own), ("inclusive", total)):
+        print(f"-- top {top} frames by {title} samples (all threads)")
+        for frame, count in rows:
+            print(f"{100.0 * count / weight:6.1f}%  {frame}")
@@ -10,6 +10,10 @@ from db import init_db
 from url_collector import URLCollector
 from profile_scraper import ProfileScraper
 from export_module import Exporter
+from politeness import HostScheduler
+from http_client import make_session, connection_stats
+from metrics import Metrics
+from profiling import MODES, dump_dir_for, profiled
 
 def configure_logging():
     logging.basicConfig(
@@ -17,42 +21,119 @@ def configure_logging():
         format="%(asctime)s %(levelname)s %(name)s: %(message)s"
     )
 
-def main():
+def main(incremental=False, parallel_listing=False, sync=False,
+         sitemap_url=None, metrics_path=None, prometheus_path=None,
+         profile=None):
     configure_logging()
     logger = logging.getLogger("pipeline")
 
     # 1. Initialize the database (SQLite file hrd.db)
-    SessionLocal = init_db("sqlite:///hrd.db", echo=False)
+    DB_URL = "sqlite:///hrd.db"
+    SessionLocal = init_db(DB_URL, echo=False)
+    dump_dir = dump_dir_for(DB_URL)
+
+    # Stage timings cost nothing unless an output was asked for
+    metrics = Metrics(enabled=bool(metrics_path or prometheus_path))
+    metrics.instrument_network()
+
+    # One politeness scheduler for every request to hrdmemorial.org
+    scheduler = HostScheduler(min_interval=1.0,
+                              host_intervals={'hrdmemorial.org': 2.0},
+                              metrics=metrics)
+    # ...and one pooled HTTP client, so listing and profile fetches reuse
+    # the same keep-alive connections
+    http = make_session(pool_maxsize=4)
 
     with SessionLocal() as session:  # type: Session
         logger.info("Step 1: Collect profile URLs")
         collector = URLCollector(
             base_url="https://hrdmemorial.org/hrdrecord/",
             db_session=session,
-            delay=2.0
+            scheduler=scheduler,
+            session=http,
+            metrics=metrics,
+            incremental=incremental,
+            parallel=parallel_listing
         )
-        profile_urls = collector.collect()
+        with profiled('phase1-collect', profile, dump_dir):
+            profile_urls = collector.collect()
         logger.info(f"Collected {len(profile_urls)} profile URLs")
 
         logger.info("Step 2: Scrape profile pages")
-        scraper = ProfileScraper(db_session=session, delay=1.0)
-        report = scraper.scrape_profiles(profile_urls)
+        # Fetchers wait on the scheduler; parsing runs in worker processes,
+        # or in-process when profiling so extract_profile_data is measured
+        scraper = ProfileScraper(db_session=session, scheduler=scheduler,
+                                 session=http, metrics=metrics,
+                                 fetch_workers=4,
+                                 parse_workers=0 if profile else 2)
+        with profiled('phase1-scrape', profile, dump_dir):
+            if sync:
+                # Only new or changed profiles are parsed and written
+                report = scraper.sync_profiles(profile_urls,
+                                               sitemap_url=sitemap_url)
+            else:
+                report = scraper.scrape_profiles(profile_urls)
+        if sync:
+            logger.info(f"Sync: {report['new']} new, {report['changed']} changed, "
+                        f"{report['unchanged']} unchanged, "
+                        f"{len(report['failures'])} failed")
         logger.info(f"Scraping report: {report}")
+        logger.info(f"HTTP connections: {connection_stats(http)}")
 
         logger.info("Step 3: Export profiles to CSV")
         # Ensure output directory exists
         output_dir = "./output_profiles"
         os.makedirs(output_dir, exist_ok=True)
 
-        exporter = Exporter(db_session=session, output_dir=output_dir)
-        export_report = exporter.export(
-            include_profiles=True,
-            include_urls=True,   # skip exporting URLs table
-            to_pandas=True
-        )
+        exporter = Exporter(db_session=session, output_dir=output_dir,
+                            metrics=metrics)
+        with profiled('phase1-export', profile, dump_dir):
+            export_report = exporter.export(
+                include_profiles=True,
+                include_urls=True,   # skip exporting URLs table
+                to_pandas=False      # stream to disk; the DataFrames are unused
+            )
         logger.info(f"Export report: {export_report}")
 
+    metrics.log_summary(logger)
+    if metrics_path:
+        metrics.write_jsonl(metrics_path, run='phase1', sync=sync,
+                            incremental=incremental)
+    if prometheus_path:
+        metrics.write_prometheus(prometheus_path)
+
     logger.info("Pipeline complete (profiles only)")
 
 if __name__ == "__main__":
-    main()
+    import argparse
+
+    p = argparse.ArgumentParser(description="Phase I: collect, scrape, export")
+    p.add_argument("--incremental", action="store_true",
+                   help="Stop the listing crawl at the first page of known "
+                        "profiles and scrape only new ones")
+    p.add_argument("--parallel-listing", action="store_true",
+                   help="Read the last listing page and fetch listing pages "
+                        "concurrently")
+    p.add_argument("--sync", action="store_true",
+                   help="Check every listed profile for changes (conditional "
+                        "GET / content hash) and re-scrape only new or "
+                        "changed ones")
+    p.add_argument("--sitemap", default=None, metavar="URL",
+                   help="Sitemap with <lastmod> dates; with --sync, profiles "
+                        "not modified since their last check are skipped "
+                        "without a request")
+    p.add_argument("--metrics", default=None, metavar="PATH",
+                   help="Append per-stage timing histograms as a JSON line")
+    p.add_argument("--prometheus", default=None, metavar="PATH",
+                   help="Write per-stage timings in Prometheus text format")
+    p.add_argument("--profile", nargs="?", const="cprofile", choices=MODES,
+                   default=None,
+                   help="Profile each step (cprofile: deterministic, .pstats; "
+                        "sample: wall-clock stacks, .collapsed) and print "
+                        "hotspots; dumps go to profiling/ next to hrd.db")
+    args = p.parse_args()
+
+    main(incremental=args.incremental, parallel_listing=args.parallel_listing,
+         sync=args.sync, sitemap_url=args.sitemap,
+         metrics_path=args.metrics, prometheus_path=args.prometheus,
+         profile=args.profile)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+## Export profiles and URLs, in full or incrementally, and compact deltas
+## filename: run_export.py
+
+import logging
+import argparse
+
+from db import init_db
+from export_module import Exporter, FORMATS
+from metrics import Metrics
+
+
+def configure_logging():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+    )
+
+
+def parse_columns(specs):
+    """['profiles.description_html', ...] -> {'profiles': ['description_html']}"""
+    columns = {}
+    for spec in specs or []:
+        table, _, column = spec.partition('.')
+        if not column:
+            raise SystemExit(f"Expected TABLE.COLUMN, got {spec!r}")
+        columns.setdefault(table, []).append(column)
+    return columns
+
+
+def main(db_url, output_dir, fmt, incremental, compact, chunksize, exclude,
+         metrics_path=None):
+    configure_logging()
+    logger = logging.getLogger("export")
+    metrics = Metrics(enabled=bool(metrics_path))
+
+    SessionLocal = init_db(db_url, echo=False)
+    with SessionLocal() as session:
+        exporter = Exporter(db_session=session, output_dir=output_dir,
+                            metrics=metrics)
+        if compact:
+            counts = exporter.compact(fmt=fmt)
+            logger.info(f"Compacted snapshots: {counts or 'no deltas'}")
+            return
+
+        report = exporter.export(fmt=fmt, chunksize=chunksize,
+                                 exclude=parse_columns(exclude),
+                                 incremental=incremental)
+        logger.info(f"Exported rows: {report['counts']} "
+                    f"-> {report['profiles_csv']}, {report['urls_csv']}")
+        metrics.log_summary(logger)
+        if metrics_path:
+            metrics.write_jsonl(metrics_path, run='export', format=fmt,
+                                incremental=incremental)
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Export profiles and URLs")
+    p.add_argument("--db", default="sqlite:///hrd.db", help="Database URL")
+    p.add_argument("--out", default="./output_profiles",
+                   help="Output directory")
+    p.add_argument("--format", default="csv", choices=sorted(FORMATS),
+                   help="Output format (parquet requires pyarrow)")
+    p.add_argument("--incremental", action="store_true",
+                   help="Write only rows changed since the last incremental "
+                        "export, as delta files")
+    p.add_argument("--compact", action="store_true",
+                   help="Merge delta files into the full snapshots and exit")
+    p.add_argument("--chunksize", type=int, default=1000,
+                   help="Rows streamed per chunk")
+    p.add_argument("--exclude", nargs="*", metavar="TABLE.COLUMN",
+                   help="Columns to leave out, e.g. profiles.description_html")
+    p.add_argument("--metrics", default=None, metavar="PATH",
+                   help="Append per-chunk read/write timings as a JSON line")
+    args = p.parse_args()
+
+    main(args.db, args.out, args.format, args.incremental, args.compact,
+         args.chunksize, args.exclude, metrics_path=args.metrics)
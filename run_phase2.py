@@ -1,10 +1,19 @@
 #!/usr/bin/env python3
 import logging
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import inspect, select, text
 
-from db import Base
-from phase2_validator import URLValidator
+from db import (URL, Base, PageContent, get_engine, get_session_factory,
+                insert_ignore, ensure_canonical_urls, ensure_columns,
+                ensure_url_unique_index)
+from phase2_validator import (URLValidator, DEFAULT_CHUNK_SIZE,
+                              DEFAULT_MAX_BYTES)
+from work_queue import WorkQueue
+from host_health import HostHealth, install_dns_cache
+from http_client import make_session
+from politeness import HostScheduler
+from metrics import Metrics
+from profiling import MODES, dump_dir_for, profiled
+from search_index import SearchIndex
 
 logger = logging.getLogger("phase2")
 logging.basicConfig(
@@ -12,36 +21,110 @@ logging.basicConfig(
     format="%(asctime)s %(levelname)s %(name)s: %(message)s"
 )
 
-def ensure_url_columns(engine):
-    needed = {
-        'is_active':     "BOOLEAN",
-        'contains_name': "BOOLEAN",
-        'page_text':     "TEXT",
-        'checked_at':    "DATETIME"
-    }
-    with engine.connect() as conn:
-        existing = {
-            row['name']
-            for row in conn.execute(text("PRAGMA table_info(urls);")).mappings()
-        }
-        for col, col_def in needed.items():
-            if col not in existing:
-                logger.info("Adding column `%s` to urls", col)
-                conn.execute(text(f"ALTER TABLE urls ADD COLUMN {col} {col_def};"))
+def migrate_schema(engine):
+    """
+    Bring an existing database up to the current models on any engine:
+    missing tables and columns are added (via SQLAlchemy's inspector, not
+    SQLite PRAGMAs) and legacy inline page text is moved out of urls.
+    """
+    Base.metadata.create_all(engine)
+    ensure_columns(engine)
+    ensure_url_unique_index(engine)
+    ensure_canonical_urls(engine)
+    if 'page_text' in {c['name'] for c in inspect(engine).get_columns('urls')}:
+        with engine.connect() as conn:
+            migrate_page_text(conn)
+
+
+def migrate_page_text(conn, chunk_size=200):
+    """
+    Move legacy inline urls.page_text into the page_content store.
+
+    Bodies are compressed and deduplicated; the old column is emptied (not
+    dropped) so the move is resumable. Run VACUUM afterwards to reclaim space.
+    """
+    moved = 0
+    while True:
+        rows = conn.execute(text(
+            "SELECT url_id, page_text FROM urls "
+            "WHERE page_text IS NOT NULL LIMIT :n"), {'n': chunk_size}).all()
+        if not rows:
+            break
+        pages = {}
+        for url_id, page_text in rows:
+            page = PageContent.row_for(page_text)
+            pages[page['content_hash']] = page
+            conn.execute(text(
+                "UPDATE urls SET page_hash = :h, page_text = NULL "
+                "WHERE url_id = :id"), {'h': page['content_hash'], 'id': url_id})
+        insert_ignore(conn, PageContent, list(pages.values()))
         conn.commit()
+        moved += len(rows)
+    if moved:
+        logger.info("Moved %d page_text values into page_content; "
+                    "run VACUUM to reclaim space", moved)
 
-def main(limit=None, force=False):
+def main(limit=None, force=False, concurrency=1, max_bytes=None,
+         batch_size=100, breaker_threshold=3, breaker_reset=300.0,
+         http2=False, metrics_path=None, prometheus_path=None, profile=None,
+         db_url="sqlite:///hrd.db", queue=False, worker_id=None,
+         lease=600.0, claim_size=100, chunk_size=DEFAULT_CHUNK_SIZE,
+         fetch_once=False, reset_queue=False):
     # 0) Setup
-    DB_URL = "sqlite:///hrd.db"
-    engine = create_engine(DB_URL, echo=False)
-    Base.metadata.create_all(engine)
-    ensure_url_columns(engine)
+    engine = get_engine(db_url, echo=False)
+    migrate_schema(engine)
 
-    Session = sessionmaker(bind=engine)
+    Session = get_session_factory(engine)
     session = Session()
 
-    validator = URLValidator(db_session=session, delay=1.0)
-    validator.validate_batch(limit=limit, force=force)
+    if reset_queue:
+        # One-off step before the workers start: every URL's job to pending
+        work = WorkQueue(session, kind='validate')
+        work.reset(select(URL.url_id))
+        logger.info("Jobs: %s", work.stats())
+        return
+
+    # Resolve each cited domain once per run, dead ones included
+    install_dns_cache()
+    # Stage timings cost nothing unless an output was asked for
+    metrics = Metrics(enabled=bool(metrics_path or prometheus_path))
+    metrics.instrument_network()
+    health = HostHealth(failure_threshold=breaker_threshold,
+                        reset_timeout=breaker_reset)
+    # Keep-alive pools for many hosts, one connection per worker per host
+    http = make_session(pool_maxsize=max(10, concurrency),
+                        pool_connections=100, http2=http2)
+
+    validator = URLValidator(db_session=session,
+                             scheduler=HostScheduler(min_interval=1.0,
+                                                     metrics=metrics),
+                             concurrency=concurrency,
+                             max_bytes=max_bytes or DEFAULT_MAX_BYTES,
+                             batch_size=batch_size,
+                             health=health,
+                             session=http,
+                             metrics=metrics)
+    with profiled('phase2-validate', profile, dump_dir_for(db_url)):
+        if queue:
+            # Workers sharing the database split the URLs through the jobs table
+            work = WorkQueue(session, kind='validate', worker_id=worker_id,
+                             lease_seconds=lease)
+            validator.validate_queue(work, claim_size=claim_size,
+                                     limit=limit, force=force)
+        else:
+            validator.validate_batch(limit=limit, force=force,
+                                     chunk_size=chunk_size,
+                                     fetch_once=fetch_once)
+    if engine.dialect.name == 'sqlite':
+        # Keep the optional full-text index (run_search.py --build) current
+        index = SearchIndex(engine)
+        if index.exists():
+            index.sync()
+    if metrics_path:
+        metrics.write_jsonl(metrics_path, run='phase2', limit=limit,
+                            force=force, concurrency=concurrency)
+    if prometheus_path:
+        metrics.write_prometheus(prometheus_path)
 
     logger.info("Phase II complete")
 
@@ -53,6 +136,64 @@ if __name__ == "__main__":
                    help="Max URLs to process")
     p.add_argument("--force", action="store_true",
                    help="Re-validate all URLs, ignoring prior checks")
+    p.add_argument("--concurrency", type=int, default=1,
+                   help="URLs checked at once (default 1 = serial)")
+    p.add_argument("--max-bytes", type=int, default=None,
+                   help="Max body bytes read per page (default 2 MiB)")
+    p.add_argument("--batch-size", type=int, default=100,
+                   help="Results committed per transaction (default 100)")
+    p.add_argument("--breaker-threshold", type=int, default=3,
+                   help="Consecutive connection failures before a host's "
+                        "URLs are skipped (0 disables; default 3)")
+    p.add_argument("--breaker-reset", type=float, default=300.0,
+                   help="Seconds before a skipped host is probed again "
+                        "(default 300)")
+    p.add_argument("--http2", action="store_true",
+                   help="Use HTTP/2 for https URLs (requires httpx[http2])")
+    p.add_argument("--metrics", default=None, metavar="PATH",
+                   help="Append per-stage timing histograms as a JSON line")
+    p.add_argument("--prometheus", default=None, metavar="PATH",
+                   help="Write per-stage timings in Prometheus text format")
+    p.add_argument("--profile", nargs="?", const="cprofile", choices=MODES,
+                   default=None,
+                   help="Profile the run (cprofile: deterministic, .pstats; "
+                        "sample: wall-clock stacks, .collapsed) and print "
+                        "hotspots; dumps go to profiling/ next to hrd.db")
+    p.add_argument("--db", default="sqlite:///hrd.db",
+                   help="Database URL (e.g. postgresql://... for several "
+                        "machines)")
+    p.add_argument("--queue", action="store_true",
+                   help="Claim URLs from the shared jobs table, so several "
+                        "workers can run against one database")
+    p.add_argument("--worker-id", default=None,
+                   help="Name recorded on claimed jobs (default host:pid)")
+    p.add_argument("--lease", type=float, default=600.0,
+                   help="Seconds a claim is valid before other workers may "
+                        "take it over (default 600)")
+    p.add_argument("--reset-queue", action="store_true",
+                   help="Put every URL's validate job back to pending and "
+                        "exit; run once before starting --queue workers to "
+                        "re-validate (--force does not reset finished jobs)")
+    p.add_argument("--claim-size", type=int, default=100,
+                   help="URLs claimed per round with --queue (default 100)")
+    p.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                   help="URLs read from the database at a time "
+                        f"(default {DEFAULT_CHUNK_SIZE})")
+    p.add_argument("--fetch-once", action="store_true",
+                   help="Fetch each distinct (canonical) URL once and match "
+                        "every citing profile's name against that page; "
+                        "--limit then counts distinct URLs")
     args = p.parse_args()
+    if args.fetch_once and args.queue:
+        p.error("--fetch-once is not supported with --queue (jobs are per "
+                "URL row)")
 
-    main(limit=args.limit, force=args.force)
+    main(limit=args.limit, force=args.force, concurrency=args.concurrency,
+         max_bytes=args.max_bytes, batch_size=args.batch_size,
+         breaker_threshold=args.breaker_threshold,
+         breaker_reset=args.breaker_reset, http2=args.http2,
+         metrics_path=args.metrics, prometheus_path=args.prometheus,
+         profile=args.profile, db_url=args.db, queue=args.queue,
+         worker_id=args.worker_id, lease=args.lease,
+         claim_size=args.claim_size, chunk_size=args.chunk_size,
+         fetch_once=args.fetch_once, reset_queue=args.reset_queue)
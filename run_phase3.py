@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+## Phase III: look up Wayback Machine snapshots and submit missing URLs
+## filename: run_phase3.py
+
+import logging
+
+from db import init_db
+from wayback_archiver import (WaybackArchiver, AVAILABILITY_URL, SAVE_URL,
+                              SUBMIT_INACTIVE, SUBMIT_ACTIVE, SUBMIT_ALL)
+
+logger = logging.getLogger("phase3")
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+)
+
+
+def main(limit=None, force=False, concurrency=8, submit=SUBMIT_INACTIVE,
+         max_saves=None, save_interval=10.0, availability_url=AVAILABILITY_URL,
+         save_url=SAVE_URL, db_url="sqlite:///hrd.db"):
+    SessionLocal = init_db(db_url, echo=False)
+    with SessionLocal() as session:
+        archiver = WaybackArchiver(session,
+                                   availability_url=availability_url,
+                                   save_url=save_url,
+                                   concurrency=concurrency,
+                                   save_interval=save_interval)
+        report = archiver.archive_batch(limit=limit, force=force,
+                                        submit=submit, max_saves=max_saves)
+        for failure in report['failures'][:20]:
+            logger.warning(f"{failure['stage']} failed for {failure['url']}: "
+                           f"{failure['error']}")
+
+    logger.info("Phase III complete")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    p = argparse.ArgumentParser(description="Phase III Wayback archiving")
+    p.add_argument("--limit", type=int, default=None,
+                   help="Max URLs to process")
+    p.add_argument("--force", action="store_true",
+                   help="Look up every URL again, ignoring earlier lookups")
+    p.add_argument("--concurrency", type=int, default=8,
+                   help="Concurrent availability lookups (default 8)")
+    p.add_argument("--submit", default=SUBMIT_INACTIVE,
+                   choices=[SUBMIT_INACTIVE, SUBMIT_ACTIVE, SUBMIT_ALL, 'none'],
+                   help="Which URLs without a snapshot to send to Save Page "
+                        "Now (default: inactive)")
+    p.add_argument("--max-saves", type=int, default=None,
+                   help="Cap on Save Page Now submissions this run")
+    p.add_argument("--save-interval", type=float, default=10.0,
+                   help="Seconds between Save Page Now submissions")
+    p.add_argument("--availability-url", default=AVAILABILITY_URL,
+                   help="Availability API endpoint (e.g. a local stand-in)")
+    p.add_argument("--save-url", default=SAVE_URL,
+                   help="Save Page Now prefix")
+    p.add_argument("--db", default="sqlite:///hrd.db", help="Database URL")
+    args = p.parse_args()
+
+    main(limit=args.limit, force=args.force, concurrency=args.concurrency,
+         submit=None if args.submit == 'none' else args.submit,
+         max_saves=args.max_saves, save_interval=args.save_interval,
+         availability_url=args.availability_url, save_url=args.save_url,
+         db_url=args.db)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+## Full-text search over stored page text and profile descriptions (SQLite FTS5)
+## filename: run_search.py
+
+import json
+import time
+import logging
+
+from db import get_engine
+from search_index import SearchIndex, KINDS, PAGES, PROFILES
+
+logger = logging.getLogger("search")
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+)
+
+
+def print_hits(hits, seconds):
+    for hit in hits:
+        if hit['kind'] == 'page':
+            urls = hit['urls']
+            where = (f"{urls[0]['url']} ({urls[0]['profile']})" if urls
+                     else hit['content_hash'][:12])
+            if len(urls) > 1:
+                where += f", +{len(urls) - 1} more"
+        else:
+            where = f"{hit['name']} <{hit['profile_url']}>"
+        print(f"[{hit['kind']}] {hit['score']:7.2f}  {where}")
+        print(f"    {hit['snippet']}")
+    print(f"{len(hits)} hits in {seconds * 1000:.1f} ms")
+
+
+def main(query=None, db_url="sqlite:///hrd.db", build=False, rebuild=False,
+         sync=False, drop=False, kinds=KINDS, limit=10, raw=False,
+         as_json=False):
+    index = SearchIndex(get_engine(db_url, echo=False))
+    if drop:
+        index.drop()
+        logger.info("Search index dropped")
+        return
+    if rebuild:
+        logger.info("Search index rebuilt: %s", index.rebuild())
+    elif build or (sync and not index.exists()):
+        logger.info("Search index built: %s", index.create())
+    elif sync:
+        logger.info("Search index synced: %s", index.sync())
+    if not query:
+        return
+    if not index.exists():
+        raise SystemExit("No search index yet; run with --build first")
+
+    start = time.perf_counter()
+    try:
+        hits = index.search(query, kinds=kinds, limit=limit, raw=raw)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    seconds = time.perf_counter() - start
+    if as_json:
+        print(json.dumps(hits, ensure_ascii=False, indent=2))
+    else:
+        print_hits(hits, seconds)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    p = argparse.ArgumentParser(description="Search stored pages and profiles")
+    p.add_argument("query", nargs="?", default=None,
+                   help="Words that must all occur (a trailing * matches a "
+                        "prefix)")
+    p.add_argument("--db", default="sqlite:///hrd.db", help="Database URL")
+    p.add_argument("--build", action="store_true",
+                   help="Create the index (and its triggers) and fill it")
+    p.add_argument("--rebuild", action="store_true",
+                   help="Drop and re-create the index from scratch")
+    p.add_argument("--sync", action="store_true",
+                   help="Index pages stored since the last sync")
+    p.add_argument("--drop", action="store_true",
+                   help="Remove the index and its triggers")
+    p.add_argument("--pages", action="store_true",
+                   help="Search page text only")
+    p.add_argument("--profiles", action="store_true",
+                   help="Search profile names and descriptions only")
+    p.add_argument("--limit", type=int, default=10,
+                   help="Max hits per kind (default 10)")
+    p.add_argument("--raw", action="store_true",
+                   help="Treat the query as FTS5 syntax (OR, NEAR, "
+                        "\"phrases\", column filters)")
+    p.add_argument("--json", action="store_true",
+                   help="Print hits as JSON")
+    args = p.parse_args()
+
+    kinds = [k for k, on in ((PAGES, args.pages), (PROFILES, args.profiles))
+             if on] or KINDS
+    main(args.query, db_url=args.db, build=args.build, rebuild=args.rebuild,
+         sync=args.sync, drop=args.drop, kinds=kinds, limit=args.limit,
+         raw=args.raw, as_json=args.json)
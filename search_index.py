@@ -0,0 +1,256 @@
+# file: search_index.py
+
+import re
+import logging
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+
+from db import decompress_text
+
+logger = logging.getLogger(__name__)
+
+PAGES, PROFILES = 'pages', 'profiles'
+KINDS = (PAGES, PROFILES)
+# Accents folded, so 'Perez' finds 'Pérez'
+TOKENIZE = "unicode61 remove_diacritics 2"
+SNIPPET_TOKENS = 16
+_TERM = re.compile(r'\S+')
+
+# Profiles: external-content table over profiles.name/description_text,
+# kept current by triggers (ON CONFLICT DO UPDATE fires them too)
+_PROFILE_DDL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS profile_fts USING fts5(
+        name, description_text, content='profiles',
+        content_rowid='profile_id', tokenize='{TOKENIZE}')""",
+    """CREATE TRIGGER IF NOT EXISTS profile_fts_ai AFTER INSERT ON profiles BEGIN
+        INSERT INTO profile_fts(rowid, name, description_text)
+        VALUES (new.profile_id, new.name, new.description_text);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS profile_fts_ad AFTER DELETE ON profiles BEGIN
+        INSERT INTO profile_fts(profile_fts, rowid, name, description_text)
+        VALUES ('delete', old.profile_id, old.name, old.description_text);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS profile_fts_au
+    AFTER UPDATE OF name, description_text ON profiles BEGIN
+        INSERT INTO profile_fts(profile_fts, rowid, name, description_text)
+        VALUES ('delete', old.profile_id, old.name, old.description_text);
+        INSERT INTO profile_fts(rowid, name, description_text)
+        VALUES (new.profile_id, new.name, new.description_text);
+    END""",
+]
+# Pages: bodies are compressed in page_content, which SQL cannot read, so
+# the text is copied in by sync(); page_fts_docs maps content hashes to the
+# FTS rowids (page_content's own rowids are not stable across VACUUM)
+_PAGE_DDL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS page_fts USING fts5(
+        body, tokenize='{TOKENIZE}')""",
+    """CREATE TABLE IF NOT EXISTS page_fts_docs (
+        doc_id       INTEGER PRIMARY KEY,
+        content_hash VARCHAR(64) NOT NULL UNIQUE)""",
+]
+_DROP = [
+    "DROP TRIGGER IF EXISTS profile_fts_ai",
+    "DROP TRIGGER IF EXISTS profile_fts_ad",
+    "DROP TRIGGER IF EXISTS profile_fts_au",
+    "DROP TABLE IF EXISTS profile_fts",
+    "DROP TABLE IF EXISTS page_fts",
+    "DROP TABLE IF EXISTS page_fts_docs",
+]
+
+
+def match_query(query: str) -> str:
+    """
+    FTS5 MATCH expression for plain search words: every word must occur,
+    punctuation is taken literally ('anti-mining', 'S.A.') and a trailing
+    * keeps prefix search ('minin*').
+    """
+    terms = []
+    for term in _TERM.findall(query):
+        prefix = term.endswith('*') and len(term) > 1
+        term = term.rstrip('*') if prefix else term
+        terms.append('"' + term.replace('"', '""') + '"' + ('*' if prefix else ''))
+    return ' '.join(terms)
+
+
+class SearchIndex:
+    def __init__(self, engine: Engine):
+        """
+        Optional SQLite FTS5 index over stored page text (page_content) and
+        profile names and descriptions.
+
+        Profiles are indexed by triggers as they are written. Pages are
+        added by sync(); run_phase2.py calls it after validation once the
+        index exists. Nothing is created until create() is called.
+
+        Args:
+            engine (Engine): SQLite engine of the database to index.
+
+        Raises:
+            RuntimeError: The engine is not SQLite.
+        """
+        if engine.dialect.name != 'sqlite':
+            raise RuntimeError("Full-text search needs a SQLite database "
+                               f"(got {engine.dialect.name})")
+        self.engine = engine
+
+    def exists(self) -> bool:
+        with self.engine.connect() as conn:
+            found = conn.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE name = 'page_fts'")).first()
+        return found is not None
+
+    def create(self) -> Dict[str, int]:
+        """
+        Create the index (if missing) and fill it.
+
+        Raises:
+            RuntimeError: This SQLite build has no FTS5.
+        """
+        with self.engine.begin() as conn:
+            options = {r[0] for r in conn.exec_driver_sql(
+                "PRAGMA compile_options")}
+            if 'ENABLE_FTS5' not in options:
+                raise RuntimeError("This SQLite build has no FTS5")
+            for ddl in _PROFILE_DDL + _PAGE_DDL:
+                conn.exec_driver_sql(ddl)
+            conn.exec_driver_sql(
+                "INSERT INTO profile_fts(profile_fts) VALUES ('rebuild')")
+        return self.sync()
+
+    def drop(self):
+        with self.engine.begin() as conn:
+            for ddl in _DROP:
+                conn.exec_driver_sql(ddl)
+
+    def rebuild(self) -> Dict[str, int]:
+        """Drop and re-create the index from scratch."""
+        self.drop()
+        return self.create()
+
+    def sync(self, chunk_size: int = 200) -> Dict[str, int]:
+        """
+        Index pages stored since the last sync and forget deleted ones.
+
+        Page bodies are immutable (keyed by their hash), so only new hashes
+        are read and decompressed, `chunk_size` per transaction.
+
+        Returns:
+            Dict[str, int]: {'added', 'removed', 'profiles'} counts.
+        """
+        with self.engine.begin() as conn:
+            removed = conn.exec_driver_sql(
+                "SELECT doc_id FROM page_fts_docs WHERE content_hash NOT IN "
+                "(SELECT content_hash FROM page_content)").scalars().all()
+            for i in range(0, len(removed), 500):
+                ids = ','.join(str(int(d)) for d in removed[i:i + 500])
+                conn.exec_driver_sql(f"DELETE FROM page_fts WHERE rowid IN ({ids})")
+                conn.exec_driver_sql(
+                    f"DELETE FROM page_fts_docs WHERE doc_id IN ({ids})")
+
+        added = 0
+        while True:
+            with self.engine.begin() as conn:
+                rows = conn.execute(text(
+                    "SELECT pc.content_hash, pc.codec, pc.body "
+                    "FROM page_content pc WHERE NOT EXISTS ("
+                    "  SELECT 1 FROM page_fts_docs d "
+                    "  WHERE d.content_hash = pc.content_hash) "
+                    "LIMIT :n"), {'n': max(1, chunk_size)}).all()
+                if not rows:
+                    break
+                for content_hash, codec, body in rows:
+                    doc_id = conn.execute(text(
+                        "INSERT INTO page_fts_docs(content_hash) VALUES (:h)"),
+                        {'h': content_hash}).lastrowid
+                    conn.execute(text(
+                        "INSERT INTO page_fts(rowid, body) VALUES (:id, :body)"),
+                        {'id': doc_id, 'body': decompress_text(codec, body)})
+                added += len(rows)
+
+        with self.engine.connect() as conn:
+            profiles = conn.exec_driver_sql(
+                "SELECT count(*) FROM profile_fts").scalar()
+        if added or removed:
+            logger.info("Search index: %d pages added, %d removed",
+                        added, len(removed))
+        return {'added': added, 'removed': len(removed), 'profiles': profiles}
+
+    def search(self, query: str, kinds: Iterable[str] = KINDS,
+               limit: int = 10, raw: bool = False) -> List[Dict[str, Any]]:
+        """
+        Ranked search (BM25) with highlighted snippets.
+
+        Args:
+            query (str): Words that must all occur; see match_query(). With
+                raw=True, an FTS5 query ('"human rights" NEAR mine*', OR, ...).
+            kinds (Iterable[str]): 'pages' and/or 'profiles'.
+            limit (int): Max hits per kind.
+            raw (bool): Pass `query` to FTS5 unchanged.
+
+        Returns:
+            List[Dict[str, Any]]: Hits, best first. Every hit has 'kind',
+            'score' (higher is better) and 'snippet' (matches in [brackets]).
+            Page hits add 'content_hash' and 'urls' (url, profile name of
+            each link to the page); profile hits add 'profile_id', 'name'
+            and 'profile_url'.
+
+        Raises:
+            ValueError: The query is not valid FTS5 syntax.
+        """
+        expr = query if raw else match_query(query)
+        if not expr.strip():
+            return []
+        hits: List[Dict[str, Any]] = []
+        try:
+            with self.engine.connect() as conn:
+                if PAGES in kinds:
+                    hits += self._search_pages(conn, expr, limit)
+                if PROFILES in kinds:
+                    hits += self._search_profiles(conn, expr, limit)
+        except OperationalError as e:
+            # FTS5 reports query errors as OperationalError too
+            if 'no such table' in str(e.orig):
+                raise
+            raise ValueError(f"Bad search query {expr!r}: {e.orig}")
+        hits.sort(key=lambda h: h['score'], reverse=True)
+        return hits
+
+    @staticmethod
+    def _search_pages(conn, expr: str, limit: int) -> List[Dict[str, Any]]:
+        rows = conn.execute(text(
+            "SELECT d.content_hash, f.rank, "
+            f"snippet(page_fts, 0, '[', ']', '…', {SNIPPET_TOKENS}) "
+            "FROM page_fts f JOIN page_fts_docs d ON d.doc_id = f.rowid "
+            "WHERE page_fts MATCH :q ORDER BY f.rank LIMIT :n"),
+            {'q': expr, 'n': limit}).all()
+        if not rows:
+            return []
+        links: Dict[str, List[Dict[str, Optional[str]]]] = {}
+        hashes = [r[0] for r in rows]
+        params = {f'h{i}': h for i, h in enumerate(hashes)}
+        for page_hash, url, name in conn.execute(text(
+                "SELECT u.page_hash, u.url, p.name FROM urls u "
+                "JOIN profiles p ON p.profile_id = u.profile_id "
+                f"WHERE u.page_hash IN ({','.join(':' + k for k in params)}) "
+                "ORDER BY u.url_id"), params):
+            links.setdefault(page_hash, []).append({'url': url, 'profile': name})
+        return [{'kind': 'page', 'score': round(-rank, 6), 'snippet': snippet,
+                 'content_hash': content_hash,
+                 'urls': links.get(content_hash, [])}
+                for content_hash, rank, snippet in rows]
+
+    @staticmethod
+    def _search_profiles(conn, expr: str, limit: int) -> List[Dict[str, Any]]:
+        rows = conn.execute(text(
+            "SELECT p.profile_id, p.name, p.profile_url, f.rank, "
+            f"snippet(profile_fts, -1, '[', ']', '…', {SNIPPET_TOKENS}) "
+            "FROM profile_fts f JOIN profiles p ON p.profile_id = f.rowid "
+            "WHERE profile_fts MATCH :q ORDER BY f.rank LIMIT :n"),
+            {'q': expr, 'n': limit}).all()
+        return [{'kind': 'profile', 'score': round(-rank, 6),
+                 'snippet': snippet, 'profile_id': profile_id, 'name': name,
+                 'profile_url': profile_url}
+                for profile_id, name, profile_url, rank, snippet in rows]
@@ -0,0 +1,173 @@
+# file: text_extract.py
+
+import logging
+from html.parser import HTMLParser
+from typing import Iterable, List, Optional
+
+try:
+    from lxml import etree
+except ImportError:       # optional: falls back to html.parser
+    etree = None
+
+logger = logging.getLogger(__name__)
+
+# Elements whose content never counts as page text
+SKIP_TAGS = frozenset({'script', 'style', 'nav', 'noscript', 'template'})
+DEFAULT_MAX_CHARS = 500_000
+
+
+class _TextSink:
+    """
+    Collects visible text and stops once `max_chars` is reached.
+
+    Text events are buffered until the next tag, so a text node split across
+    feed() chunks is not broken in two.
+    """
+
+    FLUSH_AT = 64 * 1024
+
+    def __init__(self, max_chars: Optional[int]):
+        self.max_chars = max_chars
+        self.parts: List[str] = []
+        self.length = 0
+        self.skip_depth = 0
+        self.done = False
+        self._buf: List[str] = []
+        self._buf_len = 0
+
+    def start(self, tag: str, attrib=None):
+        self._flush()
+        if tag.lower() in SKIP_TAGS:
+            self.skip_depth += 1
+
+    def end(self, tag: str):
+        self._flush()
+        if self.skip_depth and tag.lower() in SKIP_TAGS:
+            self.skip_depth -= 1
+
+    def data(self, data: str):
+        if self.skip_depth or self.done:
+            return
+        self._buf.append(data)
+        self._buf_len += len(data)
+        if self._buf_len >= self.FLUSH_AT:
+            # Very long text node: flush whole words, keep the tail buffered
+            text = "".join(self._buf)
+            cut = max(text.rfind(' '), text.rfind('\n'))
+            self._buf, self._buf_len = [], 0
+            if cut > 0:
+                self._emit(text[:cut])
+                text = text[cut:]
+            self._buf.append(text)
+            self._buf_len = len(text)
+
+    def _flush(self):
+        if self._buf:
+            text = "".join(self._buf)
+            self._buf, self._buf_len = [], 0
+            self._emit(text)
+
+    def _emit(self, text: str):
+        if self.done:
+            return
+        words = text.split()
+        if not words:
+            return
+        piece = " ".join(words)
+        self.parts.append(piece)
+        self.length += len(piece) + 1
+        if self.max_chars is not None and self.length >= self.max_chars:
+            self.done = True
+
+    def close(self) -> str:
+        self._flush()
+        text = " ".join(self.parts)
+        if self.max_chars is not None:
+            text = text[:self.max_chars]
+        return text
+
+
+class _StdlibParser(HTMLParser):
+    """html.parser backend forwarding events to a _TextSink."""
+
+    def __init__(self, sink: _TextSink):
+        super().__init__(convert_charrefs=True)
+        self.sink = sink
+
+    def handle_starttag(self, tag, attrs):
+        self.sink.start(tag)
+
+    def handle_endtag(self, tag):
+        self.sink.end(tag)
+
+    def handle_data(self, data):
+        self.sink.data(data)
+
+
+def available_parsers() -> List[str]:
+    return (['lxml'] if etree is not None else []) + ['html.parser']
+
+
+class TextExtractor:
+    def __init__(self, max_chars: Optional[int] = DEFAULT_MAX_CHARS,
+                 parser: str = 'auto'):
+        """
+        Incremental HTML-to-text extraction.
+
+        Feed decoded HTML in chunks as it arrives; script/style/nav content is
+        dropped while parsing and no DOM is built. Once `max_chars` of text
+        have been collected `done` turns True and the caller can stop reading
+        the response.
+
+        Args:
+            max_chars (Optional[int]): Cap on extracted characters; None for
+                no cap.
+            parser (str): 'lxml', 'html.parser' or 'auto' (lxml if installed).
+        """
+        if parser == 'auto':
+            parser = available_parsers()[0]
+        if parser == 'lxml' and etree is None:
+            raise ImportError("parser='lxml' requires the lxml package")
+        if parser not in ('lxml', 'html.parser'):
+            raise ValueError(f"Unknown parser: {parser}")
+
+        self.parser = parser
+        self._sink = _TextSink(max_chars)
+        if parser == 'lxml':
+            self._backend = etree.HTMLParser(target=self._sink)
+        else:
+            self._backend = _StdlibParser(self._sink)
+
+    @property
+    def done(self) -> bool:
+        return self._sink.done
+
+    def feed(self, chunk: str) -> bool:
+        """
+        Parse one chunk of HTML.
+
+        Returns:
+            bool: False once the text cap is reached (stop feeding).
+        """
+        if not self._sink.done and chunk:
+            self._backend.feed(chunk)
+        return not self._sink.done
+
+    def close(self) -> str:
+        """Finish parsing and return the whitespace-normalized text."""
+        try:
+            self._backend.close()
+        except Exception as e:   # truncated or broken markup
+            logger.debug("Parser close failed: %s", e)
+        return self._sink.close()
+
+
+def extract_text(html_chunks: Iterable[str],
+                 max_chars: Optional[int] = DEFAULT_MAX_CHARS,
+                 parser: str = 'auto') -> str:
+    """Extract text from an iterable of HTML chunks (or a one-item list)."""
+    extractor = TextExtractor(max_chars=max_chars, parser=parser)
+    for chunk in html_chunks:
+        if not extractor.feed(chunk):
+            break
+    return extractor.close()
@@ -1,53 +1,151 @@
 # file: text_scraper.py
 
-import time
 import logging
-from typing import List, Dict, Any
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import List, Dict, Any, Optional, Tuple
 
 import requests
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from sqlalchemy.exc import SQLAlchemyError
+from tqdm import tqdm
 
-from db import URL  
+from db import URL, PageContent, store_page
+from batch_writer import BatchWriter
+from politeness import HostScheduler, host_of, interleave_hosts
+from http_client import DEFAULT_MAX_BYTES, is_html, make_session, stream_text
+from text_extract import DEFAULT_MAX_CHARS
+from metrics import Metrics, NULL_METRICS
 
 logger = logging.getLogger(__name__)
 
+
+def _error_class(e: Exception) -> str:
+    """Short class for the report: 'HTTP 404', 'ConnectTimeout', ..."""
+    response = getattr(e, 'response', None)
+    if isinstance(e, requests.HTTPError) and response is not None:
+        return f"HTTP {response.status_code}"
+    return type(e).__name__
+
+
 class TextScraper:
-    def __init__(self, db_session: Session, delay: float = 1.0):
+    def __init__(self, db_session: Session, delay: float = 1.0,
+                 scheduler: Optional[HostScheduler] = None,
+                 max_bytes: int = DEFAULT_MAX_BYTES,
+                 max_chars: Optional[int] = DEFAULT_MAX_CHARS,
+                 parser: str = 'auto',
+                 session: Optional[requests.Session] = None,
+                 concurrency: int = 8,
+                 max_per_host: int = 2,
+                 batch_size: int = 100,
+                 flush_interval: float = 5.0,
+                 metrics: Optional[Metrics] = None):
         """
         Args:
             db_session (Session): Active SQLAlchemy session.
-            delay (float): Delay between HTTP GET requests.
+            delay (float): Minimum interval between GET requests to the same
+                host (used when no scheduler is given).
+            scheduler (Optional[HostScheduler]): Shared per-host politeness.
+            max_bytes (int): Cap on the body bytes read per page.
+            max_chars (Optional[int]): Cap on the text stored per page.
+            parser (str): Text extraction backend; see text_extract.
+            session (Optional[requests.Session]): Shared HTTP client (see
+                http_client.make_session); one keeping `max_per_host`
+                connections per host is built if unset.
+            concurrency (int): Pages fetched at once.
+            max_per_host (int): Pages fetched at once from one host, on top
+                of the scheduler's request spacing.
+            batch_size (int): URL rows loaded per query and results committed
+                per transaction.
+            flush_interval (float): Max seconds a result waits before commit.
+            metrics (Optional[Metrics]): Per-stage timings: 'text.ttfb',
+                'text.download' and 'text.parse' per host, plus 'db.commit'.
         """
         self.db = db_session
         self.delay = delay
+        self.scheduler = scheduler or HostScheduler(min_interval=delay)
+        self.max_bytes = max_bytes
+        self.max_chars = max_chars
+        self.parser = parser
+        self.concurrency = max(1, concurrency)
+        self.max_per_host = max(1, max_per_host)
+        self.batch_size = max(1, batch_size)
+        self.metrics = metrics or NULL_METRICS
+        self.writer = BatchWriter(db_session, batch_size=self.batch_size,
+                                  flush_interval=flush_interval,
+                                  metrics=self.metrics)
+        self.session = session or make_session(
+            pool_maxsize=max(10, self.max_per_host), pool_connections=100)
+        self._host_slots: Dict[str, threading.BoundedSemaphore] = {}
+        self._slots_lock = threading.Lock()
 
     def scrape_all(self, url_ids: List[int]) -> Dict[str, Any]:
         """
         Fetch and store text for multiple URLs.
 
+        Rows are loaded `batch_size` ids at a time with one IN query each;
+        the next batch is loaded once no more than `concurrency` fetches
+        are left, so the workers do not idle between batches. Pages are
+        fetched `concurrency` at a time (interleaved by host, at most
+        `max_per_host` per host) and committed in batches by the writer.
+
         Args:
             url_ids (List[int]): List of URL record primary keys.
 
         Returns:
-            Dict[str, Any]: Summary report.
+            Dict[str, Any]: Summary report: 'total', 'fetched', 'inactive'
+            (not live, not fetched), 'not_html', 'bytes' (body bytes read),
+            'error_counts' (error class -> count) and 'errors' (one entry per
+            failed URL with url_id, url, class and message).
         """
-        report = {"total": len(url_ids), "fetched": 0, "errors": []}
-        for uid in url_ids:
-            try:
-                record = self.db.query(URL).get(uid)
-                if self.scrape_single(record):
-                    report["fetched"] += 1
-                self.db.commit()
-            except (SQLAlchemyError, Exception) as e:
-                self.db.rollback()
-                report["errors"].append({"url_id": uid, "error": str(e)})
-            time.sleep(self.delay)
+        report: Dict[str, Any] = {'total': len(url_ids), 'fetched': 0,
+                                  'inactive': 0, 'not_html': 0, 'bytes': 0,
+                                  'error_counts': {}, 'errors': []}
+        self.writer.failures = []
+        running: Dict[Any, Any] = {}
+
+        def drain(keep: int):
+            while len(running) > keep:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    self._collect(running.pop(fut), fut, report)
+                    progress.update()
+
+        with self.writer, \
+                ThreadPoolExecutor(max_workers=self.concurrency) as pool, \
+                tqdm(total=len(url_ids), desc="Scraping text",
+                     unit="url") as progress:
+            for start in range(0, len(url_ids), self.batch_size):
+                ids = url_ids[start:start + self.batch_size]
+                rows = self.db.execute(
+                    select(URL.url_id, URL.url, URL.is_active)
+                    .where(URL.url_id.in_(ids))).all()
+                for uid in set(ids) - {row.url_id for row in rows}:
+                    self._error(report, uid, None, 'NotFound',
+                                f"No urls row with url_id {uid}")
+                live = [row for row in rows if row.is_active]
+                report['inactive'] += len(rows) - len(live)
+                progress.update(len(ids) - len(live))
+                for row in interleave_hosts(live):
+                    running[pool.submit(self._fetch, row.url)] = row
+                drain(self.concurrency)
+            drain(0)
+
+        # Pages whose batched write failed after being fetched
+        for failure in self.writer.failures:
+            report['fetched'] -= 1
+            self._error(report, None, failure['key'], 'WriteError',
+                        failure['error'])
+        logger.info("Text scrape: %s", {k: v for k, v in report.items()
+                                        if k != 'errors'})
         return report
 
     def scrape_single(self, record: URL) -> bool:
         """
-        Fetch the HTML/text of a live URL and store it.
+        Fetch a live URL and store its visible text.
+
+        Unlike scrape_all() the text goes through the record's session right
+        away; the caller commits.
 
         Args:
             record (URL): URL ORM instance with `url` and `is_active`.
@@ -58,11 +156,77 @@ class TextScraper:
         if not record.is_active:
             return False
         try:
-            response = requests.get(record.url, timeout=15)
-            response.raise_for_status()
-            record.page_text = response.text
-            self.db.add(record)
-            return True
+            text, _ = self._fetch(record.url)
         except requests.RequestException as e:
             logger.warning(f"Text fetch failed for {record.url}: {e}")
             return False
+        if text is None:
+            return False
+        record.page_hash = store_page(self.db, text)
+        self.db.add(record)
+        return True
+
+    def _fetch(self, url: str) -> Tuple[Optional[str], int]:
+        """
+        GET `url` and extract its text, reading at most `max_bytes`. Runs on
+        worker threads; no database access.
+
+        Returns:
+            Tuple[Optional[str], int]: (text, body bytes read); text is None
+            for non-HTML responses.
+
+        Raises:
+            requests.RequestException: The request failed or returned >= 400.
+        """
+        host = host_of(url)
+        with self._host_slot(host):
+            response = self.scheduler.request(self.session.get, url,
+                                              stream=True)
+            self.metrics.observe('text.ttfb',
+                                 response.elapsed.total_seconds(), host)
+            with response:
+                response.raise_for_status()
+                if not is_html(response.headers.get('Content-Type', '')):
+                    return None, 0
+                timings: Dict[str, float] = {}
+                text, nbytes = stream_text(response, self.max_bytes,
+                                           self.max_chars, self.parser,
+                                           timings=timings)
+        self.metrics.observe('text.download', timings['download'], host)
+        self.metrics.observe('text.parse', timings['parse'], host)
+        return text, nbytes
+
+    def _host_slot(self, host: str) -> threading.BoundedSemaphore:
+        with self._slots_lock:
+            slot = self._host_slots.get(host)
+            if slot is None:
+                slot = self._host_slots[host] = threading.BoundedSemaphore(
+                    self.max_per_host)
+            return slot
+
+    def _collect(self, row: Any, fut, report: Dict[str, Any]):
+        """Account for one finished fetch and queue its text for writing."""
+        try:
+            text, nbytes = fut.result()
+        except Exception as e:
+            logger.warning(f"Text fetch failed for {row.url}: {e}")
+            self._error(report, row.url_id, row.url, _error_class(e), str(e))
+            return
+        report['bytes'] += nbytes
+        if text is None:
+            report['not_html'] += 1
+            return
+        page = PageContent.row_for(text)
+        self.writer.insert_ignore(PageContent, page, key=row.url)
+        self.writer.update(URL, {'url_id': row.url_id,
+                                 'page_hash': page['content_hash']},
+                           key=row.url)
+        report['fetched'] += 1
+
+    @staticmethod
+    def _error(report: Dict[str, Any], url_id: Optional[int],
+               url: Optional[str], error_class: str, message: str):
+        counts = report['error_counts']
+        counts[error_class] = counts.get(error_class, 0) + 1
+        report['errors'].append({'url_id': url_id, 'url': url,
+                                 'class': error_class, 'error': message})
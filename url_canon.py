@@ -0,0 +1,56 @@
+# file: url_canon.py
+
+import re
+from typing import Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Query parameters that only track the click, never select the content
+TRACKING_PARAMS = frozenset({
+    'fbclid', 'gclid', 'dclid', 'msclkid', 'yclid', 'igshid', 'mc_cid',
+    'mc_eid', '_ga', '_gl', 'ref_src', 'ref_url', 'cmpid', 'share',
+})
+TRACKING_PREFIXES = ('utm_', 'pk_', 'hsa_', 'vero_', 'oly_')
+_DEFAULT_PORTS = {'http': 80, 'https': 443}
+_MULTI_SLASH = re.compile(r'/{2,}')
+
+
+def _is_tracking(param: str) -> bool:
+    param = param.lower()
+    return param in TRACKING_PARAMS or param.startswith(TRACKING_PREFIXES)
+
+
+def canonical_url(url: Optional[str]) -> Optional[str]:
+    """
+    Key under which links to the same page compare equal.
+
+    http and https fold to https, host and scheme are lower-cased, default
+    ports, fragments, tracking parameters (utm_*, fbclid, ...) and trailing
+    slashes are dropped, and the remaining query parameters are sorted.
+    Path case and percent-encoding are kept: servers may treat them as
+    significant. Non-http(s) links are returned stripped but otherwise as is.
+
+    The key is for grouping; fetch one of the group's original URLs, since
+    a site may not serve https.
+    """
+    if url is None:
+        return None
+    url = url.strip()
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return url
+    scheme = parts.scheme.lower()
+    if scheme not in _DEFAULT_PORTS or not parts.hostname:
+        return url
+
+    host = parts.hostname.rstrip('.')
+    if ':' in host:                       # IPv6 literal
+        host = f'[{host}]'
+    if port is not None and port != _DEFAULT_PORTS[scheme]:
+        host = f'{host}:{port}'
+    path = _MULTI_SLASH.sub('/', parts.path).rstrip('/') or '/'
+    query = urlencode(sorted((k, v) for k, v in
+                             parse_qsl(parts.query, keep_blank_values=True)
+                             if not _is_tracking(k)))
+    return urlunsplit(('https', host, path, query, ''))
@@ -1,98 +1,203 @@
-import time
+import re
 import logging
-from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import List, Optional, Set
 
 import requests
 from bs4 import BeautifulSoup
+from sqlalchemy import update
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError
 
-from db import URL, Profile
+from db import Profile, ProfileLink, insert_ignore
+from politeness import HostScheduler, host_of
+from http_client import make_session
+from metrics import Metrics, NULL_METRICS
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
+_PAGE_NUMBER = re.compile(r'/page/(\d+)/?')
+
+
 class URLCollector:
     def __init__(self,
                  base_url: str,
                  db_session: Session,
                  delay: float = 2.0,
                  start_page: int = 1,
-                 max_pages: Optional[int] = 20):  ## Max number of profiles to be collected, set to None for no limit
+                 max_pages: Optional[int] = 20,  ## Max number of profiles to be collected, set to None for no limit
+                 scheduler: Optional[HostScheduler] = None,
+                 incremental: bool = False,
+                 parallel: bool = False,
+                 workers: int = 4,
+                 session: Optional[requests.Session] = None,
+                 metrics: Optional[Metrics] = None):
         """
         Crawl paginated listing pages to collect profile URLs.
 
+        Every collected URL is recorded in the profile_links table.
+
         Args:
             base_url (str): Root listing page URL.
             db_session (Session): Active SQLAlchemy session.
-            delay (float): Delay between requests.
+            delay (float): Minimum interval between requests to the same host
+                (used when no scheduler is given).
             start_page (int): Page number to start/resume.
             max_pages (Optional[int]): Optional limit to number of pages. None for no limit.
+            scheduler (Optional[HostScheduler]): Shared per-host politeness.
+            incremental (bool): Stop at the first page whose profiles are all
+                already saved, and return only profile URLs not saved yet.
+            parallel (bool): Read the last page number from the pagination and
+                fetch listing pages concurrently (ignored when incremental).
+            workers (int): Concurrent listing fetches when parallel.
+            session (Optional[requests.Session]): Shared HTTP client (see
+                http_client.make_session).
+            metrics (Optional[Metrics]): Per-stage timings: 'collect.ttfb',
+                'collect.fetch', 'collect.parse' and 'db.commit'.
         """
         self.base_url = base_url.rstrip('/')
         self.delay = delay
         self.start_page = start_page
         self.max_pages = max_pages
         self.db = db_session
+        self.scheduler = scheduler or HostScheduler(min_interval=delay)
+        self.incremental = incremental
+        self.parallel = parallel
+        self.workers = max(1, workers)
+        self.metrics = metrics or NULL_METRICS
+        self._last_page = 1    # read from the pagination of the first page
 
-        # Use a Session and set a browser-like User-Agent to avoid 403s
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': (
-                'Mozilla/5.0 (Windows NT 10.0; Win64; x64) '
-                'AppleWebKit/537.36 (KHTML, like Gecko) '
-                'Chrome/114.0.0.0 Safari/537.36'
-            )
-        })
+        # Pooled session with a browser-like User-Agent to avoid 403s
+        self.session = session or make_session(pool_maxsize=self.workers)
 
     def collect(self) -> List[str]:
+        if self.parallel and not self.incremental:
+            return self._collect_parallel()
+
         page = self.start_page
         collected: List[str] = []
+        seen: Set[str] = set()
+        known = self._known_urls() if self.incremental else set()
 
         while True:
             if self.max_pages and page > self.max_pages:
                 logger.info("Reached max_pages limit: %s", self.max_pages)
                 break
 
-            url = (
-                f"{self.base_url}/page/{page}/"
-                if page > 1 else f"{self.base_url}/"
-            )
-
-            try:
-                resp = self.session.get(url, timeout=10)
-                if resp.status_code == 404:
-                    logger.info("No more pages: %s returned 404", url)
-                    break
-                resp.raise_for_status()
-            except requests.RequestException as e:
-                logger.error("Error fetching page %s: %s", page, e)
+            hrefs = self._fetch_page(page)
+            if hrefs is None:
                 break
 
-            soup = BeautifulSoup(resp.text, 'html.parser')
-            links = soup.select('div.hrd-listing a[href]')
-            if not links:
-                logger.info("No listing links found on page %s", page)
+            new = [h for h in hrefs if h not in seen and h not in known]
+            seen.update(new)
+            collected.extend(new)
+            self._record(hrefs)
+            logger.info("Page %s: collected %d new URLs", page, len(new))
+
+            if self.incremental and not new:
+                logger.info("Page %s holds only known profiles; stopping", page)
                 break
+            page += 1
 
-            new_count = 0
-            for a in links:
-                href = a['href']
-                if '/hrdrecord/' in href and href not in collected:
-                    collected.append(href)
-                    new_count += 1
+        return collected
 
-                    # Example DB upsert stub:
-                    # try:
-                    #     obj = URL(profile_url=href)
-                    #     self.db.add(obj)
-                    #     self.db.commit()
-                    # except SQLAlchemyError:
-                    #     self.db.rollback()
+    def _collect_parallel(self) -> List[str]:
+        """Fetch all listing pages concurrently under the host's politeness."""
+        first = self._fetch_page(self.start_page)
+        if first is None:
+            return []
+        last = max(self.start_page, self._last_page)
+        if self.max_pages:
+            last = min(last, self.max_pages)
+        logger.info("Fetching listing pages %d-%d with %d workers",
+                    self.start_page + 1, last, self.workers)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            pages = [first] + list(pool.map(self._fetch_page,
+                                            range(self.start_page + 1, last + 1)))
 
-            logger.info("Page %s: collected %d new URLs", page, new_count)
+        collected: List[str] = []
+        seen: Set[str] = set()
+        for hrefs in pages:
+            for href in hrefs or []:
+                if href not in seen:
+                    seen.add(href)
+                    collected.append(href)
+        self._record(collected)
+        logger.info("Collected %d URLs from %d pages", len(collected), len(pages))
+        return collected
 
-            page += 1
-            time.sleep(self.delay)
+    def _page_url(self, page: int) -> str:
+        return (
+            f"{self.base_url}/page/{page}/"
+            if page > 1 else f"{self.base_url}/"
+        )
 
-        return collected
+    def _fetch_page(self, page: int) -> Optional[List[str]]:
+        """
+        Fetch one listing page and return its profile links in page order,
+        or None when there is no such page (404, error or empty listing).
+        """
+        url = self._page_url(page)
+        host = host_of(url)
+        try:
+            send = self.metrics.timed(self.session.get, 'collect.fetch', host)
+            resp = self.scheduler.request(send, url)
+            self.metrics.observe('collect.ttfb', resp.elapsed.total_seconds(),
+                                 host)
+            if resp.status_code == 404:
+                logger.info("No more pages: %s returned 404", url)
+                return None
+            resp.raise_for_status()
+        except requests.RequestException as e:
+            logger.error("Error fetching page %s: %s", page, e)
+            return None
+
+        with self.metrics.timer('collect.parse', host):
+            soup = BeautifulSoup(resp.text, 'html.parser')
+            if page == self.start_page:
+                self._last_page = self._read_last_page(soup)
+            links = soup.select('div.hrd-listing a[href]')
+        if not links:
+            logger.info("No listing links found on page %s", page)
+            return None
+
+        # dict keeps page order and drops repeats in O(1)
+        hrefs = dict.fromkeys(a['href'] for a in links
+                              if '/hrdrecord/' in a['href'])
+        return list(hrefs)
+
+    @staticmethod
+    def _read_last_page(soup: BeautifulSoup) -> int:
+        """Highest page number linked from the pagination block."""
+        last = 1
+        for a in soup.select('a.page-numbers[href]'):
+            m = _PAGE_NUMBER.search(a['href'])
+            if m:
+                last = max(last, int(m.group(1)))
+        return last
+
+    def _known_urls(self) -> Set[str]:
+        # Only saved profiles: a link seen on the listing but never scraped
+        # (fetch error, interrupted run) must be collected again
+        return {u for (u,) in self.db.query(Profile.profile_url)}
+
+    def _record(self, hrefs: List[str]):
+        """Remember listing links in profile_links."""
+        if not hrefs:
+            return
+        now = datetime.utcnow()
+        try:
+            with self.metrics.timer('db.commit'):
+                insert_ignore(self.db, ProfileLink,
+                              [{'url': h, 'first_seen': now, 'last_seen': now}
+                               for h in hrefs])
+                self.db.execute(update(ProfileLink)
+                                .where(ProfileLink.url.in_(hrefs))
+                                .values(last_seen=now))
+                self.db.commit()
+        except SQLAlchemyError as e:
+            logger.error("Could not record listing links: %s", e)
+            self.db.rollback()
@@ -0,0 +1,250 @@
+# file: wayback_archiver.py
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+from urllib.parse import urljoin
+
+import requests
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+from tqdm import tqdm
+
+from db import URL
+from batch_writer import BatchWriter
+from http_client import make_session
+from politeness import HostScheduler
+
+logger = logging.getLogger(__name__)
+
+AVAILABILITY_URL = 'https://archive.org/wayback/available'
+SAVE_URL = 'https://web.archive.org/save/'
+SAVE_TIMEOUT = (5.0, 120.0)    # Save Page Now can take a minute to answer
+
+SUBMIT_INACTIVE, SUBMIT_ACTIVE, SUBMIT_ALL = 'inactive', 'active', 'all'
+
+
+class WaybackArchiver:
+    def __init__(self, db_session: Session,
+                 availability_url: str = AVAILABILITY_URL,
+                 save_url: str = SAVE_URL,
+                 concurrency: int = 8,
+                 lookup_rate: float = 10.0,
+                 save_interval: float = 10.0,
+                 save_workers: int = 2,
+                 max_age_days: Optional[float] = 30.0,
+                 session: Optional[requests.Session] = None,
+                 batch_size: int = 100):
+        """
+        Phase III: find Wayback Machine snapshots for cited URLs and submit
+        missing ones to Save Page Now (SPN).
+
+        Availability lookups run `concurrency` at a time, rate-limited to
+        `lookup_rate` requests/sec on the availability host; each distinct URL
+        is looked up once per archiver and results are kept on the urls row
+        (is_archived, archived_url, archive_checked_at) so later runs skip
+        URLs checked within `max_age_days`. Submissions go through a separate
+        queue allowing one SPN request every `save_interval` seconds.
+
+        Args:
+            db_session (Session): Active SQLAlchemy session.
+            availability_url (str): Wayback availability API endpoint.
+            save_url (str): Save Page Now prefix; the target URL is appended.
+            concurrency (int): Concurrent availability lookups.
+            lookup_rate (float): Max availability requests per second.
+            save_interval (float): Min seconds between two SPN submissions.
+            save_workers (int): SPN submissions in flight at once.
+            max_age_days (Optional[float]): Re-check lookups older than this;
+                None never re-checks.
+            session (Optional[requests.Session]): Shared HTTP client (see
+                http_client.make_session).
+            batch_size (int): Results committed per transaction.
+        """
+        self.db = db_session
+        self.availability_url = availability_url
+        self.save_url = save_url
+        self.concurrency = max(1, concurrency)
+        self.save_workers = max(1, save_workers)
+        self.max_age_days = max_age_days
+        self.session = session or make_session(pool_maxsize=self.concurrency)
+        self.lookup_scheduler = HostScheduler(min_interval=0.0, rate=lookup_rate,
+                                              burst=self.concurrency)
+        self.save_scheduler = HostScheduler(min_interval=save_interval)
+        self.writer = BatchWriter(db_session, batch_size=batch_size)
+        self._cache: Dict[str, Optional[str]] = {}
+        self._cache_lock = threading.Lock()
+
+    def lookup(self, url: str) -> Optional[str]:
+        """
+        Closest Wayback snapshot of `url`, cached per archiver.
+
+        Returns:
+            Optional[str]: Snapshot URL, or None if there is none.
+
+        Raises:
+            requests.RequestException: The lookup itself failed (not cached).
+        """
+        with self._cache_lock:
+            if url in self._cache:
+                return self._cache[url]
+        resp = self.lookup_scheduler.request(self.session.get,
+                                             self.availability_url,
+                                             params={'url': url})
+        resp.raise_for_status()
+        try:
+            data = resp.json()
+        except ValueError as e:
+            raise requests.RequestException(f"Bad availability answer: {e}")
+        closest = (data.get('archived_snapshots') or {}).get('closest') or {}
+        snapshot = None
+        if closest.get('available') and str(closest.get('status', '200'))[:1] in '23':
+            snapshot = closest.get('url')
+        with self._cache_lock:
+            self._cache[url] = snapshot
+        return snapshot
+
+    def save(self, url: str) -> Optional[str]:
+        """
+        Submit `url` to Save Page Now.
+
+        Returns:
+            Optional[str]: URL of the new snapshot, or None if SPN did not
+            report one.
+
+        Raises:
+            requests.RequestException: The submission failed.
+        """
+        resp = self.save_scheduler.request(self.session.get, self.save_url + url,
+                                           timeout=SAVE_TIMEOUT)
+        with resp:
+            resp.raise_for_status()
+            location = resp.headers.get('Content-Location')
+            if not location and '/web/' in resp.url:
+                location = resp.url
+        snapshot = urljoin(self.save_url, location) if location else None
+        if snapshot:
+            with self._cache_lock:
+                self._cache[url] = snapshot
+        return snapshot
+
+    def archive_batch(self, limit: Optional[int] = None, force: bool = False,
+                      submit: Optional[str] = SUBMIT_INACTIVE,
+                      max_saves: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Look up snapshots for URLs, then submit the missing ones.
+
+        Args:
+            limit (Optional[int]): Max urls rows to process.
+            force (bool): Ignore earlier lookups and check every URL.
+            submit (Optional[str]): Which URLs without a snapshot to submit:
+                'inactive' (default), 'active', 'all', or None for lookups only.
+            max_saves (Optional[int]): Cap on SPN submissions this run.
+
+        Returns:
+            Dict[str, Any]: Counts of rows checked, archived, missing,
+            submitted and saved, plus lookup and save failures.
+        """
+        rows = self._pending(limit, force)
+        by_url: Dict[str, List[Any]] = {}
+        for row in rows:
+            by_url.setdefault(row.url, []).append(row)
+        report: Dict[str, Any] = {'checked': 0, 'archived': 0, 'missing': 0,
+                                  'submitted': 0, 'saved': 0,
+                                  'failures': []}
+        logger.info("Looking up %d URLs (%d distinct)", len(rows), len(by_url))
+
+        missing: List[str] = []
+        with self.writer:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+                futures = {pool.submit(self.lookup, url): url for url in by_url}
+                for fut in tqdm(as_completed(futures), total=len(futures),
+                                desc="Wayback lookups", unit="url"):
+                    url = futures[fut]
+                    try:
+                        snapshot = fut.result()
+                    except requests.RequestException as e:
+                        logger.warning("Lookup failed for %s: %s", url, e)
+                        report['failures'].append({'url': url, 'stage': 'lookup',
+                                                   'error': str(e)})
+                        continue
+                    # New SPN captures can take a while to show up in the
+                    # availability API; keep a snapshot we already know of
+                    snapshot = snapshot or next(
+                        (r.archived_url for r in by_url[url] if r.archived_url),
+                        None)
+                    self._record(by_url[url], snapshot)
+                    report['checked'] += len(by_url[url])
+                    if snapshot:
+                        report['archived'] += len(by_url[url])
+                    else:
+                        report['missing'] += len(by_url[url])
+                        if self._wants_save(by_url[url], submit):
+                            missing.append(url)
+
+            if max_saves is not None:
+                missing = missing[:max_saves]
+            if missing:
+                self._submit(missing, by_url, report)
+
+        for failure in self.writer.failures:
+            report['failures'].append({'url': failure['key'], 'stage': 'write',
+                                       'error': failure['error']})
+        logger.info("Wayback report: %s", {k: v for k, v in report.items()
+                                           if k != 'failures'})
+        return report
+
+    def _pending(self, limit: Optional[int], force: bool) -> List[Any]:
+        q = self.db.query(URL.url_id, URL.url, URL.is_active, URL.archived_url)
+        if not force:
+            q = q.filter(or_(URL.is_archived.isnot(True),
+                             URL.archived_url.is_(None)))
+            if self.max_age_days is not None:
+                cutoff = datetime.utcnow() - timedelta(days=self.max_age_days)
+                q = q.filter(or_(URL.archive_checked_at.is_(None),
+                                 URL.archive_checked_at < cutoff))
+        q = q.order_by(URL.url_id)
+        if limit:
+            q = q.limit(limit)
+        return q.all()
+
+    @staticmethod
+    def _wants_save(rows: List[Any], submit: Optional[str]) -> bool:
+        if submit == SUBMIT_ALL:
+            return True
+        if submit == SUBMIT_INACTIVE:
+            return any(r.is_active is False for r in rows)
+        if submit == SUBMIT_ACTIVE:
+            return any(r.is_active for r in rows)
+        return False
+
+    def _submit(self, urls: List[str], by_url: Dict[str, List[Any]],
+                report: Dict[str, Any]):
+        """Save Page Now queue: `save_workers` at a time, rate-limited."""
+        logger.info("Submitting %d URLs to Save Page Now", len(urls))
+        with ThreadPoolExecutor(max_workers=self.save_workers) as pool:
+            futures = {pool.submit(self.save, url): url for url in urls}
+            for fut in tqdm(as_completed(futures), total=len(futures),
+                            desc="Save Page Now", unit="url"):
+                url = futures[fut]
+                report['submitted'] += 1
+                try:
+                    snapshot = fut.result()
+                except requests.RequestException as e:
+                    logger.warning("Save failed for %s: %s", url, e)
+                    report['failures'].append({'url': url, 'stage': 'save',
+                                               'error': str(e)})
+                    continue
+                if snapshot:
+                    report['saved'] += 1
+                    self._record(by_url[url], snapshot)
+
+    def _record(self, rows: List[Any], snapshot: Optional[str]):
+        now = datetime.utcnow()
+        for row in rows:
+            self.writer.update(URL, {'url_id': row.url_id,
+                                     'is_archived': snapshot is not None,
+                                     'archived_url': snapshot,
+                                     'archive_checked_at': now},
+                               key=row.url)
@@ -0,0 +1,230 @@
+# file: work_queue.py
+
+import os
+import uuid
+import socket
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import (and_, bindparam, exists, func, insert, literal, or_,
+                        select, update)
+from sqlalchemy.orm import Session
+
+from db import Job, _dialect_insert
+from batch_writer import BatchWriter
+
+logger = logging.getLogger(__name__)
+
+PENDING, LEASED, DONE, FAILED = 'pending', 'leased', 'done', 'failed'
+
+
+def default_worker_id() -> str:
+    """host:pid, so leases can be traced back to a process."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class WorkQueue:
+    def __init__(self, db_session: Session, kind: str,
+                 worker_id: Optional[str] = None,
+                 lease_seconds: float = 600.0,
+                 max_attempts: int = 3):
+        """
+        Lease-based work queue on the jobs table, shared by any number of
+        worker processes or machines using the same database.
+
+        claim() hands out up to n pending jobs in one UPDATE that stamps
+        them with a fresh lease token and expiry; SQLite runs the statement
+        under its single writer lock, PostgreSQL selects the rows with
+        FOR UPDATE SKIP LOCKED so concurrent claimers never block on or
+        double-claim a row. Leases that expire (a worker died or hung) are
+        claimed again, up to `max_attempts` times; then the job is failed.
+
+        Args:
+            db_session (Session): Active SQLAlchemy session.
+            kind (str): Kind of work, e.g. 'validate'.
+            worker_id (Optional[str]): Recorded on claimed jobs; host:pid if
+                unset.
+            lease_seconds (float): How long a claim is valid. Should
+                comfortably exceed the time to process one claim.
+            max_attempts (int): Claims per job before it is marked failed.
+        """
+        self.db = db_session
+        self.kind = kind
+        self.worker_id = worker_id or default_worker_id()
+        self.lease = timedelta(seconds=lease_seconds)
+        self.max_attempts = max(1, max_attempts)
+        self._tokens: List[str] = []
+        self._claims: Dict[int, str] = {}     # job_id -> lease token
+
+    def enqueue(self, item_ids) -> int:
+        """
+        Add a job for every item id selected by `item_ids` that has none.
+
+        Safe to run from several workers at once: existing jobs, finished
+        ones included, are left alone (see reset()).
+
+        Args:
+            item_ids: A one-column SELECT of item ids, e.g.
+                select(URL.url_id).where(URL.checked_at.is_(None)).
+
+        Returns:
+            int: Jobs added.
+        """
+        ids = item_ids.subquery()
+        id_col = list(ids.c)[0]
+        now = datetime.utcnow()
+        rows = select(literal(self.kind), id_col, literal(PENDING),
+                      literal(0), literal(now)).where(~exists().where(
+                          Job.kind == self.kind, Job.item_id == id_col))
+        cols = ['kind', 'item_id', 'status', 'attempts', 'created_at']
+        dialect_insert = _dialect_insert(self.db)
+        if dialect_insert is not None:
+            # A worker enqueuing at the same moment may win the race
+            stmt = dialect_insert(Job.__table__).from_select(
+                cols, rows).on_conflict_do_nothing()
+        else:
+            stmt = insert(Job.__table__).from_select(cols, rows)
+        added = self.db.execute(stmt).rowcount or 0
+        self.db.commit()
+        logger.info("Enqueued %d %s jobs", added, self.kind)
+        return added
+
+    def reset(self, item_ids) -> int:
+        """
+        Start a new round over `item_ids`: enqueue missing jobs and put
+        finished (done or failed) ones back to pending.
+
+        Run this once, before the workers start; a worker resetting while
+        others run would hand their finished jobs out again.
+
+        Returns:
+            int: Jobs added or reset.
+        """
+        added = self.enqueue(item_ids)
+        id_col = list(item_ids.subquery().c)[0]
+        reset = self.db.execute(
+            update(Job)
+            .where(Job.kind == self.kind,
+                   Job.status.in_([DONE, FAILED]),
+                   Job.item_id.in_(select(id_col)))
+            .values(status=PENDING, attempts=0, last_error=None,
+                    finished_at=None)
+            .execution_options(synchronize_session=False)).rowcount or 0
+        self.db.commit()
+        logger.info("Reset %d finished %s jobs", reset, self.kind)
+        return added + reset
+
+    def claim(self, n: int) -> Dict[int, int]:
+        """
+        Lease up to `n` jobs: pending ones and ones whose lease expired.
+
+        Returns:
+            Dict[int, int]: item_id -> job_id of the claimed jobs (empty when
+            nothing is left).
+        """
+        now = datetime.utcnow()
+        self.db.commit()    # start the claim in a fresh transaction
+        # Jobs whose lease ran out too often are given up
+        failed = self.db.execute(
+            update(Job)
+            .where(Job.kind == self.kind, Job.status == LEASED,
+                   Job.lease_expires < now, Job.attempts >= self.max_attempts)
+            .values(status=FAILED, lease_token=None, finished_at=now,
+                    last_error=f"lease expired {self.max_attempts} times")
+            .execution_options(synchronize_session=False)).rowcount
+        if failed:
+            logger.warning("Gave up on %d %s jobs after %d expired leases",
+                           failed, self.kind, self.max_attempts)
+
+        claimable = (select(Job.job_id)
+                     .where(Job.kind == self.kind,
+                            or_(Job.status == PENDING,
+                                and_(Job.status == LEASED,
+                                     Job.lease_expires < now)))
+                     .order_by(Job.job_id)
+                     .limit(max(1, n)))
+        if self.db.get_bind().dialect.name == 'postgresql':
+            claimable = claimable.with_for_update(skip_locked=True)
+        token = uuid.uuid4().hex
+        self.db.execute(
+            update(Job)
+            .where(Job.job_id.in_(claimable))
+            .values(status=LEASED, worker=self.worker_id, lease_token=token,
+                    lease_expires=now + self.lease,
+                    attempts=Job.attempts + 1)
+            .execution_options(synchronize_session=False))
+        self.db.commit()
+        claimed = dict(self.db.execute(
+            select(Job.item_id, Job.job_id).where(Job.lease_token == token)).all())
+        if claimed:
+            self._tokens.append(token)
+            self._claims.update((job_id, token) for job_id in claimed.values())
+        return claimed
+
+    def finish(self, writer: BatchWriter, job_id: int, key=None):
+        """Queue the job's completion with the writer, so it commits
+        together with the job's results. Only this worker's lease is
+        completed: if it expired and another worker claimed the job, the
+        job is left to that worker."""
+        writer.bulk(self._finish_jobs, {'b_job_id': job_id,
+                                        'b_token': self._claims.pop(job_id),
+                                        'finished_at': datetime.utcnow()},
+                    key=key)
+
+    def _finish_jobs(self, db: Session, rows: List[Dict]):
+        table = Job.__table__
+        done = db.execute(
+            update(table)
+            .where(table.c.job_id == bindparam('b_job_id'),
+                   table.c.lease_token == bindparam('b_token'),
+                   table.c.status == LEASED)
+            .values(status=DONE, lease_token=None, lease_expires=None),
+            rows).rowcount
+        if done is not None and 0 <= done < len(rows):
+            logger.warning("%d %s jobs were re-claimed after their lease "
+                           "expired; left to the new claimant",
+                           len(rows) - done, self.kind)
+
+    def retry(self, job_ids: Iterable[int], error: str):
+        """Return jobs whose results could not be written to the queue
+        (failed once they have used up `max_attempts`)."""
+        job_ids = list(job_ids)
+        if not job_ids:
+            return
+        now = datetime.utcnow()
+        for status, cond in ((FAILED, Job.attempts >= self.max_attempts),
+                             (PENDING, Job.attempts < self.max_attempts)):
+            self.db.execute(
+                update(Job)
+                .where(Job.job_id.in_(job_ids), cond)
+                .values(status=status, lease_token=None, lease_expires=None,
+                        last_error=error,
+                        finished_at=now if status == FAILED else None)
+                .execution_options(synchronize_session=False))
+        self.db.commit()
+
+    def release(self):
+        """Hand back jobs this queue claimed but did not finish (e.g. on
+        Ctrl-C), without counting the attempt."""
+        if not self._tokens:
+            return
+        self.db.rollback()
+        released = self.db.execute(
+            update(Job)
+            .where(Job.lease_token.in_(self._tokens), Job.status == LEASED)
+            .values(status=PENDING, lease_token=None, lease_expires=None,
+                    attempts=Job.attempts - 1)
+            .execution_options(synchronize_session=False)).rowcount
+        self.db.commit()
+        self._tokens = []
+        self._claims = {}
+        if released:
+            logger.info("Released %d unfinished %s jobs", released, self.kind)
+
+    def stats(self) -> Dict[str, int]:
+        """Job counts by status."""
+        return dict(self.db.execute(
+            select(Job.status, func.count())
+            .where(Job.kind == self.kind)
+            .group_by(Job.status)).all())